@@ -0,0 +1,115 @@
+"""
+Synthetic tracking challenge datasets for the benchmarks.
+
+Each dataset is a 01/ sequence of tNNN.tif frames of bright disks on a
+noisy background, with 01_GT/SEG ground truth labelling the disks on
+every gt_every-th frame. Datasets are written once to a directory under
+the system temp dir and reused by every benchmark and run that asks for
+the same one, since asv runs each benchmark in a fresh process.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from tifffile import imwrite
+
+DATASETS_DIR = os.path.join(tempfile.gettempdir(), "workshop_demo_benchmarks")
+# the disk cache used while benchmarking, so runs never touch the user's
+DISK_CACHE_DIR = os.path.join(DATASETS_DIR, "disk_cache")
+# written last, so a dataset is only reused once it's complete
+COMPLETE_NAME = ".complete"
+# disks per frame, whatever the frame size
+N_OBJECTS = 40
+
+
+def frame_labels(rng, frame_size):
+    """A frame of N_OBJECTS labelled disks, some of them touching"""
+    labels = np.zeros((frame_size, frame_size), dtype=np.uint16)
+    radius = max(2, frame_size // 20)
+    yy, xx = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+    disk = yy ** 2 + xx ** 2 <= radius ** 2
+    for label, (y, x) in enumerate(
+        rng.integers(0, frame_size - 2 * radius - 1, size=(N_OBJECTS, 2)), 1
+    ):
+        window = labels[y : y + 2 * radius + 1, x : x + 2 * radius + 1]
+        window[disk] = label
+    return labels
+
+
+def frame_image(rng, labels):
+    """A noisy 12 bit image of the objects in labels"""
+    image = rng.normal(200, 50, size=labels.shape)
+    image[labels > 0] += 1500
+    return np.clip(image, 0, 2 ** 12 - 1).astype(np.uint16)
+
+
+def make_dataset(n_frames, frame_size, gt_every=1, compression=None):
+    """Path of a synthetic dataset's ground truth, writing the dataset if needed
+
+    Parameters
+    ----------
+    n_frames : int
+        number of frames in the sequence, at most 1000
+    frame_size : int
+        size of each square frame
+    gt_every : int, optional
+        ground truth is written for every gt_every-th frame, by default 1
+    compression : str | None, optional
+        tiff compression codec of every frame, by default None
+
+    Returns
+    -------
+    str
+        path of the dataset's 01_GT/SEG directory, next to its 01 sequence
+    """
+    root = os.path.join(
+        DATASETS_DIR, f"t{n_frames}_s{frame_size}_gt{gt_every}_{compression}"
+    )
+    seq_dir = os.path.join(root, "01")
+    gt_dir = os.path.join(root, "01_GT", "SEG")
+    if os.path.exists(os.path.join(root, COMPLETE_NAME)):
+        return gt_dir
+
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(seq_dir)
+    os.makedirs(gt_dir)
+    rng = np.random.default_rng(0)
+    for t in range(n_frames):
+        labels = frame_labels(rng, frame_size)
+        imwrite(
+            os.path.join(seq_dir, f"t{t:03}.tif"),
+            frame_image(rng, labels),
+            compression=compression,
+        )
+        if t % gt_every == 0:
+            imwrite(
+                os.path.join(gt_dir, f"man_seg{t:03}.tif"),
+                labels,
+                compression=compression,
+            )
+    open(os.path.join(root, COMPLETE_NAME), "w").close()
+    return gt_dir
+
+
+def seq_dir(gt_dir):
+    """Path of the sequence next to the ground truth at gt_dir"""
+    return os.path.join(os.path.dirname(os.path.dirname(gt_dir)), "01")
+
+
+def forget_dataset(gt_dir):
+    """Clear every cache of a dataset, on disk and in memory, for a cold read"""
+    from workshop_demo import _disk_cache, _index
+    from workshop_demo._cache import frame_cache
+    from workshop_demo._threshold import histogram_cache
+
+    for dir_pth in (gt_dir, seq_dir(gt_dir)):
+        try:
+            os.remove(_index.index_path(dir_pth))
+        except OSError:
+            pass
+    _index._INDEX_CACHE.clear()
+    _index._PROBE_CACHE.clear()
+    frame_cache.clear()
+    histogram_cache.clear()
+    _disk_cache.configure(DISK_CACHE_DIR).clear()
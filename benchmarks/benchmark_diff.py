@@ -0,0 +1,34 @@
+"""Benchmarks of classifying segmentation differences, as the diff widget's worker does"""
+import numpy as np
+
+from workshop_demo._diff import DiffFrames
+from workshop_demo._reader import reader_function
+
+from ._datasets import forget_dataset, make_dataset
+
+
+def compute_differences(gt_data, seg_data):
+    """Classify differences, computing every frame into the cache with its summary"""
+    frames = DiffFrames(gt_data, seg_data)
+    frames.compute_frames(range(len(frames)))
+    frames.frame_table()
+
+
+class DiffSuite:
+    params = ([10, 100], [256, 1024], [1, 10])
+    param_names = ["n_frames", "frame_size", "gt_every"]
+    number = 1
+    repeat = (3, 10, 30.0)
+
+    def setup(self, n_frames, frame_size, gt_every):
+        gt_dir = make_dataset(n_frames, frame_size, gt_every)
+        forget_dataset(gt_dir)
+        (_, (self.gt_data, _, _)) = reader_function(gt_dir, multiscale="0")
+        # a segmentation that's off by a pixel everywhere
+        self.seg_data = np.roll(self.gt_data, 1, axis=-1)
+
+    def time_compute_differences(self, *params):
+        compute_differences(self.gt_data, self.seg_data)
+
+    def peakmem_compute_differences(self, *params):
+        compute_differences(self.gt_data, self.seg_data)
@@ -0,0 +1,57 @@
+"""Benchmarks of napari's reader probe, building the reader's layers and viewing frames"""
+import numpy as np
+
+from workshop_demo import napari_get_reader
+from workshop_demo._reader import reader_function
+
+from ._datasets import forget_dataset, make_dataset
+
+# random frames viewed per access benchmark, as when scrubbing through time
+N_FRAMES_VIEWED = 20
+
+
+class ReaderSuite:
+    params = ([10, 100], [256, 1024], [1, 10], [None, "zlib"])
+    param_names = ["n_frames", "frame_size", "gt_every", "compression"]
+    # every timing starts from a cold cache, so setup runs before each one
+    number = 1
+    repeat = (3, 10, 30.0)
+
+    def setup(self, n_frames, frame_size, gt_every, compression):
+        self.gt_dir = make_dataset(n_frames, frame_size, gt_every, compression)
+        forget_dataset(self.gt_dir)
+        rng = np.random.default_rng(0)
+        self.viewed = rng.integers(0, n_frames, size=N_FRAMES_VIEWED)
+
+    def time_probe(self, *params):
+        napari_get_reader(self.gt_dir)
+
+    def time_build_layers(self, *params):
+        reader_function(self.gt_dir, multiscale="0")
+
+    def time_view_random_frames(self, *params):
+        self._view_random_frames()
+
+    def peakmem_view_random_frames(self, *params):
+        self._view_random_frames()
+
+    def _view_random_frames(self):
+        seq_layer, gt_layer = reader_function(self.gt_dir, multiscale="0")
+        for t in self.viewed:
+            np.asarray(seq_layer[0][t])
+            np.asarray(gt_layer[0][t])
+
+
+class WarmProbeSuite:
+    """Probing a dataset that's been opened before, e.g. in an earlier session"""
+
+    params = ([10, 100], [1, 10])
+    param_names = ["n_frames", "gt_every"]
+
+    def setup(self, n_frames, gt_every):
+        self.gt_dir = make_dataset(n_frames, 256, gt_every)
+        forget_dataset(self.gt_dir)
+        reader_function(self.gt_dir, multiscale="0")
+
+    def time_probe(self, *params):
+        napari_get_reader(self.gt_dir)
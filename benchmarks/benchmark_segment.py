@@ -0,0 +1,35 @@
+"""Benchmarks of segmenting a sequence, as segment_by_threshold's worker does"""
+from workshop_demo._frames import CachedFrames
+from workshop_demo._label import Connectivity
+from workshop_demo._reader import reader_function
+from workshop_demo._steps import run_steps
+from workshop_demo._threshold import Threshold, segment_steps
+
+from ._datasets import forget_dataset, make_dataset
+
+
+def segment_layer(data, connectivity):
+    """Segment data and compute every frame of the result into the cache"""
+    frames = CachedFrames(
+        run_steps(segment_steps(data, Threshold.otsu, connectivity=connectivity))
+    )
+    frames.compute_frames(range(len(frames)))
+
+
+class SegmentSuite:
+    params = ([10, 100], [256, 1024], [None, "spacetime"])
+    param_names = ["n_frames", "frame_size", "connectivity"]
+    number = 1
+    repeat = (3, 10, 30.0)
+
+    def setup(self, n_frames, frame_size, connectivity):
+        gt_dir = make_dataset(n_frames, frame_size)
+        forget_dataset(gt_dir)
+        ((self.image, _, _), _) = reader_function(gt_dir, multiscale="0")
+        self.connectivity = connectivity and Connectivity[connectivity]
+
+    def time_segment_by_threshold(self, *params):
+        segment_layer(self.image, self.connectivity)
+
+    def peakmem_segment_by_threshold(self, *params):
+        segment_layer(self.image, self.connectivity)
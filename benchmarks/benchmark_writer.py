@@ -0,0 +1,35 @@
+"""Benchmarks of writing a labels layer to a zip, as the writer's worker does"""
+import os
+import shutil
+import tempfile
+
+from workshop_demo._reader import reader_function
+from workshop_demo._writer import write_tiffs
+
+from ._datasets import forget_dataset, make_dataset
+
+
+class WriterSuite:
+    params = ([10, 100], [256, 1024], [None, "zlib"])
+    param_names = ["n_frames", "frame_size", "compression"]
+    number = 1
+    repeat = (3, 10, 30.0)
+
+    def setup(self, n_frames, frame_size, compression):
+        gt_dir = make_dataset(n_frames, frame_size)
+        forget_dataset(gt_dir)
+        # read from disk end to end, as when saving a layer we opened
+        (_, (self.labels, _, _)) = reader_function(gt_dir, multiscale="0")
+        self.out_dir = tempfile.mkdtemp()
+        self.zip_pth = os.path.join(self.out_dir, "labels.zip")
+
+    def teardown(self, *params):
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+
+    def time_labels_to_zip(self, n_frames, frame_size, compression):
+        for _ in write_tiffs(self.labels, self.zip_pth, compression):
+            pass
+
+    def peakmem_labels_to_zip(self, n_frames, frame_size, compression):
+        for _ in write_tiffs(self.labels, self.zip_pth, compression):
+            pass
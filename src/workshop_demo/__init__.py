@@ -3,9 +3,17 @@ try:
 except ImportError:
     __version__ = "unknown"
 
-from ._dock_widget import SegmentationDiffHighlight, Threshold, segment_by_threshold
-from ._reader import napari_get_reader
-from ._writer import labels_to_zip
+from importlib import import_module
+
+# submodules are only imported when their contributions are first used, so
+# headless use of the package, e.g. the workshop-demo command, never imports Qt
+_LAZY_ATTRIBUTES = {
+    "napari_get_reader": "._reader",
+    "labels_to_zip": "._writer",
+    "segment_by_threshold": "._dock_widget",
+    "SegmentationDiffHighlight": "._dock_widget",
+    "Threshold": "._threshold",
+}
 
 __all__ = [
     "napari_get_reader",
@@ -14,3 +22,15 @@ __all__ = [
     "SegmentationDiffHighlight",
     "Threshold",
 ]
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,263 @@
+"""
+This module indexes tracking challenge frames inside a zip archive, such
+as those written by our writer or downloaded from the challenge website,
+so they can be read lazily without extracting the archive.
+
+Each member is given a virtual path, the archive's path joined with the
+member's name, e.g. /data/Fluo-N2DH-GOWT1.zip/Fluo-N2DH-GOWT1/01/t000.tif,
+so members match the same regexes as frames in a directory, and are
+indexed by the same FrameIndex. Stored (uncompressed) members are read
+with one seek and read of the archive, and those holding uncompressed
+tifs are memory-mapped straight from it. Only deflated members go through
+zipfile's decompression, from one ZipFile kept open per archive, and
+reading their headers only decompresses as far as the tif's header.
+
+Archives written by our writer leave out empty frames, and hold a
+manifest recording the length of the sequence they were written from.
+"""
+import json
+import os
+import re
+import threading
+import zipfile
+from contextlib import contextmanager
+
+from ._constants import GT_TIF_REGEX, MANIFEST_NAME, SEQ_TIF_REGEX
+from ._index import FrameIndex, FrameInfo, header_info
+
+ARCHIVE_SUFFIX = ".zip"
+
+# (archive mtime, indices) of archives we've read this session, keyed by path
+_ARCHIVE_CACHE = {}
+# (archive mtime, ZipFile) of archives we've read deflated members of, keyed by path
+_OPEN_ARCHIVES = {}
+_OPEN_ARCHIVES_LOCK = threading.Lock()
+
+
+class ArchiveFrameIndex(FrameIndex):
+    """FrameIndex of one directory of tifs inside a zip archive.
+
+    The archive's central directory already lists every member, so these
+    indices are never saved next to the dataset.
+
+    Parameters
+    ----------
+    archive : str
+        absolute path of the zip archive
+    *args
+        see FrameIndex, with dir_pth the directory's virtual path
+    sequence_frames : int, optional
+        length of the sequence the frames were written from, if the
+        archive's manifest records it, by default None
+    """
+
+    def __init__(self, archive, *args, sequence_frames=None):
+        super().__init__(*args)
+        self.archive = archive
+        self.sequence_frames = sequence_frames
+
+    @property
+    def store_pth(self):
+        """A real path beside the archive standing in for this directory.
+
+        Data derived from a directory, e.g. its pyramid levels, is saved
+        next to it, which isn't possible inside an archive.
+        """
+        dir_name = self.dir_pth[len(self.archive) + 1 :]
+        return f"{self.archive}.{dir_name.replace('/', '.')}"
+
+    def read_header(self, info):
+        return _read_member_header(info)
+
+    def save(self):
+        pass
+
+
+def member_name(info):
+    """Name of info's frame inside its archive"""
+    return info.path[len(info.archive) + 1 :]
+
+
+def read_member(info):
+    """Read the encoded tif of info's frame from its archive
+
+    Parameters
+    ----------
+    info : FrameInfo
+        index entry of a frame in a zip archive
+
+    Returns
+    -------
+    bytes
+        the member's data
+    """
+    # read here so _export's numpy and tifffile aren't needed to probe archives
+    from ._export import read_stored_member
+
+    if info.member_offset is not None:
+        with open(info.archive, "rb") as file_handle:
+            return read_stored_member(file_handle, info.member_offset)
+    with _open_member(info) as member:
+        return member.read()
+
+
+@contextmanager
+def _open_member(info):
+    """Open info's deflated member, from the one ZipFile we keep open for its archive
+
+    Opening an archive parses its whole central directory, which would
+    otherwise be done again for every frame read. zipfile counts the open
+    members of a ZipFile without a lock, so they're opened and closed under
+    ours, but read in parallel.
+    """
+    with _OPEN_ARCHIVES_LOCK:
+        mtime, zip_file = _OPEN_ARCHIVES.get(info.archive, (None, None))
+        if zip_file is None or mtime != info.mtime:
+            # a replaced ZipFile is closed once the members still being read
+            # from it are done with it
+            zip_file = zipfile.ZipFile(info.archive)
+            _OPEN_ARCHIVES[info.archive] = (info.mtime, zip_file)
+        member = zip_file.open(member_name(info))
+    try:
+        yield member
+    finally:
+        with _OPEN_ARCHIVES_LOCK:
+            member.close()
+
+
+def _read_member_header(info):
+    """Return a copy of info with shape, dtype and offset read from the tif member"""
+    import tifffile
+
+    from ._export import stored_member_span
+
+    if info.member_offset is None:
+        # given its size, tifffile never seeks to the end of the member, so only
+        # as much of it as the header spans is decompressed
+        with _open_member(info) as member:
+            with tifffile.TiffFile(member, size=info.size) as im_tif:
+                return header_info(info, im_tif, data_offset=None)
+
+    # tifffile reads just the header of a tif embedded in a larger file
+    with open(info.archive, "rb") as file_handle:
+        data_offset, size = stored_member_span(file_handle, info.member_offset)
+        with tifffile.TiffFile(file_handle, offset=data_offset, size=size) as im_tif:
+            return header_info(info, im_tif, data_offset=data_offset)
+
+
+def index_archive(zip_pth, zip_mtime):
+    """Index the members of zip_pth that are tracking challenge frames.
+
+    Members are matched against GT_TIF_REGEX and SEQ_TIF_REGEX and
+    grouped by the directory they're in. Every other member is ignored.
+
+    Parameters
+    ----------
+    zip_pth : str
+        absolute path of the zip archive
+    zip_mtime : float
+        modification time of zip_pth
+
+    Returns
+    -------
+    Dict[str, ArchiveFrameIndex]
+        virtual directory path to the index of its frames
+    """
+    tif_patterns = [re.compile(regex) for regex in (GT_TIF_REGEX, SEQ_TIF_REGEX)]
+    dir_frames = {}
+    with zipfile.ZipFile(zip_pth) as zip_file:
+        manifest_dirs, sequence_frames = _read_manifest(zip_file, zip_pth)
+        for member in zip_file.infolist():
+            member_pth = f"{zip_pth}/{member.filename}"
+            for tif_pattern in tif_patterns:
+                tif_match = tif_pattern.match(member_pth)
+                if tif_match:
+                    break
+            else:
+                continue
+            # sizes in a data descriptor after the data can't be read from the
+            # local header, so those members are left to zipfile
+            member_offset = None
+            if (
+                member.compress_type == zipfile.ZIP_STORED
+                and not member.flag_bits & 0x08
+            ):
+                member_offset = member.header_offset
+            dir_pth = member_pth.rsplit("/", 1)[0]
+            _, frames = dir_frames.setdefault(dir_pth, (tif_pattern.pattern, {}))
+            frames[int(tif_match.groups()[-1])] = FrameInfo(
+                path=member_pth,
+                mtime=zip_mtime,
+                size=member.file_size,
+                archive=zip_pth,
+                member_offset=member_offset,
+            )
+    return {
+        dir_pth: ArchiveFrameIndex(
+            zip_pth,
+            dir_pth,
+            tif_regex,
+            zip_mtime,
+            frames,
+            sequence_frames=sequence_frames if dir_pth in manifest_dirs else None,
+        )
+        for dir_pth, (tif_regex, frames) in dir_frames.items()
+    }
+
+
+def _read_manifest(zip_file, zip_pth):
+    """Virtual paths of the directories our writer's manifest covers, and their length
+
+    Archives we didn't write have no manifest, so cover no directories.
+    """
+    try:
+        manifest = json.loads(zip_file.read(MANIFEST_NAME))
+    except (KeyError, ValueError):
+        return set(), None
+    manifest_dirs = {
+        f"{zip_pth}/{name.rsplit('/', 1)[0]}" for name in manifest.get("frames", {})
+    }
+    return manifest_dirs, manifest.get("n_frames")
+
+
+def get_archive_index(zip_pth):
+    """Return the frame indices of zip_pth, reading it only when it has changed.
+
+    Parameters
+    ----------
+    zip_pth : str
+        path of the zip archive
+
+    Returns
+    -------
+    Dict[str, ArchiveFrameIndex] | None
+        virtual directory path to the index of its frames, or None if
+        zip_pth isn't a zip archive
+    """
+    zip_pth = os.path.abspath(str(zip_pth))
+    try:
+        zip_mtime = os.stat(zip_pth).st_mtime
+    except OSError:
+        return None
+
+    cached = _ARCHIVE_CACHE.get(zip_pth)
+    if cached is not None and cached[0] == zip_mtime:
+        return cached[1]
+
+    try:
+        indices = index_archive(zip_pth, zip_mtime)
+    except (OSError, zipfile.BadZipFile):
+        indices = None
+    _ARCHIVE_CACHE[zip_pth] = (zip_mtime, indices)
+    return indices
+
+
+def probe_archive(zip_pth):
+    """Whether zip_pth is a zip archive holding any tracking challenge frames.
+
+    Only the archive's central directory is read, and the answer is cached
+    against the archive's mtime, along with the indices it gave us.
+    """
+    if not str(zip_pth).lower().endswith(ARCHIVE_SUFFIX):
+        return False
+    return bool(get_archive_index(zip_pth))
@@ -0,0 +1,280 @@
+"""
+This module provides the decoded frame cache shared by every layer this
+plugin opens, so scrubbing back and forth through time doesn't decode
+the same frames over and over.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ._trace import count
+
+# 512MiB holds a few hundred typical 2D tracking challenge frames
+DEFAULT_CACHE_BYTES = 512 * 2 ** 20
+# frames either side of the one being viewed that we load in the background
+DEFAULT_PREFETCH = 2
+DEFAULT_PREFETCH_WORKERS = 4
+
+
+class FrameCache:
+    """Thread-safe LRU cache of decoded frames with a byte budget.
+
+    Frames are evicted least recently used first once the total size of
+    cached frames goes over max_bytes. Cached frames are made read-only
+    since the same array may be handed to several layers. A small summary
+    of a frame, e.g. its scores, can be kept with it, see put_summary, and
+    is dropped along with it.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        byte budget for cached frames, by default DEFAULT_CACHE_BYTES
+    prefetch : int, optional
+        number of frames either side of a requested frame to load in the
+        background, by default DEFAULT_PREFETCH
+    max_workers : int, optional
+        number of threads used for prefetching, by default DEFAULT_PREFETCH_WORKERS
+    """
+
+    def __init__(
+        self,
+        max_bytes=DEFAULT_CACHE_BYTES,
+        prefetch=DEFAULT_PREFETCH,
+        max_workers=DEFAULT_PREFETCH_WORKERS,
+    ):
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch
+        self.max_workers = max_workers
+
+        self._frames = OrderedDict()
+        # summaries of cached or loading frames, by key
+        self._summaries = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        # keys being loaded in the background, so we never load one twice
+        self._pending = {}
+        self._pool = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def stats(self):
+        """Return counters for sizing the cache
+
+        Returns
+        -------
+        dict
+            hits, misses, evictions and prefetched frame counts, along
+            with the number of frames and bytes cached and the byte budget
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "prefetched": self.prefetched,
+                "frames": len(self._frames),
+                "nbytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.prefetched = 0
+
+    def resize(self, max_bytes):
+        """Change the byte budget, evicting frames if we're now over it"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._summaries.clear()
+            self._nbytes = 0
+
+    def put_summary(self, key, summary):
+        """Keep summary with the frame at key for as long as the frame is cached.
+
+        Loaders call this while their frame is loading. Summaries of frames
+        that aren't cached or loading, or that turn out too big to cache,
+        aren't kept.
+
+        Parameters
+        ----------
+        key : Hashable
+            key of the frame, see get
+        summary : Any
+            small summary of the frame
+        """
+        with self._lock:
+            if key in self._frames or key in self._pending:
+                self._summaries[key] = summary
+
+    def get_summary(self, key):
+        """The summary kept with the frame at key, or None"""
+        with self._lock:
+            return self._summaries.get(key)
+
+    def get(self, key, loader):
+        """Return the frame cached at key, calling loader() if it isn't cached.
+
+        Concurrent requests for a frame that isn't cached load it only once.
+
+        Parameters
+        ----------
+        key : Hashable
+            key the frame is cached under, e.g. its path and mtime
+        loader : Callable[[], np.ndarray]
+            function that reads the frame
+
+        Returns
+        -------
+        np.ndarray
+            read-only decoded frame
+        """
+        with self._lock:
+            if key in self._frames:
+                self.hits += 1
+                count("cache.hits")
+                self._frames.move_to_end(key)
+                return self._frames[key]
+            self.misses += 1
+            count("cache.misses")
+            pending = self._pending.get(key)
+            if pending is None:
+                # anyone else asking for this frame waits for us to load it
+                loading = self._pending[key] = Future()
+
+        # the frame is already being loaded, by a prefetch or another caller
+        if pending is not None:
+            return pending.result()
+        try:
+            frame = self._put(key, loader())
+        except BaseException as error:
+            self._drop_summary(key)
+            loading.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        loading.set_result(frame)
+        return frame
+
+    def load_frames(self, keys, loader):
+        """Load the frames at keys that aren't cached or loading, in one call to loader.
+
+        The frames are loaded in this thread, and marked as loading while
+        they are, so anyone asking for one meanwhile waits for it rather
+        than loading it again. Frames another caller is loading already
+        are left to them.
+
+        Parameters
+        ----------
+        keys : Iterable[Hashable]
+            keys of the frames to load, see get
+        loader : Callable[[List[Hashable]], List[np.ndarray]]
+            function loading the frames at the keys it's given, in order
+        """
+        with self._lock:
+            loading = {
+                key: Future()
+                for key in keys
+                if key not in self._frames and key not in self._pending
+            }
+            self._pending.update(loading)
+        if not loading:
+            return
+        try:
+            frames = loader(list(loading))
+            for (key, future), frame in zip(loading.items(), frames):
+                future.set_result(self._put(key, frame))
+        except BaseException as error:
+            for key, future in loading.items():
+                if not future.done():
+                    self._drop_summary(key)
+                    future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                for key in loading:
+                    self._pending.pop(key, None)
+
+    def prefetch_frames(self, keys_and_loaders):
+        """Load frames in the background if they aren't cached or loading
+
+        Loaders run on the cache's own threads, so they must never wait for
+        frames loaded there in turn, e.g. by computing frames derived from
+        other cached frames, or the threads can all end up waiting on work
+        queued behind them. Derived frames are loaded with load_frames.
+
+        Parameters
+        ----------
+        keys_and_loaders : Iterable[Tuple[Hashable, Callable[[], np.ndarray]]]
+            (key, loader) pairs as would be passed to get
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="workshop-demo-prefetch"
+                )
+            for key, loader in keys_and_loaders:
+                if key in self._frames or key in self._pending:
+                    continue
+                self._pending[key] = self._pool.submit(self._prefetch, key, loader)
+
+    def _prefetch(self, key, loader):
+        try:
+            frame = self._put(key, loader())
+            with self._lock:
+                self.prefetched += 1
+            return frame
+        except BaseException:
+            self._drop_summary(key)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _put(self, key, frame):
+        frame.flags.writeable = False
+        # frames bigger than the whole budget are returned but never cached
+        if frame.nbytes > self.max_bytes:
+            self._drop_summary(key)
+            return frame
+        with self._lock:
+            if key not in self._frames:
+                self._frames[key] = frame
+                self._nbytes += frame.nbytes
+                self._evict()
+        return frame
+
+    def _evict(self):
+        """Drop least recently used frames until we're within budget. Needs lock."""
+        while self._nbytes > self.max_bytes and self._frames:
+            key, frame = self._frames.popitem(last=False)
+            self._summaries.pop(key, None)
+            self._nbytes -= frame.nbytes
+            self.evictions += 1
+            count("cache.evictions")
+
+    def _drop_summary(self, key):
+        with self._lock:
+            self._summaries.pop(key, None)
+
+
+# the one cache shared by all layers opened by this plugin
+frame_cache = FrameCache()
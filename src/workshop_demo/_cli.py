@@ -0,0 +1,340 @@
+"""
+This module provides the workshop-demo command, which segments, scores
+and exports many tracking challenge sequences headless. It never imports
+napari's GUI or Qt, so it can run nightly on machines without a display.
+
+Sequences are found under a root directory as NN/ folders of tN.tif
+frames, with ground truth, where there is any, in a sister NN_GT/SEG
+folder. Each sequence is processed in its own process from a pool, and
+each process computes its chunks with a few threads.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple, Optional
+
+import dask
+
+from ._cache import frame_cache
+from ._constants import GT_TIF_REGEX, SEQ_REGEX, SEQ_TIF_REGEX
+from ._diff import DIFF_TABLE_COLUMNS, DiffFrames
+from ._export import COMPRESSIONS, DEFAULT_COMPRESSION, write_zip
+from ._index import get_frame_index
+from ._label import Connectivity
+from ._metrics import score_sequence
+from ._reader import read_tifs
+from ._threshold import Threshold, segment
+from ._trace import flush, span
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # not available on Windows, where memory limits aren't supported
+    resource = None
+
+SCORES_NAME = "scores.json"
+SIZE_SUFFIXES = {"": 1, "K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+
+
+class Dataset(NamedTuple):
+    """A sequence to process, and its ground truth if it has any"""
+
+    # path of the sequence relative to the root, e.g. Fluo-N2DH-GOWT1/01
+    name: str
+    seq_dir: str
+    gt_dir: Optional[str]
+
+
+def discover_datasets(root):
+    """Find every sequence under root, paired with its ground truth
+
+    Parameters
+    ----------
+    root : str
+        directory to search
+
+    Returns
+    -------
+    List[Dataset]
+        sequences found, sorted by name
+    """
+    root = os.path.abspath(root)
+    datasets = []
+    for dir_pth, dir_names, _ in os.walk(root):
+        # hidden directories never hold sequences
+        dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+        if not re.match(SEQ_REGEX, dir_pth):
+            continue
+        # a numbered directory may just be a year, say, with sequences below it
+        if get_frame_index(dir_pth, SEQ_TIF_REGEX) is None:
+            continue
+        # sequences never nest
+        dir_names.clear()
+        gt_dir = os.path.join(f"{dir_pth}_GT", "SEG")
+        if get_frame_index(gt_dir, GT_TIF_REGEX) is None:
+            gt_dir = None
+        datasets.append(Dataset(os.path.relpath(dir_pth, root), dir_pth, gt_dir))
+    return sorted(datasets)
+
+
+def parse_size(size):
+    """Parse a size in bytes, optionally suffixed with K, M, G or T (powers of 1024)"""
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)B?\s*", str(size).upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {size!r}")
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2)])
+
+
+def _init_worker(memory_limit, threads):
+    """Limit each worker process's memory and the threads dask computes with"""
+    if memory_limit:
+        if resource is None:
+            raise RuntimeError("memory limits are not supported on this platform")
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        # leave most of the budget for computing chunks rather than caching frames
+        frame_cache.resize(min(frame_cache.max_bytes, memory_limit // 4))
+    dask.config.set(scheduler="threads", num_workers=threads)
+
+
+def process_dataset(
+    dataset,
+    out_dir,
+    threshold=Threshold.otsu,
+    per_frame=False,
+    connectivity=None,
+    compression=DEFAULT_COMPRESSION,
+    diff=False,
+    threads=None,
+):
+    """Segment one sequence, score it against its ground truth and write the results
+
+    The segmentation is written to <out_dir>/<name>_SEG.zip laid out like
+    the plugin's writer does, so it can be read back alongside the sequence,
+    and, with diff, the differences from the ground truth are written to
+    <out_dir>/<name>_DIFF.zip, classified as in label_differences, with a
+    table of each annotated frame's differences and scores in
+    <out_dir>/<name>_DIFF.csv. The scores then come from the same pass
+    over the frames as the diff.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        sequence to process
+    out_dir : str
+        directory to write results to
+    threshold : Threshold, optional
+        threshold method, by default Threshold.otsu
+    per_frame : bool, optional
+        whether to threshold each frame separately, by default False
+    connectivity : Connectivity | None, optional
+        labels connectivity, see segment, by default None
+    compression : str | None, optional
+        tiff compression codec, by default DEFAULT_COMPRESSION
+    diff : bool, optional
+        whether to also write the differences from the ground truth, by default False
+    threads : int, optional
+        number of threads for writing and scoring, by default one per core
+
+    Returns
+    -------
+    dict
+        paths written and, if there is ground truth, SEG and DET scores
+    """
+    seq_index = get_frame_index(dataset.seq_dir, SEQ_TIF_REGEX)
+    seq_data = read_tifs(seq_index, seq_index.n_frames)
+    seg_labels = segment(
+        seq_data, threshold, per_frame=per_frame, connectivity=connectivity
+    )
+
+    out_pth = os.path.join(out_dir, dataset.name)
+    os.makedirs(os.path.dirname(out_pth), exist_ok=True)
+    seq_number = os.path.basename(dataset.seq_dir)
+    result = {"name": dataset.name, "outputs": [out_pth + "_SEG.zip"]}
+    write_zip(
+        seg_labels,
+        out_pth + "_SEG.zip",
+        compression=compression,
+        max_workers=threads,
+        arc_dir=f"{seq_number}_AUTO/SEG",
+    )
+    if dataset.gt_dir is None:
+        return result
+
+    gt_index = get_frame_index(dataset.gt_dir, GT_TIF_REGEX)
+    gt_data = read_tifs(gt_index, seq_index.n_frames)
+    # ground truth is sparse, and frames without it are never segmented again
+    if not diff:
+        sequence_score, _ = score_sequence(
+            gt_data, seg_labels, gt_index.frame_numbers, max_workers=threads
+        )
+        result.update(sequence_score._asdict())
+        return result
+
+    diff_frames = DiffFrames(
+        gt_data, seg_labels, annotated_frames=gt_index.frame_numbers
+    )
+    write_zip(
+        # a few frames per chunk, so frames are classified in parallel
+        diff_frames.to_dask().rechunk({0: threads or os.cpu_count()}),
+        out_pth + "_DIFF.zip",
+        compression=compression,
+        max_workers=threads,
+        arc_dir=f"{seq_number}_DIFF",
+    )
+    _write_table(diff_frames.frame_table(), out_pth + "_DIFF.csv")
+    # frames evicted from the frame cache since are summarised again, from the
+    # disk cache if it's on
+    result.update(diff_frames.sequence_score(gt_index.frame_numbers)._asdict())
+    result["outputs"] += [out_pth + "_DIFF.zip", out_pth + "_DIFF.csv"]
+    return result
+
+
+def _write_table(rows, table_pth):
+    """Write rows, dicts with the same keys, to a csv file at table_pth"""
+    with open(table_pth, "w", newline="") as table_file:
+        writer = csv.DictWriter(table_file, fieldnames=DIFF_TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _process_or_report(dataset, *args, **kwargs):
+    """process_dataset, returning any error so one bad sequence doesn't stop the batch"""
+    try:
+        with span("cli.process_dataset", dataset=dataset.name):
+            return process_dataset(dataset, *args, **kwargs)
+    except Exception:
+        return {"name": dataset.name, "error": traceback.format_exc()}
+    finally:
+        flush()
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="workshop-demo",
+        description=(
+            "Segment every tracking challenge sequence under ROOT by thresholding, "
+            "score each against its ground truth, and write zipped results to OUT."
+        ),
+    )
+    parser.add_argument("root", help="directory to search for NN/ sequences")
+    parser.add_argument("out", help="directory to write results to")
+    parser.add_argument(
+        "--threshold",
+        choices=[threshold.name for threshold in Threshold],
+        default=Threshold.otsu.name,
+        help="threshold method (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--per-frame", action="store_true", help="threshold each frame separately"
+    )
+    labels = parser.add_mutually_exclusive_group()
+    labels.add_argument(
+        "--unique-labels",
+        action="store_true",
+        help="give every object a label unique across the sequence",
+    )
+    labels.add_argument(
+        "--connect-through-time",
+        action="store_true",
+        help="also connect overlapping objects in neighbouring frames",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=[str(compression) for compression in COMPRESSIONS],
+        default=DEFAULT_COMPRESSION,
+        help="tiff compression (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="also write differences from the ground truth",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of sequences processed at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="threads per worker (default: cores divided between workers)",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=parse_size,
+        default=None,
+        help="address space limit per worker, e.g. 4G (default: no limit)",
+    )
+    return parser
+
+
+def main(argv=None):
+    """Entry point of the workshop-demo command
+
+    Parameters
+    ----------
+    argv : List[str], optional
+        command line arguments, by default sys.argv[1:]
+
+    Returns
+    -------
+    int
+        exit status, 1 if any sequence failed
+    """
+    args = _parser().parse_args(argv)
+    datasets = discover_datasets(args.root)
+    if not datasets:
+        print(f"No sequences found under {args.root}", file=sys.stderr)
+        return 1
+
+    workers = max(1, min(args.workers, len(datasets)))
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    connectivity = None
+    if args.connect_through_time:
+        connectivity = Connectivity.spacetime
+    elif args.unique_labels:
+        connectivity = Connectivity.frame
+    compression = None if args.compression == "None" else args.compression
+    os.makedirs(args.out, exist_ok=True)
+
+    results = []
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(args.memory_limit, threads)
+    ) as pool:
+        futures = [
+            pool.submit(
+                _process_or_report,
+                dataset,
+                args.out,
+                threshold=Threshold[args.threshold],
+                per_frame=args.per_frame,
+                connectivity=connectivity,
+                compression=compression,
+                diff=args.diff,
+                threads=threads,
+            )
+            for dataset in datasets
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if "error" in result:
+                print(f"{result['name']}: failed\n{result['error']}", file=sys.stderr)
+            elif "seg" in result:
+                print(
+                    f"{result['name']}: SEG {result['seg']:.3f}  DET {result['det']:.3f}"
+                )
+            else:
+                print(f"{result['name']}: segmented, no ground truth")
+
+    results.sort(key=lambda result: result["name"])
+    with open(os.path.join(args.out, SCORES_NAME), "w") as scores_file:
+        json.dump(results, scores_file, indent=2)
+    return int(any("error" in result for result in results))
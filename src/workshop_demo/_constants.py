@@ -3,3 +3,7 @@ GT_REGEX = r"(.*)/([0-9]{2,})(_(?:GT|AUTO))/SEG$"
 
 SEQ_TIF_REGEX = rf'{SEQ_REGEX[:-1]}/t([0-9]{{3}}){"."}tif$'
 GT_TIF_REGEX = rf'{GT_REGEX[:-1]}/(?:man_)?seg([0-9]{{3}}){"."}tif$'
+
+# archive member holding the content hash of every frame our writer wrote
+# and the length of the sequence, which empty frames left out don't shorten
+MANIFEST_NAME = "workshop_demo_manifest.json"
@@ -0,0 +1,359 @@
+"""
+This module compares a segmentation against ground truth lazily, so the
+comparison is only computed for the frames being looked at. It has no
+napari or Qt dependencies.
+
+Differences are classified by the objects involved: ground truth the
+segmentation missed, segmented foreground with no ground truth, ground
+truth objects split between segmented objects, and segmented objects
+merging ground truth objects. Classifying a frame also scores it, so a per-frame table
+comes out of the same pass over the data as the diff itself.
+"""
+from typing import NamedTuple
+
+import dask
+import dask.array as da
+import numpy as np
+
+from ._cache import frame_cache
+from ._disk_cache import cache_key
+from ._frames import CachedFrames
+from ._metrics import (FrameScore, contingency_table_inverse, object_matches,
+                       score_table, summarise_scores)
+from ._trace import span
+
+# categories of label_differences, drawn over whatever else is shown
+FALSE_NEGATIVE = 1
+FALSE_POSITIVE = 2
+SPLIT = 3
+MERGE = 4
+DIFF_CATEGORIES = {
+    FALSE_NEGATIVE: "false negative",
+    FALSE_POSITIVE: "false positive",
+    SPLIT: "split",
+    MERGE: "merge",
+}
+DIFF_COLORS = {
+    FALSE_NEGATIVE: "#fca503",
+    FALSE_POSITIVE: "#e0218a",
+    SPLIT: "#21a0e0",
+    MERGE: "#8a2be2",
+}
+
+
+class FrameDiff(NamedTuple):
+    """Summary of the classified differences in one frame"""
+
+    frame: int
+    # number of pixels in each category
+    fn_pixels: int
+    fp_pixels: int
+    split_pixels: int
+    merge_pixels: int
+    # ground truth objects split between segmented objects, and segmented
+    # objects merging ground truth objects
+    n_split: int
+    n_merge: int
+    score: FrameScore
+
+    def as_row(self):
+        """The summary as a flat dict, with the frame's SEG and DET"""
+        row = self._asdict()
+        score = row.pop("score")
+        row.update(
+            n_gt=score.n_gt,
+            n_seg=score.n_seg,
+            seg=score.seg,
+            det=score.det,
+            fn_objects=score.fn,
+            fp_objects=score.fp,
+        )
+        return row
+
+
+# columns of FrameDiff.as_row, in order
+DIFF_TABLE_COLUMNS = FrameDiff._fields[:-1] + (
+    "n_gt",
+    "n_seg",
+    "seg",
+    "det",
+    "fn_objects",
+    "fp_objects",
+)
+
+
+def classify_frame(gt_frame, seg_frame, frame=0):
+    """Classify the pixels where a frame's segmentation differs from its ground truth.
+
+    Ground truth foreground the segmentation missed is FALSE_NEGATIVE, and
+    segmented foreground with no ground truth is FALSE_POSITIVE. Where both
+    are foreground, pixels of a ground truth object split between two or
+    more segmented objects lying mostly inside it are SPLIT, and pixels of
+    a segmented object covering most of two or more ground truth objects
+    are MERGE, which wins over SPLIT. Everything else is 0.
+
+    Frames without ground truth aren't evaluated and are all 0.
+
+    Parameters
+    ----------
+    gt_frame : ArrayLike
+        ground truth labels
+    seg_frame : ArrayLike
+        segmentation labels, same shape as gt_frame
+    frame : int, optional
+        index of the frame in its sequence, by default 0
+
+    Returns
+    -------
+    categories : np.ndarray
+        uint8 category of each pixel
+    frame_diff : FrameDiff
+        summary of the frame's differences and its score
+    """
+    gt_frame = np.asarray(gt_frame)
+    seg_frame = np.asarray(seg_frame)
+    categories = np.zeros(gt_frame.shape, dtype=np.uint8)
+    gt_ids, gt_inv, seg_ids, seg_inv, table = contingency_table_inverse(
+        gt_frame, seg_frame
+    )
+    score = score_table(gt_ids, seg_ids, table, frame=frame)
+    if not score.n_gt:
+        return categories, FrameDiff(frame, 0, 0, 0, 0, 0, 0, score)
+
+    _, seg_sizes, overlaps, matches = object_matches(gt_ids, seg_ids, table)
+    inside = overlaps > seg_sizes[np.newaxis, :] / 2
+    is_split = np.zeros(len(gt_ids), dtype=bool)
+    is_split[gt_ids != 0] = inside.sum(axis=1) > 1
+    is_merge = np.zeros(len(seg_ids), dtype=bool)
+    is_merge[seg_ids != 0] = matches.sum(axis=0) > 1
+
+    gt_foreground = gt_frame != 0
+    seg_foreground = seg_frame != 0
+    both_foreground = gt_foreground & seg_foreground
+    categories[gt_foreground & ~seg_foreground] = FALSE_NEGATIVE
+    categories[seg_foreground & ~gt_foreground] = FALSE_POSITIVE
+    categories[both_foreground & is_split[gt_inv]] = SPLIT
+    categories[both_foreground & is_merge[seg_inv]] = MERGE
+
+    pixels = np.bincount(categories.ravel(), minlength=MERGE + 1)
+    return categories, FrameDiff(
+        frame=frame,
+        fn_pixels=int(pixels[FALSE_NEGATIVE]),
+        fp_pixels=int(pixels[FALSE_POSITIVE]),
+        split_pixels=int(pixels[SPLIT]),
+        merge_pixels=int(pixels[MERGE]),
+        n_split=int(is_split.sum()),
+        n_merge=int(is_merge.sum()),
+        score=score,
+    )
+
+
+def _classify_frames(gt_block, seg_block):
+    """Classify the differences in each frame of a block, see classify_frame"""
+    categories = np.empty(gt_block.shape, dtype=np.uint8)
+    for t, (gt_frame, seg_frame) in enumerate(zip(gt_block, seg_block)):
+        categories[t], _ = classify_frame(gt_frame, seg_frame)
+    return categories
+
+
+def label_differences(gt_data, seg_data):
+    """Lazily classify the differences between segmentation and ground truth.
+
+    Each frame is classified on its own, see classify_frame, into a compact
+    uint8 array of DIFF_CATEGORIES.
+
+    Parameters
+    ----------
+    gt_data : ArrayLike
+        2D+T ground truth labels
+    seg_data : ArrayLike
+        2D+T segmentation labels, same shape as gt_data
+
+    Returns
+    -------
+    dask.array.Array
+        category of each pixel, one frame per chunk
+    """
+    gt_data = da.asarray(gt_data)
+    seg_data = da.asarray(seg_data)
+    frame_chunks = (1,) + gt_data.shape[1:]
+    return da.map_blocks(
+        _classify_frames,
+        gt_data.rechunk(frame_chunks),
+        seg_data.rechunk(frame_chunks),
+        dtype=np.uint8,
+        meta=np.empty((0,) * gt_data.ndim, dtype=np.uint8),
+    )
+
+
+class DiffFrames(CachedFrames):
+    """label_differences served through the frame cache, keeping each frame's summary.
+
+    Whenever a frame is classified its FrameDiff is kept alongside it in
+    the frame cache, so the layer, the per-frame table and the sequence's
+    scores all come from one pass over the data. Both are saved to the
+    shared disk cache, so diffing the same layers again, even in a new
+    session, classifies nothing.
+
+    Parameters
+    ----------
+    gt_data : ArrayLike
+        2D+T ground truth labels
+    seg_data : ArrayLike
+        2D+T segmentation labels, same shape as gt_data
+    annotated_frames : Iterable[int], optional
+        the only frames with ground truth, e.g. those the reader found a tif
+        for. Other frames are never classified, so their segmentation is
+        never computed. By default every frame is classified
+    cache : FrameCache, optional
+        cache of classified frames, by default the cache shared by all layers
+    """
+
+    def __init__(self, gt_data, seg_data, annotated_frames=None, cache=frame_cache):
+        super().__init__(label_differences(gt_data, seg_data), cache=cache)
+        self.gt_data = gt_data
+        self.seg_data = seg_data
+        self.annotated_frames = (
+            range(len(self)) if annotated_frames is None else sorted(annotated_frames)
+        )
+        self._zeros = np.zeros(self.shape[1:], dtype=self.dtype)
+        self._zeros.flags.writeable = False
+        self._is_annotated = np.zeros(len(self), dtype=bool)
+        self._is_annotated[list(self.annotated_frames)] = True
+
+    def get_frame(self, t):
+        """Return frame t, or the shared zero frame if it isn't annotated"""
+        if not self._is_annotated[t]:
+            return self._zeros
+        return super().get_frame(t)
+
+    def compute_frames(self, frames):
+        return super().compute_frames([t for t in frames if self._is_annotated[t]])
+
+    @property
+    def frame_diffs(self):
+        """Frame index to FrameDiff, for every annotated frame still cached"""
+        frame_diffs = {}
+        for t in self.annotated_frames:
+            frame_diff = self.cache.get_summary(self._cache_key(t))
+            if frame_diff is not None:
+                frame_diffs[t] = frame_diff
+        return frame_diffs
+
+    def _compute_or_load(self, frames):
+        """frames saved to the disk cache, and the rest classified in one go"""
+        classified = self._classify(frames)
+        for t in frames:
+            # kept with the frame in the frame cache, and dropped along with it
+            self.cache.put_summary(self._cache_key(t), classified[t][1])
+        return [classified[t][0] for t in frames]
+
+    def _classify(self, frames):
+        """Categories and FrameDiff of each of frames, from the disk cache if saved"""
+        disk_cache = self._disk_cache()
+        classified = {}
+        for t in frames:
+            classified[t] = self._load_diff(disk_cache, t)
+        missing = [t for t in frames if classified[t] is None]
+
+        # one dask call reads and classifies the frames in parallel
+        with span("diff.classify_frames", n_frames=len(missing)):
+            computed = dask.compute(
+                *[
+                    dask.delayed(classify_frame)(
+                        self.gt_data[t], self.seg_data[t], frame=t
+                    )
+                    for t in missing
+                ]
+            )
+        for t, (categories, frame_diff) in zip(missing, computed):
+            if disk_cache is not None:
+                key = cache_key("diff", self.source.name, t)
+                # the array goes first, since a summary without it is never used
+                disk_cache.put_array(key, categories)
+                disk_cache.put_json(key, [frame_diff[:-1], frame_diff.score])
+            classified[t] = categories, frame_diff
+        return classified
+
+    def _load_diff(self, disk_cache, t):
+        """Categories and FrameDiff of frame t saved to the disk cache, or None"""
+        if disk_cache is None:
+            return None
+        key = cache_key("diff", self.source.name, t)
+        summary = disk_cache.get_json(key)
+        categories = disk_cache.get_array(key) if summary is not None else None
+        if categories is None:
+            return None
+        diff, score = summary
+        return categories, FrameDiff(*diff, FrameScore(*score))
+
+    def frame_summaries(self, frames=None):
+        """FrameDiff of each annotated frame of frames, classifying any not cached
+
+        Frames are classified into the frame cache, and their summaries kept
+        with them. Summaries saved to the disk cache by an earlier diff of
+        the same layers are reused rather than classified again.
+
+        Parameters
+        ----------
+        frames : Iterable[int], optional
+            frames to summarise, by default every annotated frame
+
+        Returns
+        -------
+        List[FrameDiff]
+            summary of each annotated frame, in frame order
+        """
+        if frames is None:
+            frames = self.annotated_frames
+        frames = sorted(t for t in frames if self._is_annotated[t])
+        self.compute_frames(
+            [t for t in frames if self.cache.get_summary(self._cache_key(t)) is None]
+        )
+        frame_diffs = {t: self.cache.get_summary(self._cache_key(t)) for t in frames}
+        # frames too big to cache, or already evicted again, are summarised anew
+        missing = [t for t in frames if frame_diffs[t] is None]
+        for t, (_, frame_diff) in self._classify(missing).items():
+            frame_diffs[t] = frame_diff
+        return [frame_diffs[t] for t in frames]
+
+    def frame_table(self, frames=None):
+        """Summaries of frames with ground truth, classifying any not cached
+
+        Parameters
+        ----------
+        frames : Iterable[int], optional
+            frames to summarise, by default every annotated frame
+
+        Returns
+        -------
+        List[dict]
+            FrameDiff.as_row of each frame with ground truth, in frame order
+        """
+        return [
+            frame_diff.as_row()
+            for frame_diff in self.frame_summaries(frames)
+            if frame_diff.score.n_gt
+        ]
+
+    def sequence_score(self, frames=None):
+        """SEG and DET over frames with ground truth
+
+        Parameters
+        ----------
+        frames : Iterable[int], optional
+            frames to score, classifying any not cached, by default the
+            frames classified so far and still cached
+
+        Returns
+        -------
+        SequenceScore
+            scores of the sequence, see summarise_scores
+        """
+        if frames is None:
+            frame_diffs = self.frame_diffs.values()
+        else:
+            frame_diffs = self.frame_summaries(frames)
+        return summarise_scores(
+            frame_diff.score for frame_diff in frame_diffs if frame_diff.score.n_gt
+        )
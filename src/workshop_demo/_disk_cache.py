@@ -0,0 +1,319 @@
+"""
+This module provides the on-disk cache of derived results shared by every
+session and process on the machine, so reopening and rescoring a dataset
+that hasn't changed reuses what was computed last time.
+
+Entries are keyed by a hash of what they were derived from, e.g. the name
+of a dask array. Arrays read from disk are named after the mtime and size
+of every file they're read from, see read_tifs and read_zarr, and arrays
+derived from them are named after their inputs and the operation's
+parameters, so editing a dataset changes the keys of everything derived
+from it. Stale entries are then never asked for, and are eventually
+evicted. Arrays named any other way, e.g. by da.from_zarr or another
+plugin's reader, can keep their name when their data changes, so
+nothing derived from them is cached, see is_fingerprinted.
+
+Each entry is written under a temporary name and moved into place, so
+other processes never see half an entry, and a missing entry is just a
+miss, so processes can evict each other's entries at any time. Entries
+are touched when read, and the least recently used are evicted once the
+cache is over its size cap.
+
+The cache lives in $XDG_CACHE_HOME/workshop-demo (~/.cache/workshop-demo
+if XDG_CACHE_HOME is unset), or in WORKSHOP_DEMO_CACHE_DIR if that's set.
+WORKSHOP_DEMO_CACHE_BYTES caps its size, as a number of bytes, and 0
+turns it off.
+
+This module only needs the standard library until arrays are read or
+written, since the reader's directory indices are cached here too.
+"""
+import json
+import os
+import threading
+import time
+from hashlib import blake2b
+
+from . import __version__
+from ._trace import count
+
+CACHE_DIR_ENV = "WORKSHOP_DEMO_CACHE_DIR"
+CACHE_BYTES_ENV = "WORKSHOP_DEMO_CACHE_BYTES"
+# a few thousand typical 2D frames of segmentation and differences
+DEFAULT_DISK_CACHE_BYTES = 2 * 2 ** 30
+# bumped whenever what entries hold changes
+CACHE_VERSION = 1
+# eviction brings the cache down to this fraction of its cap, so it
+# doesn't run again straight away
+EVICT_TO = 0.9
+# temporary files older than this were left by a process that died writing them
+STALE_PART_SECONDS = 3600
+
+# the shared cache, or None while it's turned off, see configure
+_disk_cache = None
+# graph layers of arrays named after a fingerprint of their files, see fingerprinted
+_fingerprinted_layers = set()
+
+
+def default_cache_dir():
+    """Where the cache lives unless told otherwise, following the XDG spec"""
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "workshop-demo")
+
+
+def cache_key(*parts):
+    """Key of the entry derived from parts, which must be JSON serialisable.
+
+    The plugin's version is part of every key, so upgrading never serves
+    results computed by different code.
+    """
+    key_parts = [CACHE_VERSION, __version__, *parts]
+    return blake2b(json.dumps(key_parts).encode(), digest_size=16).hexdigest()
+
+
+def fingerprinted(data):
+    """Mark dask array data as named after a fingerprint of what it's read from.
+
+    Readers call this on arrays whose names change whenever their files
+    do, so results derived from them can be cached by name.
+
+    Parameters
+    ----------
+    data : dask.array.Array
+        array named after a fingerprint of its files
+
+    Returns
+    -------
+    dask.array.Array
+        data, unchanged
+    """
+    # from_array and from_zarr add a layer holding the source, named after data
+    _fingerprinted_layers.update(data.__dask_graph__().layers)
+    return data
+
+
+def is_fingerprinted(data):
+    """Whether dask array data's name changes whenever its inputs do.
+
+    That's arrays marked by fingerprinted, numpy data wrapped by dask,
+    which is named after a hash of its contents, and arrays derived only
+    from those. Results derived from anything else are never cached by
+    name, since they could be served stale.
+
+    Parameters
+    ----------
+    data : dask.array.Array
+        array to check
+
+    Returns
+    -------
+    bool
+        True if entries keyed by data's name are never stale
+    """
+    graph = data.__dask_graph__()
+    return all(
+        _is_fingerprinted_layer(graph.layers[name], name)
+        for name, dependencies in graph.dependencies.items()
+        if not dependencies
+    )
+
+
+def _is_fingerprinted_layer(layer, name):
+    if name in _fingerprinted_layers:
+        return True
+    import numpy as np
+
+    # da.asarray and da.from_array put numpy chunks straight into the graph
+    return name.startswith("array-") and all(
+        isinstance(chunk, np.ndarray) for chunk in layer.values()
+    )
+
+
+class DiskCache:
+    """Size-capped, least recently used cache of arrays and JSON on disk.
+
+    Parameters
+    ----------
+    cache_dir : str
+        directory to keep entries in, created when first written to
+    max_bytes : int, optional
+        size cap of the cache, by default DEFAULT_DISK_CACHE_BYTES
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_DISK_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # bytes written since we last checked the cache's size, None if we never have
+        self._unchecked_bytes = None
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def get_array(self, key):
+        """The array stored under key, memory-mapped read-only, or None"""
+        import numpy as np
+
+        entry_pth = self._path(key, ".npy")
+        try:
+            array = np.load(entry_pth, mmap_mode="r")
+        except (OSError, ValueError):
+            count("disk_cache.misses")
+            return None
+        self._touch(entry_pth)
+        count("disk_cache.hits")
+        return array
+
+    def put_array(self, key, array):
+        """Store array under key, replacing any array already there"""
+        import numpy as np
+
+        self._write(self._path(key, ".npy"), lambda file: np.save(file, array))
+
+    def get_json(self, key):
+        """The JSON value stored under key, or None"""
+        entry_pth = self._path(key, ".json")
+        try:
+            with open(entry_pth) as entry_file:
+                value = json.load(entry_file)
+        except (OSError, ValueError):
+            count("disk_cache.misses")
+            return None
+        self._touch(entry_pth)
+        count("disk_cache.hits")
+        return value
+
+    def put_json(self, key, value):
+        """Store JSON serialisable value under key, replacing any value already there"""
+        encoded = json.dumps(value).encode()
+        self._write(self._path(key, ".json"), lambda file: file.write(encoded))
+
+    def _touch(self, entry_pth):
+        # an entry's mtime is when it was last used, which is what eviction goes by
+        try:
+            os.utime(entry_pth)
+        except OSError:
+            pass
+
+    def _write(self, entry_pth, write):
+        part_pth = f"{entry_pth}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.makedirs(os.path.dirname(entry_pth), exist_ok=True)
+            with open(part_pth, "wb") as part_file:
+                write(part_file)
+            nbytes = os.path.getsize(part_pth)
+            os.replace(part_pth, entry_pth)
+        except OSError:
+            # a full or read-only disk just means recomputing next time
+            try:
+                os.remove(part_pth)
+            except OSError:
+                pass
+            return
+        count("disk_cache.written_bytes", nbytes)
+        with self._lock:
+            if self._unchecked_bytes is not None:
+                self._unchecked_bytes += nbytes
+                # the cache can only have gone over its cap by what we've written
+                if self._unchecked_bytes <= self.max_bytes * (1 - EVICT_TO):
+                    return
+            self._unchecked_bytes = 0
+        self.evict()
+
+    def _entries(self):
+        """(mtime, size, path) of every entry, and stale temporary files removed"""
+        entries = []
+        now = time.time()
+        try:
+            subdirs = list(os.scandir(self.cache_dir))
+        except OSError:
+            return entries
+        for subdir in subdirs:
+            try:
+                dir_entries = list(os.scandir(subdir.path))
+            except OSError:
+                continue
+            for dir_entry in dir_entries:
+                try:
+                    stat = dir_entry.stat()
+                except OSError:
+                    continue
+                if dir_entry.name.endswith(".part"):
+                    if now - stat.st_mtime > STALE_PART_SECONDS:
+                        _remove(dir_entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+        return entries
+
+    @property
+    def nbytes(self):
+        """Total size of the cache's entries"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache is back under its cap"""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+            for _, size, entry_pth in entries:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                # another process may have evicted it already, which is fine
+                _remove(entry_pth)
+                total -= size
+                count("disk_cache.evictions")
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            for _, _, entry_pth in self._entries():
+                _remove(entry_pth)
+
+
+def _remove(pth):
+    try:
+        os.remove(pth)
+    except OSError:
+        pass
+
+
+def configure(cache_dir=None, max_bytes=None):
+    """Set up the shared cache, replacing the one in use.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        directory to keep entries in, by default default_cache_dir()
+    max_bytes : int, optional
+        size cap of the cache, 0 turning it off, by default from
+        WORKSHOP_DEMO_CACHE_BYTES or DEFAULT_DISK_CACHE_BYTES if it's unset
+
+    Returns
+    -------
+    DiskCache | None
+        the shared cache, or None if it's turned off
+    """
+    global _disk_cache
+    if max_bytes is None:
+        try:
+            max_bytes = int(os.environ.get(CACHE_BYTES_ENV, DEFAULT_DISK_CACHE_BYTES))
+        except ValueError:
+            max_bytes = DEFAULT_DISK_CACHE_BYTES
+    if max_bytes <= 0:
+        _disk_cache = None
+    else:
+        _disk_cache = DiskCache(cache_dir or default_cache_dir(), max_bytes)
+    return _disk_cache
+
+
+def get_disk_cache():
+    """The shared cache, or None if it's turned off"""
+    return _disk_cache
+
+
+configure()
@@ -8,64 +8,232 @@ The second is built by subclassing QWidget directly. It provides a lot of
 flexibility for complex functionality, but requires more careful management
 and, of course, more code.
 """
-from enum import Enum
-from functools import partial
+from weakref import WeakKeyDictionary
 
-import dask.array as da
-import numpy as np
 from magicgui import magic_factory
+from magicgui.widgets import PushButton
 from napari.layers import Labels
+from napari.qt.threading import thread_worker
 from napari.utils import progress
 from qtpy.QtWidgets import (QComboBox, QHBoxLayout, QLabel, QPushButton,
                             QVBoxLayout, QWidget)
-from skimage.filters import (threshold_isodata, threshold_li, threshold_otsu,
-                             threshold_triangle, threshold_yen)
-from skimage.measure import label
 
+from ._diff import DIFF_COLORS, DiffFrames
+from ._frames import CachedFrames
+from ._label import Connectivity
+from ._metrics import SequenceScore, iter_frame_scores, summarise_scores
+from ._steps import Progress, batches
+from ._threshold import Threshold, segment_steps
+from ._trace import span
 
-class Threshold(Enum):
-    # plain functions can't be Enum members, so we wrap these in partial
-    # this doesn't change their behaviour
-    isodata = partial(threshold_isodata)
-    li = partial(threshold_li)
-    otsu = partial(threshold_otsu)
-    triangle = partial(threshold_triangle)
-    yen = partial(threshold_yen)
+
+class BackgroundRuns:
+    """Runs one generator worker at a time for a widget, showing its progress.
+
+    Workers yield a Progress after each step, which is shown in a napari
+    progress bar, and results, which are passed to the callback given to
+    start on the main thread. Starting a new run cancels the last one, and
+    anything a cancelled run yields afterwards is ignored, so its partial
+    results are kept but never mixed with the new run's.
+    """
+
+    def __init__(self):
+        self.worker = None
+        self._pbar = None
+        self._pbar_desc = None
+
+    def start(self, worker, on_result):
+        """Cancel the current run and start worker, passing its results to on_result
+
+        Parameters
+        ----------
+        worker : napari.qt.threading.GeneratorWorker
+            worker to start, which yields Progress and results
+        on_result : Callable
+            called on the main thread with each result the worker yields
+
+        Returns
+        -------
+        napari.qt.threading.GeneratorWorker
+            the started worker
+        """
+        self.cancel()
+        self.worker = worker
+        worker.yielded.connect(lambda value: self._on_yielded(worker, on_result, value))
+        worker.finished.connect(lambda: self._on_finished(worker))
+        worker.start()
+        return worker
+
+    def cancel(self):
+        """Stop the current run, if there is one, after its current step"""
+        if self.worker is not None:
+            self.worker.quit()
+            self.worker = None
+        self._close_progress()
+
+    def _on_yielded(self, worker, on_result, value):
+        if worker is not self.worker:
+            return
+        if isinstance(value, Progress):
+            self._show_progress(value)
+        else:
+            on_result(value)
+
+    def _show_progress(self, step):
+        if self._pbar is None or self._pbar_desc != step.desc:
+            self._close_progress()
+            self._pbar = progress(total=step.total, desc=step.desc)
+            self._pbar_desc = step.desc
+        self._pbar.update(step.done - self._pbar.n)
+
+    def _close_progress(self):
+        if self._pbar is not None:
+            self._pbar.close()
+            self._pbar = None
+            self._pbar_desc = None
+
+    def _on_finished(self, worker):
+        if worker is self.worker:
+            self.worker = None
+            self._close_progress()
+
+
+def full_resolution(layer):
+    """Data of layer, or of its full resolution level if it's multiscale"""
+    return layer.data[0] if layer.multiscale else layer.data
+
+
+def annotated_frames(layer):
+    """Frames of a ground truth layer with any labels, if its reader said, else None"""
+    return layer.metadata.get("annotated_frames")
+
+
+def _stream_frames(frames, layer_data_tuple):
+    """Yield layer_data_tuple, then compute its frames into the cache in batches"""
+    yield layer_data_tuple
+    _, meta, _ = layer_data_tuple
+    for batch in batches(range(len(frames))):
+        with span("widget.compute_frames", layer=meta["name"], n_frames=len(batch)):
+            frames.compute_frames(batch)
+        yield Progress("Computing frames", batch[-1] + 1, len(frames))
+
+
+@thread_worker
+def _segment_worker(img_layer, threshold, per_frame, connectivity):
+    seg_labels = yield from segment_steps(
+        full_resolution(img_layer),
+        threshold,
+        per_frame=per_frame,
+        connectivity=connectivity,
+        layer=img_layer,
+    )
+    # the layer is shown straight away, and frames fill in as they're computed
+    frames = CachedFrames(seg_labels)
+    yield from _stream_frames(
+        frames, (frames.to_dask(), {"name": f"{img_layer.name}_seg"}, "labels")
+    )
+
+
+@thread_worker
+def _diff_worker(frames, layer_data_tuple):
+    for value in _stream_frames(frames, layer_data_tuple):
+        yield value
+        # classifying frames scores them too, so scores follow the diff along
+        if isinstance(value, Progress):
+            yield frames.sequence_score()
+
+
+@thread_worker
+def _score_worker(gt_data, seg_data, frames=None):
+    if frames is None:
+        frames = range(len(gt_data))
+    # frames are scored in parallel and counted off as they finish, including
+    # those without ground truth, so progress always gets to the end
+    for n_scored, frame_score in enumerate(
+        iter_frame_scores(gt_data, seg_data, frames, skip_empty=False), 1
+    ):
+        if frame_score.n_gt:
+            yield frame_score
+        yield Progress("Scoring frames", n_scored, len(frames))
+
+
+# segmentation runs of each viewer, shared by its segment_by_threshold widgets
+_segment_runs = WeakKeyDictionary()
+
+
+def _viewer_segment_runs(viewer):
+    """Segmentation runs of viewer, created when it first segments anything"""
+    if viewer not in _segment_runs:
+        _segment_runs[viewer] = BackgroundRuns()
+    return _segment_runs[viewer]
+
+
+def _cancel_segment_run(viewer):
+    if viewer in _segment_runs:
+        _segment_runs[viewer].cancel()
+
+
+def _init_segment_widget(widget):
+    cancel_btn = PushButton(text="Cancel")
+    cancel_btn.changed.connect(lambda: _cancel_segment_run(widget.viewer.value))
+    widget.append(cancel_btn)
 
 
 # our manifest widget command points to this function
-@magic_factory
+@magic_factory(widget_init=_init_segment_widget)
 def segment_by_threshold(
-    img_layer: "napari.layers.Image", threshold: Threshold
-) -> "napari.types.LayerDataTuple":
-    """Returns segmented labels layer given an image layer and threshold function.
+    img_layer: "napari.layers.Image",
+    threshold: Threshold,
+    per_frame: bool = False,
+    unique_labels: bool = False,
+    connect_through_time: bool = False,
+    viewer: "napari.viewer.Viewer" = None,
+):
+    """Adds segmented labels layer given an image layer and threshold function.
 
     Magicgui widget providing access to five scikit-image threshold functions
-    and layer selection using a combo box. Layer is segmented based on threshold choice.
+    and layer selection using a combo box. Layer is segmented based on threshold choice,
+    either with one threshold for the whole layer or one per frame.
+
+    The image is never loaded into memory all at once: a global threshold comes
+    from a histogram accumulated chunk by chunk, and by default the returned labels
+    are computed lazily one frame at a time. Labels can instead be made unique
+    across the whole sequence, optionally connecting objects through time.
+
+    Segmentation runs in the background, reporting progress, and can be
+    cancelled. The labels layer is added as soon as the threshold is known,
+    and frames stream into it as they're computed. Frames not yet computed
+    when a run is cancelled are computed when they're viewed. Starting a
+    new run cancels the last one in the same viewer.
 
     Returns
     -------
-    napari.types.LayerDataTuple
-        tuple of (data, meta, 'labels') for consumption by napari
+    napari.qt.threading.GeneratorWorker
+        the worker running the segmentation
     """
-    with progress(total=0):
-        # need to use threshold.value to get the function from the enum member
-        threshold_val = threshold.value(img_layer.data.compute())
-        binarised_im = img_layer.data > threshold_val
-        seg_labels = da.from_array(label(binarised_im))
+    connectivity = None
+    if connect_through_time:
+        connectivity = Connectivity.spacetime
+    elif unique_labels:
+        connectivity = Connectivity.frame
 
-    seg_layer = (seg_labels, {"name": f"{img_layer.name}_seg"}, "labels")
+    def add_layer(layer_data_tuple):
+        data, meta, _ = layer_data_tuple
+        viewer.add_labels(data, **meta)
 
-    return seg_layer
+    return _viewer_segment_runs(viewer).start(
+        _segment_worker(img_layer, threshold, per_frame, connectivity), add_layer
+    )
 
 
 # our manifest widget command points to this class
 class SegmentationDiffHighlight(QWidget):
     """Widget allows selection of two labels layers and returns a new layer
-    highlighing pixels whose values differ between the two layers."""
+    highlighing pixels whose values differ between the two layers. It can
+    also score the segmentation against the ground truth."""
 
     def __init__(self, napari_viewer):
-        """Initialize widget with two layer combo boxes and a run button
+        """Initialize widget with two layer combo boxes, a run button and a score button
 
         Parameters
         ----------
@@ -89,7 +257,20 @@ class SegmentationDiffHighlight(QWidget):
         self.viewer.layers.events.inserted.connect(self._reset_layer_options)
         self.viewer.layers.events.removed.connect(self._reset_layer_options)
 
+        # make button and label for tracking challenge scores
+        self.score_btn = QPushButton("Compute Scores")
+        self.score_btn.clicked.connect(self._compute_scores)
+        self.score_label = QLabel("")
+
+        # differences and scores are computed in the background, one run at a time
+        self.runs = BackgroundRuns()
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.runs.cancel)
+
         self.layout().addWidget(self.highlight_btn)
+        self.layout().addWidget(self.score_btn)
+        self.layout().addWidget(self.cancel_btn)
+        self.layout().addWidget(self.score_label)
         self.layout().addStretch()
 
     def add_labels_combo_box(self, label_text):
@@ -130,27 +311,87 @@ class SegmentationDiffHighlight(QWidget):
         return new_layer_combo
 
     def _compute_differences(self):
-        """Get layers selected by user and compute pixel by pixel difference"""
+        """Get layers selected by user and add their differences, by category
+
+        Pixels are coloured by whether they're a false negative, false
+        positive, split or merge (see label_differences). Frames are
+        scored as they're classified, so the scores are shown too.
+
+        Returns
+        -------
+        napari.qt.threading.GeneratorWorker
+            the worker computing the difference
+        """
 
         # grab the layer using the combo box item text as the layer name
         gt_layer = self.viewer.layers[self.gt_layer_combo.currentText()]
         seg_layer = self.viewer.layers[self.seg_layer_combo.currentText()]
 
-        # find the non-zero labels in each layer
-        truth_foreground = da.where(gt_layer.data != 0, 1, 0)
-        seg_foreground = da.where(seg_layer.data != 0, 1, 0)
+        # the difference is lazy, so the layer can be added before it's computed
+        # only frames with ground truth are classified, and scored
+        frames = DiffFrames(
+            full_resolution(gt_layer),
+            full_resolution(seg_layer),
+            annotated_frames=annotated_frames(gt_layer),
+        )
+        worker = _diff_worker(
+            frames,
+            (
+                frames.to_dask(),
+                {"name": "seg_gt_diff", "color": DIFF_COLORS},
+                "labels",
+            ),
+        )
+        self.score_label.setText("")
+
+        def add_result(result):
+            if isinstance(result, SequenceScore):
+                self._show_score(result)
+                return
+            data, meta, _ = result
+            gt_layer.visible = False
+            seg_layer.visible = False
+            self.viewer.add_labels(data, **meta)
+
+        return self.runs.start(worker, add_result)
 
-        for i in range(len(truth_foreground)):
-            if np.count_nonzero(truth_foreground[i]) == 0:
-                # we want to zero out any slices with no ground truth
-                seg_foreground[i] = da.zeros(truth_foreground[i].shape)
+    def _compute_scores(self):
+        """Get layers selected by user and show SEG and DET scores for the sequence
 
-        # where they're not equal, we need to highlight
-        diff = da.where(truth_foreground != seg_foreground, 1, 0)
+        Scores are updated as frames are scored, so a cancelled run still
+        shows the scores of the frames it got through.
 
-        gt_layer.visible = False
-        seg_layer.visible = False
-        self.viewer.add_labels(diff, name="seg_gt_diff", color={1: "#fca503"})
+        Returns
+        -------
+        napari.qt.threading.GeneratorWorker
+            the worker scoring the segmentation
+        """
+        gt_layer = self.viewer.layers[self.gt_layer_combo.currentText()]
+        seg_layer = self.viewer.layers[self.seg_layer_combo.currentText()]
+        frame_scores = []
+        self.score_label.setText("")
+
+        def add_score(frame_score):
+            frame_scores.append(frame_score)
+            self._show_score(summarise_scores(frame_scores))
+
+        return self.runs.start(
+            _score_worker(
+                full_resolution(gt_layer),
+                full_resolution(seg_layer),
+                annotated_frames(gt_layer),
+            ),
+            add_score,
+        )
+
+    def _show_score(self, sequence_score):
+        """Show sequence_score in the score label, once any frame has been scored"""
+        if not sequence_score.n_frames:
+            return
+        self.score_label.setText(
+            f"SEG: {sequence_score.seg:.3f}  DET: {sequence_score.det:.3f}\n"
+            f"({sequence_score.n_gt} objects in {sequence_score.n_frames} frames)"
+        )
 
     def _reset_layer_options(self, event):
         """Clear existing combo boxes and repopulate
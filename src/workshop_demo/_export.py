@@ -0,0 +1,381 @@
+"""
+This module encodes 2D+T label data as tracking challenge style tiffs and
+streams them straight into a zip archive. It has no napari or Qt
+dependencies, so it can be used headless as well as by the writer.
+"""
+import json
+import os
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from hashlib import blake2b
+from io import BytesIO
+from zipfile import ZIP_STORED, BadZipFile, ZipFile
+
+import numpy as np
+from tifffile import imwrite
+
+from ._constants import MANIFEST_NAME
+from ._trace import count, span
+
+# tiff compression codecs we offer, None meaning uncompressed. zstd needs imagecodecs
+COMPRESSIONS = (None, "zlib", "zstd", "lzma")
+DEFAULT_COMPRESSION = "zlib"
+# folder structure inside the archive, matching what our reader expects
+ARCHIVE_SEG_DIR = "01_AUTO/SEG"
+# number of dask chunks computed ahead of the frames being encoded
+DEFAULT_CHUNKS_IN_FLIGHT = 2
+
+# version 2 leaves out empty frames
+MANIFEST_VERSION = 2
+# an export in progress, and one that was interrupted and is being resumed
+PART_SUFFIX = ".part"
+RESUME_SUFFIX = ".resume"
+JOURNAL_SUFFIX = ".journal"
+
+# zip local file header, see section 4.3.7 of the zip APPNOTE
+LOCAL_HEADER_STRUCT = "<4s2B4HL2L2H"
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_STRUCT)
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+def frame_name(t):
+    """Tracking challenge filename of frame t"""
+    return f"seg{str(t).zfill(3)}.tif"
+
+
+def encode_frame(frame, compression=DEFAULT_COMPRESSION):
+    """Encode frame as a tiff in memory
+
+    Parameters
+    ----------
+    frame : ArrayLike
+        2D frame to encode
+    compression : str | None, optional
+        tiff compression codec, by default DEFAULT_COMPRESSION
+
+    Returns
+    -------
+    bytes
+        encoded tiff file
+    """
+    with span("export.encode", compression=str(compression)) as encode:
+        buffer = BytesIO()
+        imwrite(buffer, np.asarray(frame), compression=compression)
+        encoded = buffer.getvalue()
+        encode.set(nbytes=len(encoded))
+    count("export.encoded_bytes", len(encoded))
+    return encoded
+
+
+def iter_frames(data, chunks_in_flight=DEFAULT_CHUNKS_IN_FLIGHT):
+    """Iterate over the frames of data, computing each dask chunk only once.
+
+    Indexing a dask array frame by frame recomputes the whole chunk holding
+    each frame. Instead we compute a chunk's worth of frames along the
+    first axis at a time, in the background, with at most chunks_in_flight
+    chunks computed or computing ahead of the frame being yielded.
+
+    Parameters
+    ----------
+    data : ArrayLike
+        2D+T data, dask backed or otherwise
+    chunks_in_flight : int, optional
+        maximum number of chunks held in memory, by default DEFAULT_CHUNKS_IN_FLIGHT
+
+    Yields
+    ------
+    np.ndarray
+        each frame of data in order
+    """
+    t_chunks = getattr(data, "chunks", None)
+    if t_chunks is None:
+        # numpy arrays and friends are already in memory
+        for t in range(len(data)):
+            yield np.asarray(data[t])
+        return
+
+    bounds = np.cumsum((0,) + t_chunks[0])
+    with ThreadPoolExecutor(1) as pool:
+        in_flight = deque()
+        for t_start, t_stop in zip(bounds[:-1], bounds[1:]):
+            in_flight.append(pool.submit(np.asarray, data[t_start:t_stop]))
+            if len(in_flight) >= chunks_in_flight:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def frame_hash(frame):
+    """Content hash of frame, including its shape and dtype"""
+    frame = np.ascontiguousarray(frame)
+    frame_hasher = blake2b(digest_size=16)
+    frame_hasher.update(f"{frame.shape}{frame.dtype.str}".encode())
+    frame_hasher.update(frame.data)
+    return frame_hasher.hexdigest()
+
+
+def read_stored_member(file_handle, header_offset):
+    """Read the data of a stored (uncompressed) zip member from its local header.
+
+    This works on archives without a central directory, e.g. one left
+    behind by an export that crashed, as long as we know where the member's
+    local header starts.
+
+    Parameters
+    ----------
+    file_handle : BinaryIO
+        open zip file
+    header_offset : int
+        offset of the member's local file header
+
+    Returns
+    -------
+    bytes
+        the member's data
+    """
+    data_offset, size = stored_member_span(file_handle, header_offset)
+    file_handle.seek(data_offset)
+    return file_handle.read(size)
+
+
+def stored_member_span(file_handle, header_offset):
+    """Offset and size of the data of a stored zip member, see read_stored_member
+
+    Returns
+    -------
+    data_offset : int
+        offset of the member's data in the zip file
+    size : int
+        size of the member's data in bytes
+    """
+    file_handle.seek(header_offset)
+    header = struct.unpack(LOCAL_HEADER_STRUCT, file_handle.read(LOCAL_HEADER_SIZE))
+    signature, flag_bits, compress_type = header[0], header[3], header[4]
+    # bit 3 means the sizes follow the data rather than being in the header
+    if (
+        signature != LOCAL_HEADER_SIGNATURE
+        or compress_type != ZIP_STORED
+        or flag_bits & 0x08
+    ):
+        raise ValueError(f"No stored zip member at offset {header_offset}")
+    compressed_size, name_length, extra_length = header[8], header[10], header[11]
+    data_offset = header_offset + LOCAL_HEADER_SIZE + name_length + extra_length
+    return data_offset, compressed_size
+
+
+def _previous_frames(zip_pth, compression, open_files):
+    """Find encoded frames we can reuse from an earlier export to zip_pth.
+
+    Frames come from the manifest of a finished archive at zip_pth and
+    from the journal of an unfinished export, if there is one. Frames
+    encoded with a different compression are never reused. Each archive
+    is opened once, however many frames are copied from it.
+
+    Parameters
+    ----------
+    zip_pth : str
+        path of the archive being written
+    compression : str | None
+        tiff compression codec of the frames being written
+    open_files : contextlib.ExitStack
+        stack the earlier archives are opened on, closing them when it closes
+
+    Returns
+    -------
+    Dict[str, Tuple[str, Callable[[], bytes]]]
+        archive name to (frame hash, function returning the encoded frame)
+    """
+    previous = {}
+    try:
+        # ZipFile serialises reads of its file, so frames can be copied from threads
+        zip_file = open_files.enter_context(ZipFile(zip_pth))
+        manifest = json.loads(zip_file.read(MANIFEST_NAME))
+    except (OSError, KeyError, ValueError, BadZipFile):
+        manifest = None
+    if manifest is not None and manifest.get("compression") == compression:
+        for name, hash_ in manifest["frames"].items():
+            previous[name] = (hash_, partial(zip_file.read, name))
+
+    resume_pth = zip_pth + RESUME_SUFFIX
+    entries = []
+    try:
+        with open(resume_pth + JOURNAL_SUFFIX) as journal:
+            for line in journal:
+                entries.append(json.loads(line))
+    except OSError:
+        pass
+    except ValueError:
+        # the last line may have been cut short by the crash
+        pass
+    entries = [entry for entry in entries if entry["compression"] == compression]
+    if entries:
+        resume_file = open_files.enter_context(open(resume_pth, "rb"))
+        resume_lock = threading.Lock()
+        for entry in entries:
+            previous[entry["name"]] = (
+                entry["hash"],
+                partial(_read_offset, resume_file, resume_lock, entry["offset"]),
+            )
+    return previous
+
+
+def _read_offset(file_handle, lock, header_offset):
+    # the handle is shared by every thread copying frames from it
+    with lock:
+        return read_stored_member(file_handle, header_offset)
+
+
+def iter_write_zip(
+    data,
+    zip_pth,
+    compression=DEFAULT_COMPRESSION,
+    max_workers=None,
+    chunks_in_flight=DEFAULT_CHUNKS_IN_FLIGHT,
+    arc_dir=ARCHIVE_SEG_DIR,
+    reuse=True,
+    skip_empty=True,
+):
+    """Encode each frame of data in parallel and stream it into a zip archive.
+
+    Frames are encoded on a thread pool, with at most twice as many frames
+    in flight as there are workers, and each encoded tiff is written into
+    the archive as soon as it and every frame before it are done. Entries
+    are stored rather than deflated, since the tiffs are already compressed.
+
+    Dask backed data is computed one chunk at a time, see iter_frames, so
+    peak memory stays at chunks_in_flight chunks plus the frames in flight.
+
+    The archive is written next to zip_pth and only moved into place once
+    complete, so zip_pth never holds a partial archive. A manifest of each
+    frame's content hash is stored in the archive, and a journal of the
+    frames written so far is kept beside the unfinished archive. When
+    reuse is True, frames whose hash matches one in a previous archive at
+    zip_pth, or in an export that was interrupted, are copied across as
+    they are instead of being encoded again.
+
+    Labels are often sparse, e.g. ground truth only annotates a few frames,
+    so with skip_empty frames without any labels aren't written at all. The
+    manifest records the length of the whole sequence, so readers can
+    still place the frames that were written, whether the archive is read
+    as it is or extracted.
+
+    This is a generator, yielding the index of each frame once it has been
+    written, so callers can report progress or stop early.
+
+    Parameters
+    ----------
+    data : ArrayLike
+        2D+T data to write, one tiff per frame
+    zip_pth : str
+        path of the zip archive to write
+    compression : str | None, optional
+        tiff compression codec, one of COMPRESSIONS, by default DEFAULT_COMPRESSION
+    max_workers : int | None, optional
+        number of encoding threads, by default one per core
+    chunks_in_flight : int, optional
+        maximum number of dask chunks held in memory, by default DEFAULT_CHUNKS_IN_FLIGHT
+    arc_dir : str, optional
+        directory inside the archive to write tiffs to, by default ARCHIVE_SEG_DIR
+    reuse : bool, optional
+        whether to reuse unchanged frames from earlier exports, by default True
+    skip_empty : bool, optional
+        whether to leave out frames that are all zero, by default True
+
+    Yields
+    ------
+    int
+        index of the frame just written, or skipped
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(
+            f"Unknown compression {compression!r}, expected one of {COMPRESSIONS}"
+        )
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    part_pth = zip_pth + PART_SUFFIX
+    resume_pth = zip_pth + RESUME_SUFFIX
+    if reuse and os.path.exists(part_pth + JOURNAL_SUFFIX):
+        # keep what an interrupted export managed to write, so we can copy from it
+        os.replace(part_pth, resume_pth)
+        os.replace(part_pth + JOURNAL_SUFFIX, resume_pth + JOURNAL_SUFFIX)
+    frame_hashes = {}
+    with ExitStack() as open_files, ThreadPoolExecutor(max_workers) as pool, ZipFile(
+        part_pth, "w", ZIP_STORED
+    ) as zip_file, open(part_pth + JOURNAL_SUFFIX, "w") as journal:
+        previous = _previous_frames(zip_pth, compression, open_files) if reuse else {}
+
+        def write_frame(t, encoded):
+            name = f"{arc_dir}/{frame_name(t)}"
+            with span("export.write_member", member=name, nbytes=len(encoded)):
+                zip_file.writestr(name, encoded)
+                info = zip_file.getinfo(name)
+                # the frame has to be on disk before the journal says it is
+                zip_file.fp.flush()
+            count("export.written_bytes", len(encoded))
+            journal_entry = {
+                "name": name,
+                "hash": frame_hashes[name],
+                "offset": info.header_offset,
+                "compression": compression,
+            }
+            journal.write(json.dumps(journal_entry) + "\n")
+            journal.flush()
+
+        def write_next():
+            t_done, encoding = in_flight.popleft()
+            if encoding is not None:
+                write_frame(t_done, encoding.result())
+            return t_done
+
+        # (frame index, future encoding it, or None if it's skipped)
+        in_flight = deque()
+        n_frames = 0
+        for t, frame in enumerate(iter_frames(data, chunks_in_flight)):
+            n_frames = t + 1
+            name = f"{arc_dir}/{frame_name(t)}"
+            if skip_empty and not frame.any():
+                count("export.skipped_frames")
+                in_flight.append((t, None))
+            else:
+                frame_hashes[name] = frame_hash(frame)
+                previous_hash, read_previous = previous.get(name, (None, None))
+                if previous_hash == frame_hashes[name]:
+                    # unchanged since the last export, so we copy the bytes across
+                    in_flight.append((t, pool.submit(read_previous)))
+                else:
+                    encoding = pool.submit(encode_frame, frame, compression)
+                    in_flight.append((t, encoding))
+            # write frames out in order, keeping the number in memory bounded
+            if len(in_flight) >= 2 * max_workers:
+                yield write_next()
+        while in_flight:
+            yield write_next()
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "compression": compression,
+            "n_frames": n_frames,
+            "frames": frame_hashes,
+        }
+        zip_file.writestr(MANIFEST_NAME, json.dumps(manifest))
+
+    os.replace(part_pth, zip_pth)
+    for leftover_pth in (
+        part_pth + JOURNAL_SUFFIX,
+        resume_pth,
+        resume_pth + JOURNAL_SUFFIX,
+    ):
+        if os.path.exists(leftover_pth):
+            os.remove(leftover_pth)
+
+
+def write_zip(data, zip_pth, **kwargs):
+    """Write data to zip_pth, see iter_write_zip for keyword arguments"""
+    for _ in iter_write_zip(data, zip_pth, **kwargs):
+        pass
+    return zip_pth
@@ -0,0 +1,286 @@
+"""
+This module provides lazy array-like views of a stack of frames, so a
+whole tracking challenge sequence can be wrapped in a dask array without
+building a graph node per frame. Frames come either from a frame index
+on disk, or from a lazy result computed in the background.
+"""
+import os
+import threading
+from functools import partial
+from io import BytesIO
+
+import dask
+import dask.array as da
+import numpy as np
+import tifffile
+
+from ._archive import read_member
+from ._cache import frame_cache
+from ._disk_cache import cache_key, get_disk_cache, is_fingerprinted
+from ._trace import count, span
+
+
+def read_frame(info):
+    """Read the frame described by info into a numpy array
+
+    Frames stored uncompressed and contiguously are returned as a read-only
+    memmap of the file, so no copy is made and the OS page cache does the
+    caching. Everything else is decoded by tifffile. Frames in a zip archive
+    are read straight from it, see _archive.
+
+    Parameters
+    ----------
+    info : FrameInfo
+        index entry of the frame to read
+
+    Returns
+    -------
+    np.ndarray
+        decoded or memory-mapped frame
+    """
+    if info.offset is not None:
+        count("frames.memmapped")
+        return np.memmap(
+            info.archive or info.path,
+            dtype=info.dtype,
+            mode="r",
+            offset=info.offset,
+            shape=info.shape,
+        )
+    with span("frames.decode", path=info.path) as decode:
+        tif_file = info.path
+        if info.archive is not None:
+            tif_file = BytesIO(read_member(info))
+        with tifffile.TiffFile(tif_file) as im_tif:
+            im = im_tif.pages[0].asarray()
+        decode.set(nbytes=im.nbytes)
+    count("frames.decoded_bytes", im.nbytes)
+    return im
+
+
+class _FrameArray:
+    """Array-like indexing over get_frame, which subclasses must provide"""
+
+    def __len__(self):
+        return self.shape[0]
+
+    def get_frame(self, t):
+        raise NotImplementedError
+
+    def prefetch_around(self, t):
+        """Start loading frames either side of t in the background, if we can"""
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        t_key, frame_key = key[0], key[1:]
+
+        if isinstance(t_key, (int, np.integer)):
+            t = range(self.shape[0])[t_key]
+            self.prefetch_around(t)
+            return self.get_frame(t)[frame_key]
+
+        frames = range(self.shape[0])[t_key]
+        if len(frames) == 1:
+            # this is what the time slider asks for, so it's worth prefetching
+            self.prefetch_around(frames[0])
+            # a view of the one frame saves copying it into a new stack
+            return self.get_frame(frames[0])[frame_key][np.newaxis]
+        if not len(frames):
+            empty_frame = np.empty(self.shape[1:], dtype=self.dtype)[frame_key]
+            return np.empty((0,) + empty_frame.shape, dtype=self.dtype)
+        return np.stack([self.get_frame(t)[frame_key] for t in frames])
+
+
+class FrameStack(_FrameArray):
+    """Array-like stack of the frames in a FrameIndex, read on demand.
+
+    Frames missing from the index (e.g. unannotated ground truth frames)
+    are all served from one shared, read-only zero buffer.
+
+    Parameters
+    ----------
+    index : FrameIndex
+        index of the frames to serve
+    n_frames : int
+        total number of frames in the stack, which may be more than the
+        number of frames in the index
+    cache : FrameCache, optional
+        cache of decoded frames, by default the cache shared by all layers
+    """
+
+    def __init__(self, index, n_frames, cache=frame_cache):
+        self.index = index
+        self.cache = cache
+        self.frame_shape = tuple(index.shape)
+        self.dtype = np.dtype(index.dtype)
+        self.shape = (n_frames,) + self.frame_shape
+        self.ndim = len(self.shape)
+
+        self._zeros = np.zeros(self.frame_shape, dtype=self.dtype)
+        self._zeros.flags.writeable = False
+
+    def _cache_entry(self, info):
+        # mtime is part of the key, and get_frame_index can refresh it for
+        # files rewritten in place, so a rewritten file isn't served stale
+        return (info.path, info.mtime), partial(read_frame, info)
+
+    def get_frame(self, t):
+        """Return frame t, or the shared zero frame if it isn't indexed"""
+        info = self.index.frames.get(t)
+        if info is None:
+            return self._zeros
+        # memmaps cost nothing to make and would only crowd decoded frames
+        # out of the cache, so they skip it
+        if info.offset is not None:
+            return read_frame(info)
+        return self.cache.get(*self._cache_entry(info))
+
+    def prefetch_around(self, t):
+        """Start loading indexed frames either side of t in the background"""
+        k = self.cache.prefetch
+        neighbours = [
+            self.index.frames[near_t]
+            for near_t in range(t - k, t + k + 1)
+            if near_t != t
+            and near_t in self.index.frames
+            and self.index.frames[near_t].offset is None
+        ]
+        if neighbours:
+            self.cache.prefetch_frames(self._cache_entry(info) for info in neighbours)
+
+
+class CachedFrames(_FrameArray):
+    """Array-like view of a lazy dask array, serving its frames through a cache.
+
+    Computing a frame stores it in the cache, so frames computed ahead of
+    time in the background (see compute_frames) are served instantly, and
+    frames that haven't been, or have since been evicted, are computed on
+    demand.
+
+    Computed frames are also saved to the shared disk cache, see
+    _disk_cache, keyed by the source's name, and later served from it as
+    memmaps, even in a new session. That's only if the source's name is
+    a fingerprint of its data, see is_fingerprinted. Given a store_dir, they're saved there
+    as .npy files instead.
+
+    Parameters
+    ----------
+    source : dask.array.Array
+        lazy data to serve, whose name identifies it in the cache
+    cache : FrameCache, optional
+        cache of computed frames, by default the cache shared by all layers
+    store_dir : str, optional
+        directory to persist computed frames in, by default None
+    """
+
+    def __init__(self, source, cache=frame_cache, store_dir=None):
+        self.source = source
+        self.cache = cache
+        self.store_dir = store_dir
+        self.shape = source.shape
+        self.dtype = source.dtype
+        self.ndim = source.ndim
+        # a source whose name can outlive its data would be served stale
+        self._disk_cacheable = is_fingerprinted(source)
+
+    def _disk_cache(self):
+        """The shared disk cache, or None if it's off or can't key our frames"""
+        return get_disk_cache() if self._disk_cacheable else None
+
+    def _cache_key(self, t):
+        return (self.source.name, t)
+
+    def _cache_entry(self, t):
+        return self._cache_key(t), partial(self._compute_frame, t)
+
+    def _compute_frame(self, t):
+        (frame,) = self._compute([t])
+        return frame
+
+    def _compute(self, frames):
+        with span("frames.compute", source=self.source.name, n_frames=len(frames)):
+            return self._compute_or_load(frames)
+
+    def _compute_or_load(self, frames):
+        """frames saved by an earlier session, and the rest computed in one go"""
+        loaded = {t: self._load(t) for t in frames}
+        missing = [t for t in frames if loaded[t] is None]
+        # one dask call computes chunks shared by several frames once, in parallel
+        computed = dask.compute(*[self.source[t] for t in missing])
+        for t, frame in zip(missing, computed):
+            loaded[t] = np.asarray(frame)
+            self._save(t, loaded[t])
+        return [loaded[t] for t in frames]
+
+    def _frame_pth(self, t):
+        return os.path.join(self.store_dir, f"t{t:03}.npy")
+
+    def _load(self, t):
+        """Frame t as saved in store_dir or the disk cache, or None"""
+        if self.store_dir is not None:
+            try:
+                return np.load(self._frame_pth(t), mmap_mode="r")
+            except (OSError, ValueError):
+                return None
+        disk_cache = self._disk_cache()
+        if disk_cache is None:
+            return None
+        return disk_cache.get_array(cache_key("frame", self.source.name, t))
+
+    def _save(self, t, frame):
+        """Save frame t to store_dir or the disk cache, for later sessions"""
+        if self.store_dir is None:
+            disk_cache = self._disk_cache()
+            if disk_cache is not None:
+                disk_cache.put_array(cache_key("frame", self.source.name, t), frame)
+            return
+
+        frame_pth = self._frame_pth(t)
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            # written under a temporary name so a frame is never half-saved
+            part_pth = f"{frame_pth}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(part_pth, "wb") as part_file:
+                np.save(part_file, frame)
+            os.replace(part_pth, frame_pth)
+        except OSError:
+            # read-only storage just means recomputing in later sessions
+            pass
+
+    def get_frame(self, t):
+        """Return frame t, computing it if it isn't cached"""
+        return self.cache.get(*self._cache_entry(t))
+
+    def compute_frames(self, frames):
+        """Compute frames into the cache in one dask call, skipping any already there
+
+        Frames are computed in this thread, with dask's own threads, rather
+        than on the cache's prefetch threads, which the frames they're
+        computed from may need. Frames being computed are marked as pending
+        in the cache, so viewing one meanwhile waits for it rather than
+        computing it again.
+
+        Parameters
+        ----------
+        frames : Iterable[int]
+            indices of the frames to compute
+        """
+        frames = list(frames)
+        frame_of_key = {self._cache_key(t): t for t in frames}
+        self.cache.load_frames(
+            frame_of_key,
+            lambda keys: self._compute([frame_of_key[key] for key in keys]),
+        )
+        # frames someone else was computing are waited for
+        for t in frames:
+            self.get_frame(t)
+
+    def to_dask(self):
+        """Wrap these frames in a dask array with one chunk per frame"""
+        return da.from_array(
+            self,
+            chunks=(1,) + self.shape[1:],
+            name="cached-" + self.source.name,
+            meta=np.empty((0,) * self.ndim, dtype=self.dtype),
+        )
@@ -0,0 +1,468 @@
+"""
+This module builds and caches an index of the frames in a tracking
+challenge directory, so that the reader can detect, inspect and read a
+sequence from a single directory scan.
+
+The index maps frame number to the frame's path, shape, dtype, file
+modification time and size, along with the offset of the frame's pixels if they
+are stored uncompressed and contiguously and so can be memory-mapped.
+It is kept in memory for the lifetime of the session and saved next to
+the dataset directory, or in the shared disk cache if the dataset is on
+read-only storage, so reopening a dataset that hasn't changed skips the
+scan entirely. Rewriting a file in place doesn't change its directory's
+mtime, so where that happens, e.g. to ground truth edited by an
+annotation tool, each file can also be stat'ed against the index before
+it's trusted, and any that changed have their header read again. That's
+a pass over every file each time the index is asked for, so it's only
+done when asked for, or when WORKSHOP_DEMO_CHECK_FILES is set.
+"""
+import json
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from ._disk_cache import cache_key, get_disk_cache
+from ._trace import span
+
+# bump this whenever the on-disk layout of the index changes
+INDEX_VERSION = 3
+# number of threads used to read tiff headers - mostly waiting on storage
+HEADER_READ_WORKERS = 8
+
+# number of tifs napari_get_reader's probe checks before accepting a directory
+PROBE_SAMPLE_SIZE = 64
+# set to anything but 0 to check every file of a reused index, see refresh_index
+CHECK_FILES_ENV = "WORKSHOP_DEMO_CHECK_FILES"
+
+# indices we've already built this session, keyed by directory path
+_INDEX_CACHE = {}
+# (dir_mtime, is_valid) of directories we've probed or scanned, keyed by
+# (directory path, tif regex), so failed probes aren't repeated either
+_PROBE_CACHE = {}
+
+
+class FrameInfo(NamedTuple):
+    """Everything we need to know about a frame without decoding it"""
+
+    path: str
+    mtime: float
+    # size of the file, or of the member for frames in an archive
+    size: Optional[int] = None
+    shape: Optional[Tuple[int, ...]] = None
+    dtype: Optional[str] = None
+    # byte offset of the pixel data, only set if the frame can be memory-mapped
+    offset: Optional[int] = None
+    # zip archive holding the frame, whose path is then the archive's path
+    # joined with the member's name, see _archive
+    archive: Optional[str] = None
+    # offset of the member's local header, only set if it's stored uncompressed
+    member_offset: Optional[int] = None
+
+
+class FrameIndex:
+    """Frame number to FrameInfo mapping for one directory of tifs.
+
+    Parameters
+    ----------
+    dir_pth : str
+        absolute path to the directory holding the tifs
+    tif_regex : str
+        regex every tif in the directory matched, with the frame number
+        as its last group
+    dir_mtime : float
+        modification time of dir_pth when it was scanned
+    frames : Dict[int, FrameInfo]
+        frame number to frame information
+    """
+
+    def __init__(self, dir_pth, tif_regex, dir_mtime, frames):
+        self.dir_pth = dir_pth
+        self.tif_regex = tif_regex
+        self.dir_mtime = dir_mtime
+        self.frames = frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def frame_numbers(self):
+        """Sorted frame numbers present in the directory"""
+        return sorted(self.frames)
+
+    @property
+    def n_frames(self):
+        """Number of frames in the sequence, assuming it starts at frame 0"""
+        return max(self.frames) + 1
+
+    @property
+    def has_headers(self):
+        return all(info.shape is not None for info in self.frames.values())
+
+    @property
+    def shape(self):
+        """Shape of a single frame"""
+        self.load_headers()
+        return self.frames[self.frame_numbers[0]].shape
+
+    @property
+    def dtype(self):
+        """Dtype of a single frame"""
+        self.load_headers()
+        return self.frames[self.frame_numbers[0]].dtype
+
+    def load_headers(self):
+        """Read shape, dtype and offset of every frame that doesn't have them yet.
+
+        Headers are read in parallel, since on network storage the time
+        goes to waiting on each file rather than parsing it. Once every
+        header is known the index is saved next to the dataset.
+        """
+        missing = [frame for frame, info in self.frames.items() if info.shape is None]
+        if not missing:
+            return
+
+        with span("index.read_headers", dir=self.dir_pth, n_frames=len(missing)):
+            with ThreadPoolExecutor(HEADER_READ_WORKERS) as pool:
+                infos = pool.map(
+                    lambda frame: self.read_header(self.frames[frame]), missing
+                )
+                for frame, info in zip(missing, infos):
+                    self.frames[frame] = info
+        self.save()
+
+    def read_header(self, info):
+        """Return a copy of info with shape, dtype and offset read from the tif"""
+        return _read_header(info)
+
+    def save(self):
+        """Save the index next to the dataset"""
+        save_index(self)
+
+    def to_dict(self):
+        return {
+            "version": INDEX_VERSION,
+            "tif_regex": self.tif_regex,
+            "dir_mtime": self.dir_mtime,
+            "frames": {
+                str(frame): {
+                    "name": os.path.basename(info.path),
+                    "mtime": info.mtime,
+                    "size": info.size,
+                    "shape": info.shape,
+                    "dtype": info.dtype,
+                    "offset": info.offset,
+                }
+                for frame, info in self.frames.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, dir_pth, index_dict):
+        frames = {}
+        for frame, info in index_dict["frames"].items():
+            shape = info["shape"]
+            frames[int(frame)] = FrameInfo(
+                path=os.path.join(dir_pth, info["name"]),
+                mtime=info["mtime"],
+                size=info["size"],
+                shape=tuple(shape) if shape is not None else None,
+                dtype=info["dtype"],
+                offset=info["offset"],
+            )
+        return cls(dir_pth, index_dict["tif_regex"], index_dict["dir_mtime"], frames)
+
+
+def _read_header(info):
+    """Return a copy of info with shape, dtype and offset read from the tif header"""
+    # napari probes the reader for every path it opens, and only needs headers
+    # once we're reading, so tifffile isn't imported with the module
+    import tifffile
+
+    with tifffile.TiffFile(info.path) as im_tif:
+        return header_info(info, im_tif)
+
+
+def header_info(info, im_tif, data_offset=0):
+    """Return a copy of info with shape, dtype and offset of im_tif's first page
+
+    Parameters
+    ----------
+    info : FrameInfo
+        frame im_tif was opened from
+    im_tif : tifffile.TiffFile
+        open tif of the frame
+    data_offset : int | None, optional
+        offset of the tif in the file holding it, or None if it can't be
+        memory-mapped from there, by default 0
+    """
+    import numpy as np
+
+    page = im_tif.pages[0]
+    dtype = np.dtype(page.dtype)
+    offset = None
+    if data_offset is not None and _is_memmappable(page, dtype, im_tif.byteorder):
+        offset = data_offset + int(page.dataoffsets[0])
+    return info._replace(shape=tuple(page.shape), dtype=str(dtype), offset=offset)
+
+
+def _is_memmappable(page, dtype, byteorder):
+    """Whether page's pixels can be served as a memmap straight from the file.
+
+    The pixels need to be uncompressed, untiled and stored in one contiguous,
+    aligned run in native byte order. Anything else has to be decoded.
+    """
+    native_order = dtype.itemsize == 1 or byteorder == (
+        "<" if sys.byteorder == "little" else ">"
+    )
+    return bool(
+        page.compression == 1
+        and not page.is_tiled
+        and page.is_contiguous
+        and native_order
+        and page.dataoffsets[0] % dtype.itemsize == 0
+    )
+
+
+def index_path(dir_pth):
+    """Path of the on-disk index for dir_pth.
+
+    The index lives beside the directory rather than in it, because
+    writing into the directory would change its mtime and invalidate
+    the index we just wrote.
+    """
+    parent, name = os.path.split(dir_pth)
+    return os.path.join(parent, f".{name}.workshop_demo_index.json")
+
+
+def save_index(index):
+    """Write index next to its directory, or to the disk cache if that's read-only"""
+    index_dict = index.to_dict()
+    try:
+        with open(index_path(index.dir_pth), "w") as index_file:
+            json.dump(index_dict, index_file)
+    except OSError:
+        disk_cache = get_disk_cache()
+        if disk_cache is not None:
+            disk_cache.put_json(cache_key("index", index.dir_pth), index_dict)
+
+
+def load_index(dir_pth, tif_regex, dir_mtime):
+    """Load the on-disk index for dir_pth if it is still valid, else None"""
+    try:
+        with open(index_path(dir_pth)) as index_file:
+            index_dict = json.load(index_file)
+    except (OSError, ValueError):
+        disk_cache = get_disk_cache()
+        if disk_cache is None:
+            return None
+        index_dict = disk_cache.get_json(cache_key("index", dir_pth))
+        if index_dict is None:
+            return None
+
+    if (
+        index_dict.get("version") != INDEX_VERSION
+        or index_dict.get("tif_regex") != tif_regex
+        or index_dict.get("dir_mtime") != dir_mtime
+    ):
+        return None
+    return FrameIndex.from_dict(dir_pth, index_dict)
+
+
+def refresh_index(index):
+    """Forget the headers of frames whose file changed since index was built.
+
+    Files rewritten in place keep their directory's mtime, so each is
+    stat'ed against the mtime and size in the index. Changed frames keep
+    their path, and their header, including any memmap offset, is read
+    again when it's next needed.
+
+    Parameters
+    ----------
+    index : FrameIndex
+        index to refresh in place
+
+    Returns
+    -------
+    bool
+        False if a frame's file is gone, so the directory needs scanning again
+    """
+    changed = False
+    for frame, info in list(index.frames.items()):
+        try:
+            stat = os.stat(info.path)
+        except OSError:
+            return False
+        if stat.st_mtime != info.mtime or stat.st_size != info.size:
+            index.frames[frame] = FrameInfo(
+                path=info.path, mtime=stat.st_mtime, size=stat.st_size
+            )
+            changed = True
+    if changed:
+        index.save()
+    return True
+
+
+def scan_dir(dir_pth, tif_regex, dir_mtime):
+    """Scan dir_pth once, matching every tif against tif_regex.
+
+    Parameters
+    ----------
+    dir_pth : str
+        absolute path to directory to scan
+    tif_regex : str
+        regex each tif path must match, with frame number as last group
+    dir_mtime : float
+        modification time of dir_pth
+
+    Returns
+    -------
+    FrameIndex | None
+        index of the directory's frames, or None if there are no tifs or
+        any tif doesn't match tif_regex
+    """
+    frames: Dict[int, FrameInfo] = {}
+    with os.scandir(dir_pth) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".tif"):
+                continue
+            tif_match = re.match(tif_regex, os.path.join(dir_pth, entry.name))
+            if not tif_match:
+                return None
+            frame = int(tif_match.groups()[-1])
+            stat = entry.stat()
+            frames[frame] = FrameInfo(
+                path=entry.path, mtime=stat.st_mtime, size=stat.st_size
+            )
+
+    if not frames:
+        return None
+    return FrameIndex(dir_pth, tif_regex, dir_mtime, frames)
+
+
+def _sample_dir(dir_pth, tif_regex, sample_size):
+    """Whether the first sample_size tifs listed in dir_pth all match tif_regex"""
+    tif_pattern = re.compile(tif_regex)
+    n_tifs = 0
+    with os.scandir(dir_pth) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".tif"):
+                continue
+            if not tif_pattern.match(os.path.join(dir_pth, entry.name)):
+                return False
+            n_tifs += 1
+            if n_tifs >= sample_size:
+                return True
+    return n_tifs > 0
+
+
+def probe_dir(dir_pth, tif_regex, sample_size=PROBE_SAMPLE_SIZE):
+    """Quickly check whether dir_pth looks like a directory of tif_regex tifs.
+
+    This answers napari's reader probe without indexing the directory.
+    A valid index in memory or on disk is trusted. Otherwise the directory
+    is listed only until its first tif that doesn't match, or until
+    sample_size matching tifs have been seen. No file is stat'ed or
+    opened. Answers are cached against the directory's mtime.
+
+    Because only a sample is checked, a directory can pass the probe and
+    still be rejected by get_frame_index, which checks every tif.
+
+    Parameters
+    ----------
+    dir_pth : str
+        path to directory of tifs
+    tif_regex : str
+        regex each tif path must match, with frame number as last group
+    sample_size : int, optional
+        number of matching tifs to accept the directory after, by default
+        PROBE_SAMPLE_SIZE
+
+    Returns
+    -------
+    bool
+        True if the directory has tifs, and every tif checked matched
+    """
+    dir_pth = os.path.abspath(str(dir_pth))
+    try:
+        dir_mtime = os.stat(dir_pth).st_mtime
+    except OSError:
+        return False
+
+    probed = _PROBE_CACHE.get((dir_pth, tif_regex))
+    if probed is not None and probed[0] == dir_mtime:
+        return probed[1]
+
+    with span("index.probe_dir", dir=dir_pth):
+        index = _cached_index(dir_pth, tif_regex, dir_mtime)
+        is_valid = index is not None or _sample_dir(dir_pth, tif_regex, sample_size)
+    _PROBE_CACHE[(dir_pth, tif_regex)] = (dir_mtime, is_valid)
+    return is_valid
+
+
+def _cached_index(dir_pth, tif_regex, dir_mtime):
+    """The index of dir_pth from memory or disk, if either is up to date"""
+    index = _INDEX_CACHE.get(dir_pth)
+    if (
+        index is not None
+        and index.tif_regex == tif_regex
+        and index.dir_mtime == dir_mtime
+    ):
+        return index
+
+    index = load_index(dir_pth, tif_regex, dir_mtime)
+    if index is not None:
+        _INDEX_CACHE[dir_pth] = index
+    return index
+
+
+def get_frame_index(dir_pth, tif_regex, check_files=None):
+    """Return the frame index of dir_pth, scanning only when it has changed.
+
+    The index is looked up in this session's memory first, then on disk
+    next to the dataset, and only if neither is up to date with the
+    directory's mtime do we scan the directory again. A directory already
+    found invalid since it last changed isn't scanned again. Given
+    check_files, frames of an index we reuse are checked for being
+    rewritten in place, see refresh_index.
+
+    Parameters
+    ----------
+    dir_pth : str
+        path to directory of tifs
+    tif_regex : str
+        regex each tif path must match, with frame number as last group
+    check_files : bool, optional
+        whether to stat every file of a reused index, by default only if
+        WORKSHOP_DEMO_CHECK_FILES is set to anything but 0
+
+    Returns
+    -------
+    FrameIndex | None
+        index of the directory's frames, or None if the directory doesn't
+        exist, has no tifs or has tifs not matching tif_regex
+    """
+    dir_pth = os.path.abspath(str(dir_pth))
+    try:
+        dir_mtime = os.stat(dir_pth).st_mtime
+    except OSError:
+        return None
+
+    if check_files is None:
+        check_files = os.environ.get(CHECK_FILES_ENV, "0") not in ("", "0")
+    index = _cached_index(dir_pth, tif_regex, dir_mtime)
+    if index is not None and (not check_files or refresh_index(index)):
+        return index
+    if _PROBE_CACHE.get((dir_pth, tif_regex)) == (dir_mtime, False):
+        return None
+
+    with span("index.scan_dir", dir=dir_pth) as scan:
+        index = scan_dir(dir_pth, tif_regex, dir_mtime)
+        scan.set(n_frames=len(index) if index is not None else 0)
+    _PROBE_CACHE[(dir_pth, tif_regex)] = (dir_mtime, index is not None)
+    if index is None:
+        return None
+    save_index(index)
+    _INDEX_CACHE[dir_pth] = index
+    return index
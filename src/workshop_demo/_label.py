@@ -0,0 +1,190 @@
+"""
+This module labels the connected components of large 2D+T binary images
+block by block, giving every object one label across the whole array. It
+has no napari or Qt dependencies.
+
+Each dask chunk is labelled independently, labels are offset so no two
+chunks share any, and objects touching across chunk boundaries are
+merged by finding the connected components of the graph of label pairs
+found on each boundary. Finally labels are renumbered consecutively from 1.
+
+Labelling each chunk, which counts its labels and keeps the labels on its
+faces, is one parallel pass over the data, computed up front with dask's
+local scheduler. Pairs are found from the kept faces as soon as both sides
+of a boundary are labelled, so only the faces of about one slab of chunks
+are held at a time. The result is then a lazy dask array whose chunks are
+each relabelled on their own when they're requested, the second pass.
+"""
+from enum import Enum
+
+import dask
+import dask.array as da
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from ._steps import Progress, batches, run_steps
+from ._trace import span
+
+
+class Connectivity(Enum):
+    # objects are connected within each frame only
+    frame = "frame"
+    # objects are also connected to overlapping objects in neighbouring frames
+    spacetime = "spacetime"
+
+
+def _connects_time(ndim, connectivity):
+    """Whether objects are connected along axis 0, which is time in 3D and up"""
+    # a 2D image is a single frame, whose objects are connected along both axes
+    return ndim < 3 or Connectivity(connectivity) is Connectivity.spacetime
+
+
+def _structure(ndim, connectivity):
+    """Face connectivity structure, without time neighbours for frame connectivity"""
+    structure = ndimage.generate_binary_structure(ndim, 1)
+    if not _connects_time(ndim, connectivity):
+        structure[0] = False
+        structure[2] = False
+    return structure
+
+
+def _label_faces(block, structure, axes):
+    """Number of labels in block, and its first and last slices along each of axes"""
+    labels, n_labels = ndimage.label(block, structure=structure)
+    faces = {
+        axis: (np.take(labels, 0, axis=axis), np.take(labels, -1, axis=axis))
+        for axis in axes
+    }
+    return n_labels, faces
+
+
+def _label_block(block, structure, offsets, mapping=None, block_id=None):
+    """Label block, offset by the labels in all blocks before it, then map them"""
+    labels, _ = ndimage.label(block, structure=structure)
+    labels = labels.astype(np.int64)
+    labels[labels > 0] += offsets[block_id]
+    if mapping is None:
+        return labels
+    return mapping[labels]
+
+
+def _face_pairs(before, before_offset, after, after_offset):
+    """Pairs of global labels touching across the boundary between two faces"""
+    touching = (before > 0) & (after > 0)
+    pairs = np.stack(
+        [before[touching] + before_offset, after[touching] + after_offset], axis=1
+    )
+    return np.unique(pairs, axis=0)
+
+
+def _merged_labels(n_labels, *face_pairs):
+    """Map every block label to its final, consecutive global label.
+
+    Labels touching across a boundary are connected in a graph, and each
+    of its connected components is given the next unused label from 1.
+    """
+    pairs = np.concatenate([np.empty((0, 2), dtype=np.int64), *face_pairs])
+    graph = coo_matrix(
+        (np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])),
+        shape=(n_labels + 1, n_labels + 1),
+    )
+    # components are numbered in order of their lowest label, so background,
+    # which touches nothing, keeps 0
+    _, mapping = connected_components(graph, directed=False)
+    return mapping.astype(np.int32)
+
+
+def label_components_steps(binary, connectivity=Connectivity.frame, batch_size=None):
+    """Steps of label_components, reporting progress as blocks are labelled
+
+    Yields
+    ------
+    Progress
+        number of blocks labelled so far
+
+    Returns
+    -------
+    dask.array.Array
+        see label_components
+    """
+    binary = da.asarray(binary)
+    structure = _structure(binary.ndim, connectivity)
+
+    # label every block once, counting its labels so each block's labels can
+    # be offset by the number of labels in all blocks before it, and keeping
+    # its faces along every axis objects are connected on
+    axes = [
+        axis
+        for axis in range(binary.ndim)
+        if axis or _connects_time(binary.ndim, connectivity)
+    ]
+    blocks = binary.to_delayed()
+    block_indices = list(np.ndindex(blocks.shape))
+    offsets = np.zeros(blocks.shape, dtype=np.int64)
+    n_labels = 0
+    # last faces of labelled blocks, by block and axis, until the block
+    # after them along that axis is labelled
+    last_faces = {}
+    face_pairs = []
+    n_labelled = 0
+    for batch in batches(block_indices, batch_size):
+        with span("label.label_blocks", n_blocks=len(batch)):
+            batch_results = dask.compute(
+                *[
+                    dask.delayed(_label_faces)(blocks[index], structure, axes)
+                    for index in batch
+                ]
+            )
+        # blocks come in C order, so every block before one is already labelled
+        for index, (count, faces) in zip(batch, batch_results):
+            offsets[index] = n_labels
+            n_labels += count
+            for axis, (first, last) in faces.items():
+                if index[axis] > 0:
+                    before_index = index[:axis] + (index[axis] - 1,) + index[axis + 1 :]
+                    face_pairs.append(
+                        _face_pairs(
+                            last_faces.pop((before_index, axis)),
+                            offsets[before_index],
+                            first,
+                            offsets[index],
+                        )
+                    )
+                if index[axis] < blocks.shape[axis] - 1:
+                    last_faces[index, axis] = last
+        n_labelled += len(batch)
+        yield Progress("Labelling blocks", n_labelled, len(block_indices))
+
+    with span("label.merge_labels", n_labels=n_labels):
+        mapping = _merged_labels(n_labels, *face_pairs)
+    return binary.map_blocks(
+        _label_block,
+        structure,
+        offsets,
+        mapping,
+        dtype=np.int32,
+        meta=np.empty((0,) * binary.ndim, dtype=np.int32),
+    )
+
+
+def label_components(binary, connectivity=Connectivity.frame):
+    """Label connected components of binary with globally unique labels.
+
+    Parameters
+    ----------
+    binary : ArrayLike
+        2D+T (or nD) boolean image, dask backed or otherwise
+    connectivity : Connectivity | str, optional
+        "frame" to connect pixels within each frame only, or "spacetime"
+        to also connect them through time, by default Connectivity.frame.
+        A 2D image is a single frame, so both connect it along both axes
+
+    Returns
+    -------
+    dask.array.Array
+        lazy int32 labels, chunked like binary, with labels numbered
+        consecutively from 1 across the whole array
+    """
+    return run_steps(label_components_steps(binary, connectivity))
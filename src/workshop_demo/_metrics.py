@@ -0,0 +1,320 @@
+"""
+This module scores a segmentation against tracking challenge ground truth
+with the challenge's SEG and DET measures, frame by frame. It has no
+napari or Qt dependencies, so sequences can be scored headless.
+
+SEG is the mean Jaccard index of each ground truth object with the
+segmented object covering more than half of it (0 if there is none).
+DET is computed from the detection part of the AOGM measure: the weighted
+cost of the splits, false negatives and false positives needed to turn the
+segmentation into the ground truth, normalised by the cost of creating the
+ground truth from scratch. Since we only have segmentation ground truth,
+DET is evaluated on annotated frames only.
+
+Both are computed from one contingency table per frame counting the
+pixels shared by every (ground truth label, segmentation label) pair.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+import numpy as np
+
+# AOGM-D weights for each operation, as used by the tracking challenge
+NS_WEIGHT = 5
+FN_WEIGHT = 10
+FP_WEIGHT = 1
+
+
+class FrameScore(NamedTuple):
+    """SEG and DET results for one frame"""
+
+    frame: int
+    # number of ground truth and segmented objects in the frame
+    n_gt: int
+    n_seg: int
+    # sum over ground truth objects of their Jaccard index with their match
+    jaccard_sum: float
+    # detection errors: needed splits, false negatives, false positives
+    ns: int
+    fn: int
+    fp: int
+
+    @property
+    def seg(self):
+        return self.jaccard_sum / self.n_gt if self.n_gt else float("nan")
+
+    @property
+    def aogm_d(self):
+        return NS_WEIGHT * self.ns + FN_WEIGHT * self.fn + FP_WEIGHT * self.fp
+
+    @property
+    def aogm_d0(self):
+        return FN_WEIGHT * self.n_gt
+
+    @property
+    def det(self):
+        return _det(self.aogm_d, self.aogm_d0)
+
+
+class SequenceScore(NamedTuple):
+    """SEG and DET results over all scored frames of a sequence"""
+
+    n_frames: int
+    n_gt: int
+    seg: float
+    det: float
+
+
+def _det(aogm_d, aogm_d0):
+    if not aogm_d0:
+        return float("nan")
+    return 1 - min(aogm_d, aogm_d0) / aogm_d0
+
+
+def contingency_table(gt_frame, seg_frame):
+    """Count the pixels shared by every pair of ground truth and segmentation labels.
+
+    Labels are first mapped to consecutive integers so the table is only as
+    big as the number of labels present, then every pair is counted at once
+    with a single bincount.
+
+    Parameters
+    ----------
+    gt_frame : np.ndarray
+        ground truth labels
+    seg_frame : np.ndarray
+        segmentation labels, same shape as gt_frame
+
+    Returns
+    -------
+    gt_ids : np.ndarray
+        sorted ground truth labels, indexing rows of table
+    seg_ids : np.ndarray
+        sorted segmentation labels, indexing columns of table
+    table : np.ndarray
+        table[i, j] is the number of pixels labelled gt_ids[i] in the ground
+        truth and seg_ids[j] in the segmentation
+    """
+    gt_ids, _, seg_ids, _, table = contingency_table_inverse(gt_frame, seg_frame)
+    return gt_ids, seg_ids, table
+
+
+def contingency_table_inverse(gt_frame, seg_frame):
+    """contingency_table, also mapping every pixel to its row and column of the table
+
+    Returns
+    -------
+    gt_ids : np.ndarray
+        see contingency_table
+    gt_inv : np.ndarray
+        row of the table of each pixel, shaped like gt_frame
+    seg_ids : np.ndarray
+        see contingency_table
+    seg_inv : np.ndarray
+        column of the table of each pixel, shaped like seg_frame
+    table : np.ndarray
+        see contingency_table
+    """
+    gt_ids, gt_inv = np.unique(gt_frame, return_inverse=True)
+    seg_ids, seg_inv = np.unique(seg_frame, return_inverse=True)
+    pairs = gt_inv.ravel().astype(np.int64) * len(seg_ids) + seg_inv.ravel()
+    table = np.bincount(pairs, minlength=len(gt_ids) * len(seg_ids))
+    table = table.reshape(len(gt_ids), len(seg_ids))
+    return (
+        gt_ids,
+        gt_inv.reshape(np.shape(gt_frame)),
+        seg_ids,
+        seg_inv.reshape(np.shape(seg_frame)),
+        table,
+    )
+
+
+def object_matches(gt_ids, seg_ids, table):
+    """Match ground truth objects to the segmented objects covering most of them
+
+    A segmented object matches a ground truth object if it covers more
+    than half of it, so each ground truth object has at most one match.
+
+    Parameters
+    ----------
+    gt_ids, seg_ids, table : np.ndarray
+        see contingency_table
+
+    Returns
+    -------
+    gt_sizes : np.ndarray
+        size of each ground truth object, leaving out the background
+    seg_sizes : np.ndarray
+        size of each segmented object, leaving out the background
+    overlaps : np.ndarray
+        table without its background row and column
+    matches : np.ndarray
+        matches[i, j] is whether segmented object j matches ground truth object i
+    """
+    # drop the background row and column, keeping object sizes first
+    gt_sizes = table.sum(axis=1)[gt_ids != 0]
+    seg_sizes = table.sum(axis=0)[seg_ids != 0]
+    overlaps = table[gt_ids != 0][:, seg_ids != 0]
+    matches = overlaps > gt_sizes[:, np.newaxis] / 2
+    return gt_sizes, seg_sizes, overlaps, matches
+
+
+def score_frame(gt_frame, seg_frame, frame=0):
+    """Compute SEG and DET results for one frame
+
+    Parameters
+    ----------
+    gt_frame : ArrayLike
+        ground truth labels
+    seg_frame : ArrayLike
+        segmentation labels, same shape as gt_frame
+    frame : int, optional
+        index of the frame in its sequence, by default 0
+
+    Returns
+    -------
+    FrameScore
+        results for this frame
+    """
+    gt_ids, seg_ids, table = contingency_table(
+        np.asarray(gt_frame), np.asarray(seg_frame)
+    )
+    return score_table(gt_ids, seg_ids, table, frame=frame)
+
+
+def score_table(gt_ids, seg_ids, table, frame=0):
+    """Compute SEG and DET results for one frame from its contingency table
+
+    Parameters
+    ----------
+    gt_ids, seg_ids, table : np.ndarray
+        see contingency_table
+    frame : int, optional
+        index of the frame in its sequence, by default 0
+
+    Returns
+    -------
+    FrameScore
+        results for this frame
+    """
+    gt_sizes, seg_sizes, overlaps, matches = object_matches(gt_ids, seg_ids, table)
+    n_gt, n_seg = overlaps.shape
+    jaccard_sum = 0.0
+    if n_gt and n_seg:
+        gt_rows, seg_cols = np.nonzero(matches)
+        intersection = overlaps[gt_rows, seg_cols]
+        union = gt_sizes[gt_rows] + seg_sizes[seg_cols] - intersection
+        jaccard_sum = float(np.sum(intersection / union))
+
+    matches_per_seg = matches.sum(axis=0)
+    return FrameScore(
+        frame=frame,
+        n_gt=n_gt,
+        n_seg=n_seg,
+        jaccard_sum=jaccard_sum,
+        ns=int(np.sum(np.maximum(matches_per_seg - 1, 0))),
+        fn=int(np.sum(~matches.any(axis=1))),
+        fp=int(np.sum(matches_per_seg == 0)),
+    )
+
+
+def iter_frame_scores(
+    gt_data, seg_data, frames=None, max_workers=None, skip_empty=True
+):
+    """Score frames in parallel, yielding each result as soon as it's ready.
+
+    Frames without any ground truth are skipped, unless skip_empty is
+    False, e.g. to count off every frame scored. At most twice as many
+    frames as workers are read at once, so memory stays bounded for long
+    dask backed sequences.
+
+    Parameters
+    ----------
+    gt_data : ArrayLike
+        2D+T ground truth labels
+    seg_data : ArrayLike
+        2D+T segmentation labels, same shape as gt_data
+    frames : Iterable[int], optional
+        frames to score, by default every frame
+    max_workers : int, optional
+        number of scoring threads, by default one per core
+    skip_empty : bool, optional
+        whether to skip frames without ground truth, by default True
+
+    Yields
+    ------
+    FrameScore
+        results for each frame (with ground truth), in order of completion
+    """
+    if frames is None:
+        frames = range(len(gt_data))
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    def score(t):
+        return score_frame(gt_data[t], seg_data[t], frame=t)
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        pending = set()
+        for t in frames:
+            pending.add(pool.submit(score, t))
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from _results(done, skip_empty)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from _results(done, skip_empty)
+
+
+def _results(done, skip_empty):
+    for future in done:
+        frame_score = future.result()
+        if frame_score.n_gt or not skip_empty:
+            yield frame_score
+
+
+def summarise_scores(frame_scores):
+    """Combine per-frame results into results for the whole sequence.
+
+    SEG is averaged over every ground truth object rather than over frames,
+    and DET is computed from the total AOGM-D over all frames.
+
+    Parameters
+    ----------
+    frame_scores : Iterable[FrameScore]
+        per-frame results
+
+    Returns
+    -------
+    SequenceScore
+        results for the sequence
+    """
+    frame_scores = list(frame_scores)
+    n_gt = sum(frame_score.n_gt for frame_score in frame_scores)
+    jaccard_sum = sum(frame_score.jaccard_sum for frame_score in frame_scores)
+    aogm_d = sum(frame_score.aogm_d for frame_score in frame_scores)
+    aogm_d0 = sum(frame_score.aogm_d0 for frame_score in frame_scores)
+    return SequenceScore(
+        n_frames=len(frame_scores),
+        n_gt=n_gt,
+        seg=jaccard_sum / n_gt if n_gt else float("nan"),
+        det=_det(aogm_d, aogm_d0),
+    )
+
+
+def score_sequence(gt_data, seg_data, frames=None, max_workers=None):
+    """Score every frame of a sequence, see iter_frame_scores
+
+    Returns
+    -------
+    sequence_score : SequenceScore
+        results for the whole sequence
+    frame_scores : List[FrameScore]
+        results for each frame with ground truth, in frame order
+    """
+    frame_scores = sorted(
+        iter_frame_scores(gt_data, seg_data, frames, max_workers),
+        key=lambda frame_score: frame_score.frame,
+    )
+    return summarise_scores(frame_scores), frame_scores
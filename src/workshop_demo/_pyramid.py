@@ -0,0 +1,147 @@
+"""
+This module builds multiscale pyramids of 2D+T layers, so napari can show
+large frames zoomed out without reading them at full resolution. It has
+no napari or Qt dependencies.
+
+Each level halves the frames of the level above. Images are downsampled
+by their mean, and labels by the most common label in each window, or by
+taking every other pixel, so every label in a level is a label of the
+full resolution data. Levels are lazy and each of their frames is
+computed from the level above on first access, then served from the
+frame cache. Optionally, computed frames are also saved next to the
+dataset, so later sessions read the small levels straight from disk.
+"""
+import os
+import shutil
+
+import dask.array as da
+import numpy as np
+
+from ._frames import CachedFrames
+
+# levels are added until frames are no bigger than this along either axis
+PYRAMID_MIN_SIZE = 512
+# how much each level shrinks the frames of the level above along each axis
+PYRAMID_FACTOR = 2
+LABEL_METHODS = ("mode", "nearest")
+
+
+def _mean(windows, axis=None, dtype=None):
+    """Mean of each window, rounded back to integers for integer data"""
+    mean = np.mean(windows, axis=axis)
+    if np.issubdtype(dtype, np.integer):
+        mean = np.round(mean)
+    return mean.astype(dtype)
+
+
+def _mode(windows, axis=None):
+    """Most common value in each window, the first one seen on ties"""
+    if axis is None:
+        axis = tuple(range(windows.ndim))
+    # flatten each window into the last axis
+    windows = np.moveaxis(windows, axis, tuple(range(-len(axis), 0)))
+    windows = windows.reshape(windows.shape[: windows.ndim - len(axis)] + (-1,))
+    # windows are small, so comparing every pair of values is cheap
+    counts = (windows[..., :, np.newaxis] == windows[..., np.newaxis, :]).sum(axis=-1)
+    most_common = np.argmax(counts, axis=-1)[..., np.newaxis]
+    return np.take_along_axis(windows, most_common, axis=-1)[..., 0]
+
+
+def downsample(data, layer_type, label_method="mode", factor=PYRAMID_FACTOR):
+    """Lazily shrink each frame of data by factor along both frame axes
+
+    Frames are trimmed to a multiple of factor first.
+
+    Parameters
+    ----------
+    data : dask.array.Array
+        2D+T data, one frame per chunk
+    layer_type : str
+        "image" to downsample by mean, or "labels"
+    label_method : str, optional
+        "mode" for the most common label in each window, or "nearest" for
+        the label at its top left corner, by default "mode"
+    factor : int, optional
+        how much to shrink frames by, by default PYRAMID_FACTOR
+
+    Returns
+    -------
+    dask.array.Array
+        downsampled data, one frame per chunk
+    """
+    frame_axes = {axis: factor for axis in range(1, data.ndim)}
+    if layer_type != "labels":
+        return da.coarsen(_mean, data, frame_axes, trim_excess=True, dtype=data.dtype)
+    if label_method not in LABEL_METHODS:
+        raise ValueError(
+            f"label_method must be one of {LABEL_METHODS}, not {label_method!r}"
+        )
+    if label_method == "nearest":
+        return data[(slice(None),) + (slice(None, None, factor),) * (data.ndim - 1)]
+    return da.coarsen(_mode, data, frame_axes, trim_excess=True)
+
+
+def pyramid_dir(dir_pth):
+    """Path where the pyramid levels of the dataset at dir_pth are persisted.
+
+    Like the frame index, levels live beside the dataset rather than in it,
+    so writing them doesn't change the dataset's mtime.
+    """
+    parent, name = os.path.split(os.path.abspath(dir_pth))
+    return os.path.join(parent, f".{name}.workshop_demo_pyramid")
+
+
+def _clear_stale_levels(store_dir, level_names):
+    """Remove persisted levels of earlier versions of the dataset"""
+    try:
+        entries = os.listdir(store_dir)
+    except OSError:
+        return
+    for entry in entries:
+        if entry not in level_names:
+            shutil.rmtree(os.path.join(store_dir, entry), ignore_errors=True)
+
+
+def build_pyramid(
+    data,
+    layer_type,
+    label_method="mode",
+    min_size=PYRAMID_MIN_SIZE,
+    store_dir=None,
+):
+    """Build a lazy multiscale pyramid over data
+
+    Parameters
+    ----------
+    data : dask.array.Array
+        full resolution 2D+T data, one frame per chunk, with a deterministic
+        name, e.g. from read_tifs
+    layer_type : str
+        "image" or "labels", see downsample
+    label_method : str, optional
+        "mode" or "nearest", see downsample, by default "mode"
+    min_size : int, optional
+        levels are added until frames fit in min_size along both axes,
+        by default PYRAMID_MIN_SIZE
+    store_dir : str, optional
+        directory to persist computed frames of each level in, e.g.
+        pyramid_dir of the dataset, by default levels aren't persisted
+
+    Returns
+    -------
+    List[dask.array.Array]
+        levels from full resolution down, starting with data itself
+    """
+    levels = [data]
+    level_names = set()
+    while max(levels[-1].shape[1:]) > min_size:
+        level = downsample(levels[-1], layer_type, label_method)
+        # level names derive from data's, so they change whenever the dataset does
+        level_store = None
+        if store_dir is not None:
+            level_store = os.path.join(store_dir, level.name)
+            level_names.add(level.name)
+        levels.append(CachedFrames(level, store_dir=level_store).to_dask())
+    if store_dir is not None:
+        _clear_stale_levels(store_dir, level_names)
+    return levels
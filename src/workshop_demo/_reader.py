@@ -3,18 +3,26 @@ This module contains the necessary functions to serve as a reader
 plugin for napari, that can read directories of tracking challenge
 gold standard manual segmentation data.
 """
-import glob
+
+import json
 import os
 import re
 import warnings
 from pathlib import Path
 
-import dask
-import dask.array as da
-import tifffile
-from napari.utils import progress
+from ._constants import GT_REGEX, GT_TIF_REGEX, MANIFEST_NAME, SEQ_TIF_REGEX
+from ._disk_cache import fingerprinted
+from ._index import get_frame_index, probe_dir
+
+# napari calls napari_get_reader for every path it opens, so it only needs the
+# standard library: dask, numpy and tifffile are imported once we're reading
 
-from ._constants import GT_REGEX, GT_TIF_REGEX, SEQ_TIF_REGEX
+# number of frames we look at to estimate an image layer's contrast limits
+CONTRAST_SAMPLE_FRAMES = 5
+# set to "1" to read large frames as multiscale pyramids, or to "persist" to
+# also save computed pyramid levels next to the dataset
+MULTISCALE_ENV = "WORKSHOP_DEMO_MULTISCALE"
+MULTISCALE_OPTIONS = ("0", "1", "persist")
 
 
 # our manifest reader command points to this function
@@ -26,6 +34,9 @@ def napari_get_reader(path):
     challenge specifications:
     https://public.celltrackingchallenge.net/documents/Naming%20and%20file%20content%20conventions.pdf
 
+    Zip archives holding tracking challenge sequences or ground truth, such
+    as those our writer produces, are read too, without being extracted.
+
     :param path: path to be opened by reader
     :type path: str
     :return: reader function or None
@@ -34,6 +45,12 @@ def napari_get_reader(path):
     # return None
 
     path = os.path.abspath(path)
+    if os.path.isfile(path) and path.lower().endswith(".zip"):
+        # zipfile is only needed for archives, so we import it for them alone
+        from ._archive import probe_archive
+
+        return archive_reader_function if probe_archive(path) else None
+
     # we want a folder not an individual tiff
     if not os.path.isdir(path):
         return None
@@ -43,87 +60,242 @@ def napari_get_reader(path):
     if not is_gt:
         return None
 
-    # need to be able to find some tifs
-    all_tifs = glob.glob(path + "/*.tif")
-    if not all_tifs:
+    # need to be able to find some tifs, and they need to match the regex for
+    # a ground truth tif. We stop at the first that doesn't, and only check a
+    # sample of them, as napari probes every path it opens with every reader
+    if not probe_dir(path, GT_TIF_REGEX):
+        return None
+
+    return reader_function
+
+
+# our manifest zarr reader command points to this function
+def napari_get_zarr_reader(path):
+    """Returns reader if path is a Zarr store written by this plugin, otherwise None.
+
+    Only the store's metadata is read, so probing doesn't import zarr.
+
+    :param path: path to be opened by reader
+    :type path: str
+    :return: reader function or None
+    """
+    if not isinstance(path, str) or not path.rstrip(os.sep).endswith(".zarr"):
+        return None
+    if not os.path.isdir(path):
         return None
 
-    # the tifs we've found need to match the regex for a ground truth tif
-    is_gt_tifs = all([re.match(GT_TIF_REGEX, pth) for pth in all_tifs])
-    if not is_gt_tifs:
+    from ._zarr import read_zarr_attrs
+
+    if read_zarr_attrs(path) is None:
         return None
+    return zarr_reader_function
 
-    return reader_function
 
+def zarr_reader_function(path):
+    """Lazily reads a Zarr store written by this plugin as a napari layer
+
+    Parameters
+    ----------
+    path : str
+        path of the Zarr store
+
+    Returns
+    -------
+    layer_data : list of tuples
+        one (layer_data, meta, layer_type) tuple, with data chunked like the store
+    """
+    from ._zarr import read_zarr
+
+    path = os.path.normpath(path)
+    layer_data, layer_type = read_zarr(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return [(layer_data, {"name": name}, layer_type)]
 
-def read_tifs(path, n_frames):
-    """Read all tifs at path matching tif_regex into delayed dask stack.
+
+def read_tifs(index, n_frames):
+    """Read all tifs in frame index into a lazy dask stack.
 
     If n_frames is given, places GT labels at the appropriate indices
-    in the larger time sequence. Otherwise, reads labels into one
-    contiguous sequence.
+    in the larger time sequence. Otherwise, reads labels up to the last
+    frame in the index.
 
-    :param path: path containing tifs
-    :type path: str
+    Frames are only read when dask asks for them, and the whole stack is
+    a single blockwise graph layer however many frames it has.
+
+    :param index: frame index of directory containing tifs
+    :type index: FrameIndex
     :param n_frames: number of total frames in the sequence
     :type n_frames: int
     :return: nd dask array
     """
+    import dask.array as da
+    import numpy as np
+    from dask.base import tokenize
 
-    # sort all the tifs found at path that match the regex
-    all_tifs = sorted(
-        pth for pth in glob.glob(path + "/*.tif") if re.match(GT_TIF_REGEX, pth)
-    )
-
-    # open and inspect the first file so we can give a shape and dtype to the dask array
-    tif_shape = None
-    tif_dtype = None
-    with tifffile.TiffFile(all_tifs[0]) as im_tif:
-        tif_shape = im_tif.pages[0].shape
-        tif_dtype = im_tif.pages[0].dtype
+    from ._frames import FrameStack
 
     # if we haven't been given a number of frames we just read the whole folder
     if not n_frames:
-        n_frames = len(all_tifs)
-    im_stack = [da.zeros(shape=tif_shape, dtype=tif_dtype) for _ in range(n_frames)]
+        n_frames = index.n_frames
+    frame_stack = FrameStack(index, n_frames)
+
+    # a deterministic name means reopening an unchanged dataset gives the same
+    # array, and results cached by name are reused. Each frame's mtime and size
+    # are part of it, since rewriting a frame in place leaves dir_mtime as it was
+    fingerprint = [
+        (t, info.mtime, info.size) for t, info in sorted(index.frames.items())
+    ]
+    name = "tracking-challenge-" + tokenize(index.dir_pth, n_frames, fingerprint)
+    layer_data = da.from_array(
+        frame_stack,
+        # one frame per chunk, so scrubbing through time reads one file at a time
+        chunks=(1,) + frame_stack.frame_shape,
+        name=name,
+        meta=np.empty((0,) * frame_stack.ndim, dtype=frame_stack.dtype),
+    )
+
+    return fingerprinted(layer_data)
+
+
+def sample_contrast_limits(layer_data, n_samples=CONTRAST_SAMPLE_FRAMES):
+    """Estimate contrast limits from a few frames spread through the sequence.
+
+    Without contrast limits napari would compute them from the whole
+    layer, reading every frame before anything is shown.
+
+    Parameters
+    ----------
+    layer_data : dask.array.Array
+        2D+T image data, one frame per chunk
+    n_samples : int, optional
+        number of frames to sample, by default CONTRAST_SAMPLE_FRAMES
+
+    Returns
+    -------
+    List[float]
+        [min, max] of the sampled frames
+    """
+    import dask.array as da
+    import numpy as np
 
-    @dask.delayed
-    def read_im(tif_pth):
-        """Delayed func to read each individual tif into a numpy array"""
-        with tifffile.TiffFile(tif_pth) as im_tif:
-            im = im_tif.pages[0].asarray()
-        return im
+    n_frames = layer_data.shape[0]
+    sample_ts = np.unique(
+        np.linspace(0, n_frames - 1, min(n_samples, n_frames)).astype(int)
+    )
+    sample = layer_data[sample_ts]
+    im_min, im_max = da.compute(sample.min(), sample.max())
+    # napari won't accept equal limits, e.g. for a blank sequence
+    if im_min == im_max:
+        im_max = im_min + 1
+    return [float(im_min), float(im_max)]
+
+
+def _multiscale_setting(multiscale):
+    if multiscale is None:
+        multiscale = os.environ.get(MULTISCALE_ENV) or "0"
+    multiscale = str(multiscale).lower()
+    if multiscale not in MULTISCALE_OPTIONS:
+        raise ValueError(
+            f"multiscale must be one of {MULTISCALE_OPTIONS}, not {multiscale!r}"
+        )
+    return multiscale
+
+
+def as_multiscale(layer_data, layer_type, dir_pth, multiscale):
+    """Build a pyramid over layer_data if asked to and its frames are large.
+
+    Parameters
+    ----------
+    layer_data : dask.array.Array
+        full resolution data read from dir_pth
+    layer_type : str
+        "image" or "labels"
+    dir_pth : str
+        directory layer_data was read from
+    multiscale : str
+        "0" for no pyramid, "1" for a lazily computed pyramid, or "persist"
+        to also save computed levels next to dir_pth
+
+    Returns
+    -------
+    layer_data : dask.array.Array | List[dask.array.Array]
+        layer_data, or its pyramid levels from full resolution down
+    meta : dict
+        extra layer kwargs, marking the layer multiscale if it is
+    """
+    if multiscale == "0":
+        return layer_data, {}
+
+    from ._pyramid import build_pyramid, pyramid_dir
+
+    store_dir = pyramid_dir(dir_pth) if multiscale == "persist" else None
+    levels = build_pyramid(layer_data, layer_type, store_dir=store_dir)
+    if len(levels) == 1:
+        return layer_data, {}
+    return levels, {"multiscale": True}
+
+
+def extracted_sequence_frames(path):
+    """Length of the sequence the labels at path were written from, if we know it.
+
+    An archive our writer wrote leaves out empty frames, so once it's
+    extracted the directories' tifs alone would give a shorter sequence.
+    Its manifest, extracted alongside them, records the whole length.
 
-    for tif_pth in progress(all_tifs):
-        # get the slice index from the name of the file
-        frame_index = int(re.match(GT_TIF_REGEX, tif_pth).groups()[-1])
-        im = da.from_delayed(read_im(tif_pth), shape=tif_shape, dtype=tif_dtype)
-        # assign what we read into the stack at the right spot
-        im_stack[frame_index] = im
-    layer_data = da.stack(im_stack)
+    Parameters
+    ----------
+    path : str
+        ground truth directory, e.g. <extracted archive>/01_AUTO/SEG
 
-    return layer_data
+    Returns
+    -------
+    int | None
+        length from the manifest two levels up, or None if there's no
+        manifest there or it doesn't list frames of path
+    """
+    root = os.path.dirname(os.path.dirname(path))
+    try:
+        with open(os.path.join(root, MANIFEST_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    dir_name = os.path.relpath(path, root).replace(os.sep, "/")
+    frame_names = manifest.get("frames", {})
+    if not any(name.rsplit("/", 1)[0] == dir_name for name in frame_names):
+        return None
+    return manifest.get("n_frames")
 
 
-def reader_function(path):
+def reader_function(path, multiscale=None):
     """Reads valid tracking challenge ground truth tifs at path and returns as napari layers.
 
     Readers are expected to return data as a list of tuples, where each tuple
     is (data, [add_kwargs, [layer_type]]), "add_kwargs" and "layer_type" are
     both optional.
 
+    Large frames can be read as multiscale pyramids, so zoomed out views
+    never read full resolution frames. Labels are downsampled by their most
+    common label, and images by their mean. Each level's frames are computed
+    on first view, and can be saved next to the dataset for later sessions.
+
     Parameters
     ----------
     path : str or list of str
         Path to file, or list of paths.
+    multiscale : str, optional
+        "0", "1" or "persist", see as_multiscale, by default read from the
+        WORKSHOP_DEMO_MULTISCALE environment variable, or "0" if it's unset
 
     Returns
     -------
     layer_data : list of tuples
         tuples of (layer_data, meta, layer_type) where layer_data is a dask array,
-        meta contains metadata for the layer and layer_type is labels
+        meta contains metadata for the layer and layer_type is labels, or image
+        for the raw sequence if it was found next to the ground truth. The
+        labels' meta["metadata"]["annotated_frames"] lists the frames with a tif
     """
     path = os.path.normpath(path)
+    multiscale = _multiscale_setting(multiscale)
     gt_match = re.match(GT_REGEX, path)
 
     # we need to know the number of frames to spread this over, so we look for the sister sequence
@@ -132,23 +304,120 @@ def reader_function(path):
     seq_number = gt_match.groups()[1]
     sister_sequence_pth = os.path.join(parent_dir_pth, seq_number)
 
-    n_frames = None
-    if not os.path.exists(sister_sequence_pth):
+    # labels extracted from one of our archives know their length even if
+    # their last frames were empty and so never written
+    n_frames = extracted_sequence_frames(path)
+    # the sister sequence's index tells us its last frame without sorting a glob
+    seq_index = get_frame_index(sister_sequence_pth, SEQ_TIF_REGEX)
+    if seq_index is None and n_frames is None:
         warnings.warn(
             f"Can't find image for ground truth at {path}. Reading without knowing number of frames..."
         )
-    else:
-        # find the last tif in the sequence so we can work out the number of frames
-        latest_tif_pth = sorted(glob.glob(sister_sequence_pth + "/*.tif"))[-1]
-        # split the number out of the filename and add 1 because we start at 0
-        n_frames = int(re.match(SEQ_TIF_REGEX, latest_tif_pth).groups()[-1]) + 1
+    elif seq_index is not None:
+        n_frames = seq_index.n_frames
+
+    layers = []
+    if seq_index is not None:
+        # the raw sequence goes first so the labels are drawn over it
+        seq_data = read_tifs(seq_index, n_frames)
+        seq_kwargs = {
+            "name": seq_number,
+            "contrast_limits": sample_contrast_limits(seq_data),
+        }
+        seq_data, multiscale_kwargs = as_multiscale(
+            seq_data, "image", sister_sequence_pth, multiscale
+        )
+        seq_kwargs.update(multiscale_kwargs)
+        layers.append((seq_data, seq_kwargs, "image"))
 
-    layer_data = read_tifs(path, n_frames)
+    gt_index = get_frame_index(path, GT_TIF_REGEX)
+    if gt_index is None:
+        # the probe only checks a sample of the tifs, so one may not match
+        raise ValueError(
+            f"Not all tifs in {path} are tracking challenge ground truth frames"
+        )
+    layer_data = read_tifs(gt_index, n_frames)
     layer_type = "labels"
     layer_name = f"{gt_match.group(2)}{gt_match.group(3)}"
 
     # optional kwargs for the corresponding viewer.add_* method
     #    e.g. name, colormap, scale, etc.
-    add_kwargs = {"name": layer_name}
+    # frames without a tif are never read, and consumers can skip them too
+    add_kwargs = {
+        "name": layer_name,
+        "metadata": {"annotated_frames": gt_index.frame_numbers},
+    }
+    layer_data, multiscale_kwargs = as_multiscale(
+        layer_data, layer_type, path, multiscale
+    )
+    add_kwargs.update(multiscale_kwargs)
+    layers.append((layer_data, add_kwargs, layer_type))
+
+    return layers
+
+
+def archive_reader_function(path, multiscale=None):
+    """Reads the tracking challenge frames in a zip archive as napari layers.
+
+    Every sequence and every ground truth directory in the archive is read
+    lazily, straight from the archive, with ground truth spread over the
+    frames of its sister sequence when the archive holds it.
+
+    Parameters
+    ----------
+    path : str
+        path of the zip archive
+    multiscale : str, optional
+        "0", "1" or "persist", see reader_function, with levels persisted
+        next to the archive
+
+    Returns
+    -------
+    layer_data : list of tuples
+        (layer_data, meta, layer_type) tuples, images for the sequences
+        first so the labels of their ground truth are drawn over them, see
+        reader_function
+    """
+    from ._archive import get_archive_index
+
+    path = os.path.abspath(path)
+    multiscale = _multiscale_setting(multiscale)
+    indices = get_archive_index(path)
+    if not indices:
+        raise ValueError(f"No tracking challenge frames found in {path}")
+
+    seq_frames = {}
+    image_layers, labels_layers = [], []
+    for dir_pth, index in sorted(indices.items()):
+        if index.tif_regex != SEQ_TIF_REGEX:
+            continue
+        seq_frames[dir_pth] = index.n_frames
+        seq_data = read_tifs(index, index.n_frames)
+        seq_kwargs = {
+            "name": os.path.basename(dir_pth),
+            "contrast_limits": sample_contrast_limits(seq_data),
+        }
+        seq_data, multiscale_kwargs = as_multiscale(
+            seq_data, "image", index.store_pth, multiscale
+        )
+        seq_kwargs.update(multiscale_kwargs)
+        image_layers.append((seq_data, seq_kwargs, "image"))
+
+    for dir_pth, index in sorted(indices.items()):
+        gt_match = re.match(GT_REGEX, dir_pth)
+        if index.tif_regex != GT_TIF_REGEX or not gt_match:
+            continue
+        # labels we wrote know their length even if their last frames were empty
+        n_frames = seq_frames.get(f"{gt_match.group(1)}/{gt_match.group(2)}")
+        layer_data = read_tifs(index, n_frames or index.sequence_frames)
+        add_kwargs = {
+            "name": f"{gt_match.group(2)}{gt_match.group(3)}",
+            "metadata": {"annotated_frames": index.frame_numbers},
+        }
+        layer_data, multiscale_kwargs = as_multiscale(
+            layer_data, "labels", index.store_pth, multiscale
+        )
+        add_kwargs.update(multiscale_kwargs)
+        labels_layers.append((layer_data, add_kwargs, "labels"))
 
-    return [(layer_data, add_kwargs, layer_type)]
+    return image_layers + labels_layers
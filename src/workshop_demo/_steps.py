@@ -0,0 +1,48 @@
+"""
+Long running operations in this plugin are written as generators of
+steps: they yield a Progress after each step and return their result.
+napari's generator workers can run them in the background, reporting
+progress and cancelling between steps, while headless code just runs
+them to completion with run_steps.
+"""
+
+import os
+from typing import NamedTuple
+
+# number of chunks computed between progress reports, enough to keep every core busy
+DEFAULT_BATCH_SIZE = 2 * (os.cpu_count() or 1)
+
+
+class Progress(NamedTuple):
+    """How far through an operation we are"""
+
+    desc: str
+    done: int
+    total: int
+
+
+def run_steps(steps):
+    """Run a generator of steps to completion and return its result
+
+    Parameters
+    ----------
+    steps : Generator[Progress, None, T]
+        operation to run
+
+    Returns
+    -------
+    T
+        the operation's result
+    """
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+def batches(items, batch_size=None):
+    """Split items into consecutive lists of at most batch_size items"""
+    items = list(items)
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    return [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
@@ -0,0 +1,13 @@
+import pytest
+
+from workshop_demo import _disk_cache
+
+
+@pytest.fixture(autouse=True)
+def disk_cache(tmp_path_factory, monkeypatch):
+    """A fresh shared disk cache for every test, so tests never share results"""
+    cache_dir = str(tmp_path_factory.mktemp("disk_cache"))
+    # subprocesses started by tests use it too
+    monkeypatch.setenv(_disk_cache.CACHE_DIR_ENV, cache_dir)
+    yield _disk_cache.configure(cache_dir)
+    _disk_cache.configure()
@@ -0,0 +1,132 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dask.array as da
+import numpy as np
+from tifffile import imsave
+
+from workshop_demo._cache import DEFAULT_PREFETCH_WORKERS, FrameCache
+from workshop_demo._constants import GT_TIF_REGEX
+from workshop_demo._frames import CachedFrames, FrameStack
+from workshop_demo._index import get_frame_index
+
+
+def frame_loader(value, calls):
+    def load():
+        calls.append(value)
+        return np.full((10, 10), value, dtype=np.uint8)
+
+    return load
+
+
+def test_cache_hits_and_misses():
+    cache = FrameCache(max_bytes=1000)
+    calls = []
+
+    first = cache.get("a", frame_loader(1, calls))
+    second = cache.get("a", frame_loader(1, calls))
+
+    assert first is second
+    assert calls == [1]
+    assert not first.flags.writeable
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["nbytes"] == 100
+
+
+def test_cache_evicts_least_recently_used():
+    # room for two 100 byte frames
+    cache = FrameCache(max_bytes=250)
+    calls = []
+    cache.get("a", frame_loader(1, calls))
+    cache.get("b", frame_loader(2, calls))
+    # touch a so b is the least recently used
+    cache.get("a", frame_loader(1, calls))
+    cache.get("c", frame_loader(3, calls))
+
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert cache.stats()["evictions"] == 1
+
+    cache.resize(150)
+    assert len(cache) == 1 and "c" in cache
+
+
+def test_cache_prefetch():
+    cache = FrameCache(max_bytes=1000)
+    calls = []
+    cache.prefetch_frames(
+        [("a", frame_loader(1, calls)), ("b", frame_loader(2, calls))]
+    )
+    # getting a frame being prefetched waits on the prefetch instead of reloading
+    assert cache.get("a", frame_loader(1, calls))[0, 0] == 1
+    assert cache.get("b", frame_loader(2, calls))[0, 0] == 2
+    assert sorted(calls) == [1, 2]
+
+
+def test_cache_keeps_summaries_with_their_frames():
+    # room for two 100 byte frames
+    cache = FrameCache(max_bytes=250)
+    calls = []
+
+    def load_summarised(key, value):
+        def load():
+            cache.put_summary(key, value)
+            return frame_loader(value, calls)()
+
+        return load
+
+    cache.get("a", load_summarised("a", 1))
+    cache.load_frames(["b"], lambda keys: [load_summarised("b", 2)()])
+    assert (cache.get_summary("a"), cache.get_summary("b")) == (1, 2)
+    # only frames being loaded or cached keep summaries
+    cache.put_summary("c", 3)
+    assert cache.get_summary("c") is None
+
+    cache.get("c", load_summarised("c", 3))
+    assert cache.get_summary("a") is None and cache.get_summary("c") == 3
+    cache.clear()
+    assert cache.get_summary("b") is None
+
+
+def test_cache_loads_concurrent_requests_once():
+    cache = FrameCache(max_bytes=1000)
+    calls = []
+    started, release = threading.Event(), threading.Event()
+    load = frame_loader(1, calls)
+
+    def slow_load():
+        started.set()
+        release.wait()
+        return load()
+
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(cache.get, "a", slow_load)
+        started.wait()
+        second = pool.submit(cache.get, "a", frame_loader(1, calls))
+        release.set()
+        assert first.result() is second.result()
+    assert calls == [1]
+
+
+def test_compute_frames_over_prefetched_frames_never_deadlocks(tmpdir):
+    """Computing derived frames never waits on the prefetch threads it fills"""
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    n_frames = DEFAULT_PREFETCH_WORKERS * 3
+    for t in range(n_frames):
+        frame = np.full((10, 10), t, dtype=np.uint8)
+        # compressed, so frames are decoded through the cache and prefetched
+        imsave(str(gt_pth.join(f"man_seg{t:03}.tif")), frame, compression="zlib")
+    cache = FrameCache(max_bytes=10_000)
+    stack = FrameStack(get_frame_index(str(gt_pth), GT_TIF_REGEX), n_frames, cache)
+    frames = CachedFrames(da.from_array(stack, chunks=(1, 10, 10)) + 1, cache=cache)
+
+    computing = threading.Thread(
+        target=frames.compute_frames, args=(range(n_frames),), daemon=True
+    )
+    computing.start()
+    computing.join(timeout=30)
+
+    assert not computing.is_alive()
+    for t in range(n_frames):
+        assert frames.get_frame(t)[0, 0] == t + 1
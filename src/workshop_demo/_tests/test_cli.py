@@ -0,0 +1,114 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+from zipfile import ZipFile
+
+import numpy as np
+from tifffile import imsave
+
+from workshop_demo._cli import discover_datasets, main, parse_size
+
+
+def write_dataset(root, seq_number, n_frames=3, gt_frames=(1,)):
+    rng = np.random.default_rng(0)
+    seq_pth = root.mkdir(seq_number)
+    gt_pth = root.mkdir(f"{seq_number}_GT").mkdir("SEG")
+    for t in range(n_frames):
+        frame = rng.integers(0, 50, size=(40, 40), dtype=np.uint16)
+        frame[10:20, 10:20] = 200
+        imsave(str(seq_pth.join(f"t{t:03}.tif")), frame)
+        if t in gt_frames:
+            labels = np.zeros((40, 40), dtype=np.uint16)
+            labels[10:20, 10:20] = 1
+            imsave(str(gt_pth.join(f"man_seg{t:03}.tif")), labels)
+
+
+def test_discover_datasets(tmpdir):
+    write_dataset(tmpdir.mkdir("Fluo-A"), "01")
+    seq_only = tmpdir.mkdir("Fluo-B").mkdir("02")
+    imsave(str(seq_only.join("t000.tif")), np.zeros((10, 10), dtype=np.uint8))
+    tmpdir.mkdir("not-a-dataset").mkdir("03").join("notes.txt").write("")
+    # numbered directories that aren't sequences are searched too
+    write_dataset(tmpdir.mkdir("2024").mkdir("Fluo-C"), "04")
+
+    datasets = discover_datasets(str(tmpdir))
+    assert [dataset.name for dataset in datasets] == [
+        "2024/Fluo-C/04",
+        "Fluo-A/01",
+        "Fluo-B/02",
+    ]
+    assert datasets[1].gt_dir.endswith("Fluo-A/01_GT/SEG")
+    assert datasets[2].gt_dir is None
+
+
+def test_parse_size():
+    assert parse_size("512") == 512
+    assert parse_size("4G") == 4 * 2 ** 30
+    assert parse_size("1.5MB") == int(1.5 * 2 ** 20)
+
+
+def test_main_segments_scores_and_writes(tmpdir):
+    root = tmpdir.mkdir("root")
+    write_dataset(root.mkdir("Fluo-A"), "01")
+    out = tmpdir.join("out")
+
+    assert main([str(root), str(out), "--diff", "--workers", "1"]) == 0
+
+    with open(out.join("scores.json")) as scores_file:
+        (result,) = json.load(scores_file)
+    assert result["name"] == "Fluo-A/01"
+    assert result["n_frames"] == 1
+    assert result["seg"] == result["det"] == 1
+    with ZipFile(out.join("Fluo-A", "01_SEG.zip")) as zip_file:
+        assert "01_AUTO/SEG/seg002.tif" in zip_file.namelist()
+    assert out.join("Fluo-A", "01_DIFF.zip").check()
+    with open(out.join("Fluo-A", "01_DIFF.csv")) as table_file:
+        (row,) = csv.DictReader(table_file)
+    assert row["frame"] == "1" and row["fn_pixels"] == "0"
+
+
+def test_main_traces_each_worker(tmpdir):
+    root = tmpdir.mkdir("root")
+    for seq_number in ("01", "02"):
+        write_dataset(root.mkdir(f"Fluo-{seq_number}"), seq_number)
+    trace_dir = tmpdir.mkdir("traces")
+    env = dict(os.environ, WORKSHOP_DEMO_TRACE=str(trace_dir.join("trace-{pid}.json")))
+    subprocess.run(
+        [sys.executable, "-c", "import workshop_demo._cli as cli; cli.main()"]
+        + [str(root), str(tmpdir.join("out")), "--workers", "2"],
+        env=env,
+        check=True,
+    )
+
+    processed = []
+    for trace_pth in trace_dir.listdir("trace-*.json"):
+        pid = int(trace_pth.purebasename[len("trace-") :])
+        with open(trace_pth) as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+        # each process writes only its own events, to its own trace
+        assert {event["pid"] for event in events} <= {pid}
+        processed += [
+            event["args"]["dataset"]
+            for event in events
+            if event["name"] == "cli.process_dataset"
+        ]
+    assert sorted(processed) == ["Fluo-01/01", "Fluo-02/02"]
+
+
+def test_cli_never_imports_qt(tmpdir):
+    root = tmpdir.mkdir("root")
+    write_dataset(root.mkdir("Fluo-A"), "01")
+    # a whole run, reading, segmenting, scoring and writing a sequence
+    code = (
+        "import sys, workshop_demo._cli; "
+        f"workshop_demo._cli.main([{str(root)!r}, {str(tmpdir.join('out'))!r}, "
+        "'--diff', '--workers', '1']); "
+        "print([m for m in sys.modules if m.split('.')[0] in "
+        "('qtpy', 'PyQt5', 'PySide2', 'magicgui') or m.startswith('napari.qt')])"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert out.stdout.strip().splitlines()[-1] == "[]"
@@ -0,0 +1,102 @@
+import dask.array as da
+import numpy as np
+
+from workshop_demo._cache import FrameCache
+from workshop_demo._diff import (FALSE_NEGATIVE, FALSE_POSITIVE, MERGE, SPLIT,
+                                 DiffFrames, classify_frame, label_differences)
+
+
+def labelled_frames():
+    gt = np.zeros((2, 10, 10), dtype=np.uint16)
+    seg = np.zeros_like(gt)
+    # frame 0 has no ground truth, frame 1 has one of each category
+    seg[0] = 1
+    gt[1, :4, :4] = 1
+    seg[1, :4, :2] = 1
+    seg[1, :4, 2:4] = 2
+    gt[1, 6:8, :3] = 2
+    gt[1, 6:8, 3:6] = 3
+    seg[1, 6:8, :6] = 5
+    gt[1, 9, 9] = 4
+    seg[1, 9, 0] = 7
+    return gt, seg
+
+
+def test_classify_frame():
+    gt, seg = labelled_frames()
+
+    categories, frame_diff = classify_frame(gt[0], seg[0])
+    assert not categories.any() and frame_diff.score.n_gt == 0
+
+    categories, frame_diff = classify_frame(gt[1], seg[1], frame=1)
+    assert categories.dtype == np.uint8
+    assert (categories[:4, :4] == SPLIT).all()
+    assert (categories[6:8, :6] == MERGE).all()
+    assert categories[9, 9] == FALSE_NEGATIVE
+    assert categories[9, 0] == FALSE_POSITIVE
+    assert (categories != 0).sum() == 16 + 12 + 2
+    assert frame_diff.frame == 1
+    assert (frame_diff.n_split, frame_diff.n_merge) == (1, 1)
+    assert frame_diff.split_pixels == 16 and frame_diff.merge_pixels == 12
+    assert frame_diff.score.n_gt == 4
+
+
+def test_diff_frames_table_comes_from_the_diff():
+    gt, seg = labelled_frames()
+    frames = DiffFrames(gt, seg, cache=FrameCache(2 ** 20))
+    np.testing.assert_array_equal(
+        frames.to_dask().compute(), label_differences(gt, seg).compute()
+    )
+    # both frames were classified, and scored, computing the diff
+    assert sorted(frames.frame_diffs) == [0, 1]
+
+    (row,) = frames.frame_table()
+    assert row["frame"] == 1 and row["n_split"] == 1 and row["fp_pixels"] == 1
+    sequence_score = frames.sequence_score()
+    assert sequence_score.n_frames == 1 and sequence_score.n_gt == 4
+
+
+def test_diff_frames_score_twice_in_a_session():
+    gt, seg = labelled_frames()
+    cache = FrameCache(2 ** 20)
+    scores = []
+    for _ in range(2):
+        # the second diff finds every frame in the frame cache
+        frames = DiffFrames(gt, seg, cache=cache)
+        frames.compute_frames(range(len(frames)))
+        scores.append(frames.sequence_score())
+    assert scores[0] == scores[1] and scores[1].n_frames == 1
+
+
+def test_diff_frames_summaries_are_evicted_with_their_frames():
+    gt, seg = labelled_frames()
+    # room for one frame of differences
+    frames = DiffFrames(gt, seg, cache=FrameCache(100))
+    frames.compute_frames(range(len(frames)))
+    assert sorted(frames.frame_diffs) == [1]
+
+    frames.cache.clear()
+    assert not frames.frame_diffs
+    # evicted frames are summarised again when asked for
+    assert [row["frame"] for row in frames.frame_table()] == [1]
+    assert frames.sequence_score(range(len(frames))).n_gt == 4
+
+
+def test_diff_frames_only_classify_annotated_frames():
+    gt, seg = labelled_frames()
+    classified = []
+
+    def record_seg(block):
+        classified.append(block.shape[0])
+        return block
+
+    seg_data = da.from_array(seg, chunks=(1, 10, 10)).map_blocks(
+        record_seg, meta=np.empty((0, 0, 0), dtype=seg.dtype)
+    )
+    frames = DiffFrames(gt, seg_data, annotated_frames=[1], cache=FrameCache(2 ** 20))
+    frames.compute_frames(range(len(frames)))
+    assert not frames[0].any()
+    assert frames[1].any()
+    # the segmentation of the unannotated frame was never computed
+    assert classified == [1]
+    assert [row["frame"] for row in frames.frame_table()] == [1]
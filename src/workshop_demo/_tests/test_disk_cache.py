@@ -0,0 +1,145 @@
+import os
+
+import dask.array as da
+import numpy as np
+from tifffile import imsave
+
+from workshop_demo import _index
+from workshop_demo._cache import FrameCache
+from workshop_demo._constants import GT_TIF_REGEX
+from workshop_demo._diff import DiffFrames
+from workshop_demo._disk_cache import DiskCache, cache_key, is_fingerprinted
+from workshop_demo._frames import CachedFrames
+from workshop_demo._reader import read_tifs
+
+
+def recorded(data, computed, name=None):
+    """data as a dask array recording the frames computed from it"""
+
+    def record(block, block_info=None):
+        computed.append(block_info[0]["chunk-location"][0])
+        return block
+
+    return da.from_array(data, chunks=(1,) + data.shape[1:], name=name).map_blocks(
+        record, meta=np.empty((0,) * data.ndim, dtype=data.dtype)
+    )
+
+
+def test_disk_cache_round_trip(tmp_path):
+    disk_cache = DiskCache(str(tmp_path))
+    key = cache_key("test", 1)
+    assert key != cache_key("test", 2)
+    assert disk_cache.get_array(key) is None and disk_cache.get_json(key) is None
+
+    disk_cache.put_array(key, np.arange(6).reshape(2, 3))
+    disk_cache.put_json(key, {"a": [1, 2]})
+    np.testing.assert_array_equal(disk_cache.get_array(key), np.arange(6).reshape(2, 3))
+    assert disk_cache.get_json(key) == {"a": [1, 2]}
+    # nothing is left half written
+    assert not [pth for pth in tmp_path.rglob("*") if pth.name.endswith(".part")]
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    entry = np.zeros(1000, dtype=np.uint8)
+    entry_size = 1000 + 128
+    disk_cache = DiskCache(str(tmp_path), max_bytes=int(2.5 * entry_size))
+    keys = [cache_key("entry", i) for i in range(3)]
+    for age, key in zip((30, 20), keys):
+        disk_cache.put_array(key, entry)
+        entry_pth = disk_cache._path(key, ".npy")
+        os.utime(entry_pth, (0, os.stat(entry_pth).st_mtime - age))
+    # reading the oldest entry makes it the most recently used
+    assert disk_cache.get_array(keys[0]) is not None
+
+    disk_cache.put_array(keys[2], entry)
+    assert disk_cache.get_array(keys[1]) is None
+    assert disk_cache.get_array(keys[0]) is not None
+    assert disk_cache.get_array(keys[2]) is not None
+    assert disk_cache.nbytes <= disk_cache.max_bytes
+
+
+def test_cached_frames_persist_across_sessions():
+    data = np.random.randint(0, 5, size=(3, 8, 8))
+    computed = []
+    source = recorded(data, computed)
+
+    for _ in range(2):
+        # a new frame cache stands in for a new session
+        frames = CachedFrames(source, cache=FrameCache())
+        np.testing.assert_array_equal(frames.to_dask().compute(), data)
+    assert sorted(computed) == [0, 1, 2]
+
+
+def test_diff_frames_persist_across_sessions():
+    gt = np.zeros((2, 10, 10), dtype=np.uint16)
+    gt[1, :4, :4] = 1
+    seg = np.zeros_like(gt)
+    seg[1, :4, :2] = 1
+    computed = []
+    seg_data = recorded(seg, computed)
+
+    tables = []
+    for _ in range(2):
+        frames = DiffFrames(gt, seg_data, cache=FrameCache())
+        frames.compute_frames(range(len(frames)))
+        tables.append(frames.frame_table())
+    assert sorted(computed) == [0, 1]
+    assert tables[0] == tables[1] and tables[0][0]["fn_pixels"] == 8
+
+
+def test_frames_edited_in_place_miss_the_cache(tmpdir):
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    frame_pth = str(gt_pth.join("man_seg000.tif"))
+    gt = np.zeros((10, 10), dtype=np.uint16)
+    gt[:4, :4] = 1
+    imsave(frame_pth, gt)
+    seg = np.zeros((1, 10, 10), dtype=np.uint16)
+    seg[0, :4, :2] = 1
+    dir_mtime = os.stat(str(gt_pth)).st_mtime
+
+    tables = []
+    for edit in range(2):
+        if edit:
+            # rewritten in place, e.g. by an annotation tool, which leaves
+            # the directory's mtime as it was
+            gt[:4, :4] = 0
+            imsave(frame_pth, gt)
+            os.utime(frame_pth, (0, os.stat(frame_pth).st_mtime + 1))
+            os.utime(str(gt_pth), (0, dir_mtime))
+        # a new session
+        _index._INDEX_CACHE.clear()
+        index = _index.get_frame_index(str(gt_pth), GT_TIF_REGEX, check_files=True)
+        frames = DiffFrames(read_tifs(index, 1), seg, cache=FrameCache())
+        frames.compute_frames(range(len(frames)))
+        tables.append(frames.frame_table(frames=[0]))
+    assert tables[0][0]["fn_pixels"] == 8
+    # no ground truth is left, so there's nothing to score
+    assert tables[1] == [] and frames.sequence_score().n_frames == 0
+
+
+def test_index_of_read_only_dataset_is_cached(tmpdir, monkeypatch):
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    imsave(str(gt_pth.join("man_seg000.tif")), np.ones((10, 10), dtype=np.uint8))
+    # nothing can be written next to the dataset
+    monkeypatch.setattr(
+        _index, "index_path", lambda dir_pth: os.path.join(dir_pth, "missing", "x")
+    )
+
+    index = _index.get_frame_index(str(gt_pth), GT_TIF_REGEX)
+    _index._INDEX_CACHE.clear()
+    loaded = _index.load_index(index.dir_pth, GT_TIF_REGEX, index.dir_mtime)
+    assert loaded is not None and loaded.frame_numbers == [0]
+
+
+def test_arrays_named_any_other_way_skip_the_disk_cache():
+    data = np.random.randint(0, 5, size=(3, 8, 8))
+    computed = []
+    # a name that could outlive the data, like a path
+    source = recorded(data, computed, name="frames.tif")
+    assert not is_fingerprinted(source)
+    assert is_fingerprinted(recorded(data, []))
+
+    for _ in range(2):
+        frames = CachedFrames(source, cache=FrameCache())
+        frames.compute_frames(range(len(frames)))
+    assert sorted(computed) == [0, 0, 1, 1, 2, 2]
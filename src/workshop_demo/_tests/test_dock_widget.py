@@ -1,10 +1,12 @@
 import dask.array as da
 import pytest
+from napari.components import ViewerModel
 from napari.layers import Image, Labels
 from qtpy.QtCore import Qt
 
 from workshop_demo import (SegmentationDiffHighlight, Threshold,
                            segment_by_threshold)
+from workshop_demo._cache import frame_cache
 
 
 @pytest.fixture
@@ -17,13 +19,50 @@ def labels_layer():
     return Labels(da.random.randint(0, 255, (5, 100, 100)), name="lab")
 
 
-def test_segment_widg_returns_layer(im_layer, labels_layer):
+def test_segment_widg_adds_layer(im_layer, qtbot):
+    viewer = ViewerModel()
+    viewer.add_layer(im_layer)
     widg = segment_by_threshold()
 
-    retval = widg(im_layer, Threshold.triangle)
-    assert isinstance(retval[0], da.Array)
-    assert retval[1]["name"] == "im_seg"
-    assert retval[2] == "labels"
+    worker = widg(im_layer, Threshold.triangle, viewer=viewer)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        pass
+
+    seg_layer = viewer.layers["im_seg"]
+    assert isinstance(seg_layer.data, da.Array)
+    # every frame was computed into the cache in the background
+    source_name = seg_layer.data.name[len("cached-") :]
+    assert all((source_name, t) in frame_cache for t in range(5))
+
+
+def test_segment_widg_new_run_cancels_previous(im_layer, qtbot):
+    viewer = ViewerModel()
+    viewer.add_layer(im_layer)
+    widg = segment_by_threshold()
+
+    first = widg(im_layer, Threshold.triangle, viewer=viewer)
+    second = widg(im_layer, Threshold.otsu, viewer=viewer)
+    with qtbot.waitSignals([first.finished, second.finished], timeout=10000):
+        pass
+
+    assert first.abort_requested
+    assert not second.abort_requested
+    # only the latest run adds its layer
+    assert [layer.name for layer in viewer.layers] == ["im", "im_seg"]
+
+
+def test_segment_widg_runs_in_each_viewer(im_layer, qtbot):
+    viewers = [ViewerModel(), ViewerModel()]
+    workers = []
+    for viewer in viewers:
+        viewer.add_layer(im_layer)
+        workers.append(segment_by_threshold()(im_layer, Threshold.otsu, viewer=viewer))
+    qtbot.waitUntil(
+        lambda: all("im_seg" in viewer.layers for viewer in viewers), timeout=10000
+    )
+
+    # a run in one viewer doesn't cancel a run in another
+    assert not any(worker.abort_requested for worker in workers)
 
 
 def test_highlight_widg_populates_layers(make_napari_viewer, labels_layer, im_layer):
@@ -49,4 +88,5 @@ def test_highlight_widg_computes_difference(make_napari_viewer, labels_layer, qt
 
     qtbot.mouseClick(widg.highlight_btn, Qt.MouseButton.LeftButton)
 
-    assert len(viewer.layers) == 2
+    # the layer is added by a background worker
+    qtbot.waitUntil(lambda: len(viewer.layers) == 2, timeout=10000)
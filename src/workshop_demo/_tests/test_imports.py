@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+import numpy as np
+from tifffile import imsave
+
+# napari probes the reader for every path it opens, so importing and calling
+# it must stay cheap: these are never needed to answer the probe
+HEAVY_MODULES = ("dask", "numpy", "tifffile", "skimage", "scipy", "napari", "qtpy")
+# cumulative import time of the reader module, in microseconds
+READER_IMPORT_BUDGET_US = 50_000
+
+
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, *code], capture_output=True, text=True, check=True
+    )
+
+
+def imported_heavy_modules(code):
+    out = run_python(
+        [
+            "-c",
+            f"import sys; {code}; "
+            f"print(sorted({{m.split('.')[0] for m in sys.modules}} & {set(HEAVY_MODULES)}))",
+        ]
+    )
+    return out.stdout.strip()
+
+
+def test_package_import_is_light():
+    assert imported_heavy_modules("import workshop_demo") == "[]"
+
+
+def test_reader_probe_is_light(tmpdir):
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    imsave(str(gt_pth.join("man_seg000.tif")), np.zeros((10, 10), dtype=np.uint8))
+    not_gt_pth = tmpdir.mkdir("02")
+
+    code = (
+        "from workshop_demo import napari_get_reader; "
+        f"assert napari_get_reader({str(gt_pth)!r}) is not None; "
+        f"assert napari_get_reader({str(not_gt_pth)!r}) is None"
+    )
+    assert imported_heavy_modules(code) == "[]"
+
+
+def test_reader_import_time_budget():
+    out = run_python(["-X", "importtime", "-c", "import workshop_demo._reader"])
+    # lines look like "import time: self [us] | cumulative | imported package"
+    cumulative_us = {
+        line.split("|")[2].strip(): int(line.split("|")[1])
+        for line in out.stderr.splitlines()
+        if line.startswith("import time:") and line.split("|")[1].strip().isdigit()
+    }
+    assert cumulative_us["workshop_demo._reader"] < READER_IMPORT_BUDGET_US
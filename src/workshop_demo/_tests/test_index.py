@@ -0,0 +1,180 @@
+import os
+
+import numpy as np
+import pytest
+from tifffile import imsave
+
+from workshop_demo._constants import GT_TIF_REGEX
+from workshop_demo._frames import FrameStack
+from workshop_demo._index import (
+    _INDEX_CACHE,
+    get_frame_index,
+    index_path,
+    load_index,
+    probe_dir,
+)
+
+
+def make_gt_dir(tmpdir, frames):
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    for frame in frames:
+        gt_labels = np.random.randint(0, 20, size=(10, 12), dtype=np.uint8)
+        imsave(str(gt_pth.join(f"man_seg{str(frame).zfill(3)}.tif")), gt_labels)
+    return str(gt_pth)
+
+
+def test_index_frames(tmpdir):
+    """Index maps frame numbers to paths and reads headers on demand"""
+    gt_pth = make_gt_dir(tmpdir, [1, 4])
+    index = get_frame_index(gt_pth, GT_TIF_REGEX)
+
+    assert index.frame_numbers == [1, 4]
+    assert index.n_frames == 5
+    assert os.path.basename(index.frames[4].path) == "man_seg004.tif"
+    assert not index.has_headers
+
+    assert index.shape == (10, 12)
+    assert index.dtype == "uint8"
+    assert index.has_headers
+
+
+def test_index_persisted_next_to_dataset(tmpdir):
+    """Index is saved beside the directory and reused while it's unchanged"""
+    gt_pth = make_gt_dir(tmpdir, [0, 1])
+    get_frame_index(gt_pth, GT_TIF_REGEX).load_headers()
+    _INDEX_CACHE.clear()
+
+    assert os.path.exists(index_path(gt_pth))
+    # the index sits beside the directory so the directory's mtime is untouched
+    assert len(os.listdir(gt_pth)) == 2
+
+    index = load_index(gt_pth, GT_TIF_REGEX, os.stat(gt_pth).st_mtime)
+    assert index is not None and index.has_headers
+    assert index.shape == (10, 12)
+
+
+def test_index_invalidated_by_new_frame(tmpdir):
+    """Adding a frame to the directory triggers a rescan"""
+    gt_pth = make_gt_dir(tmpdir, [0])
+    assert get_frame_index(gt_pth, GT_TIF_REGEX).frame_numbers == [0]
+
+    imsave(os.path.join(gt_pth, "man_seg002.tif"), np.zeros((10, 12), np.uint8))
+    # make sure the directory mtime moves even on coarse filesystem clocks
+    stat = os.stat(gt_pth)
+    os.utime(gt_pth, (stat.st_atime, stat.st_mtime + 10))
+
+    assert get_frame_index(gt_pth, GT_TIF_REGEX).frame_numbers == [0, 2]
+
+
+def test_index_rejects_mismatched_tif(tmpdir):
+    gt_pth = make_gt_dir(tmpdir, [0])
+    open(os.path.join(gt_pth, "foobar.tif"), "w").close()
+
+    assert get_frame_index(gt_pth, GT_TIF_REGEX) is None
+
+
+def test_index_memmaps_uncompressed_frames(tmpdir):
+    """Uncompressed frames are memory-mapped, compressed ones decoded"""
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    gt_labels = np.random.randint(0, 2 ** 12, size=(10, 12), dtype=np.uint16)
+    imsave(str(gt_pth.join("man_seg000.tif")), gt_labels)
+    imsave(str(gt_pth.join("man_seg001.tif")), gt_labels, compression="zlib")
+
+    index = get_frame_index(str(gt_pth), GT_TIF_REGEX)
+    index.load_headers()
+    assert index.frames[0].offset is not None
+    assert index.frames[1].offset is None
+
+    stack = FrameStack(index, 2)
+    assert isinstance(stack.get_frame(0), np.memmap)
+    assert not isinstance(stack.get_frame(1), np.memmap)
+    np.testing.assert_array_equal(stack[0], gt_labels)
+    np.testing.assert_array_equal(stack[1], gt_labels)
+
+
+@pytest.mark.parametrize("new_session", [False, True])
+def test_index_rereads_frames_rewritten_in_place(tmpdir, new_session):
+    """A rewritten frame's header is read again on request, though its directory's mtime is unchanged"""
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    frame_pth = str(gt_pth.join("man_seg000.tif"))
+    imsave(frame_pth, np.ones((10, 12), dtype=np.uint16))
+    index = get_frame_index(str(gt_pth), GT_TIF_REGEX)
+    index.load_headers()
+    assert index.frames[0].offset is not None
+    dir_mtime = os.stat(str(gt_pth)).st_mtime
+
+    rewritten = np.random.randint(0, 2 ** 12, size=(20, 12), dtype=np.uint16)
+    imsave(frame_pth, rewritten, compression="zlib")
+    stat = os.stat(frame_pth)
+    # make sure the file's mtime moves even on coarse filesystem clocks,
+    # while its directory's doesn't
+    os.utime(frame_pth, (stat.st_atime, stat.st_mtime + 10))
+    os.utime(str(gt_pth), (dir_mtime, dir_mtime))
+    if new_session:
+        _INDEX_CACHE.clear()
+
+    # files aren't checked unless we ask
+    index = get_frame_index(str(gt_pth), GT_TIF_REGEX)
+    assert index.frames[0].mtime != os.stat(frame_pth).st_mtime
+    index = get_frame_index(str(gt_pth), GT_TIF_REGEX, check_files=True)
+    assert index.shape == (20, 12) and index.frames[0].offset is None
+    np.testing.assert_array_equal(FrameStack(index, 1)[0], rewritten)
+
+
+@pytest.fixture
+def count_listed(monkeypatch):
+    """Count the directory entries listed through os.scandir"""
+    listed = []
+    scandir = os.scandir
+
+    class CountingScandir:
+        def __init__(self, path):
+            self._entries = scandir(path)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            self._entries.close()
+
+        def __iter__(self):
+            for entry in self._entries:
+                listed.append(entry.name)
+                yield entry
+
+    monkeypatch.setattr(os, "scandir", CountingScandir)
+    return listed
+
+
+def make_named_gt_dir(tmpdir, names):
+    """GT directory of empty files, as probing only looks at their names"""
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    for name in names:
+        gt_pth.join(name).write("")
+    return str(gt_pth)
+
+
+def test_probe_samples_matching_tifs(tmpdir, count_listed):
+    gt_pth = make_named_gt_dir(tmpdir, [f"man_seg{t:03}.tif" for t in range(100)])
+
+    assert probe_dir(gt_pth, GT_TIF_REGEX, sample_size=10)
+    assert len(count_listed) == 10
+    # nothing was indexed
+    assert os.path.abspath(gt_pth) not in _INDEX_CACHE
+
+
+def test_probe_stops_at_first_mismatch_and_caches_answer(tmpdir, count_listed):
+    gt_pth = make_named_gt_dir(tmpdir, ["man_seg000.tif", "foobar.tif"])
+
+    assert not probe_dir(gt_pth, GT_TIF_REGEX)
+    assert count_listed[-1] == "foobar.tif"
+    n_listed = len(count_listed)
+    # neither probing again nor indexing lists the directory again
+    assert not probe_dir(gt_pth, GT_TIF_REGEX)
+    assert get_frame_index(gt_pth, GT_TIF_REGEX) is None
+    assert len(count_listed) == n_listed
+
+    # until it changes
+    os.remove(os.path.join(gt_pth, "foobar.tif"))
+    os.utime(gt_pth, (0, 12345))
+    assert probe_dir(gt_pth, GT_TIF_REGEX)
@@ -0,0 +1,79 @@
+import dask.array as da
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from workshop_demo._label import (Connectivity, label_components,
+                                  label_components_steps)
+from workshop_demo._steps import Progress
+
+
+def assert_same_partition(labels, expected):
+    """Labels match expected up to renumbering"""
+    assert (labels > 0).tolist() == (expected > 0).tolist()
+    pairs = np.unique(np.stack([labels.ravel(), expected.ravel()]), axis=1)
+    # each label corresponds to exactly one expected label and vice versa
+    assert len(np.unique(pairs[0])) == len(np.unique(pairs[1])) == pairs.shape[1]
+
+
+@pytest.fixture
+def binary():
+    rng = np.random.default_rng(1)
+    return rng.random((6, 40, 40)) > 0.6
+
+
+def test_label_spacetime(binary):
+    labels = label_components(
+        da.from_array(binary, chunks=(2, 15, 15)), Connectivity.spacetime
+    )
+    assert isinstance(labels, da.Array) and labels.dtype == np.int32
+
+    labels = labels.compute()
+    expected, n_expected = ndimage.label(binary)
+    assert_same_partition(labels, expected)
+    # labels are consecutive from 1
+    np.testing.assert_array_equal(np.unique(labels), np.arange(n_expected + 1))
+
+
+def test_label_frame(binary):
+    labels = label_components(da.from_array(binary, chunks=(4, 15, 15)), "frame")
+    labels = labels.compute()
+
+    for t in range(len(binary)):
+        assert_same_partition(labels[t], ndimage.label(binary[t])[0])
+    # no label is reused in another frame
+    frame_labels = [set(np.unique(frame[frame > 0])) for frame in labels]
+    assert sum(map(len, frame_labels)) == len(set().union(*frame_labels))
+
+
+def test_label_frame_2d(binary):
+    """A 2D image is a single frame, connected along both axes"""
+    labels = label_components(da.from_array(binary[0], chunks=(15, 15)), "frame")
+    assert_same_partition(labels.compute(), ndimage.label(binary[0])[0])
+
+
+def test_label_steps_report_progress(binary, monkeypatch):
+    n_labelled = []
+    label = ndimage.label
+    monkeypatch.setattr(
+        ndimage,
+        "label",
+        lambda *args, **kwargs: n_labelled.append(1) or label(*args, **kwargs),
+    )
+    steps = label_components_steps(
+        da.from_array(binary, chunks=(2, 20, 20)), Connectivity.spacetime, batch_size=4
+    )
+    progress = []
+    with pytest.raises(StopIteration) as stop:
+        while True:
+            progress.append(next(steps))
+
+    # 12 blocks labelled in batches of 4, each only once
+    assert progress == [
+        Progress("Labelling blocks", 4, 12),
+        Progress("Labelling blocks", 8, 12),
+        Progress("Labelling blocks", 12, 12),
+    ]
+    assert len(n_labelled) == 12
+    monkeypatch.undo()
+    assert_same_partition(stop.value.value.compute(), ndimage.label(binary)[0])
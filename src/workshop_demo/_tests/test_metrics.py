@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from workshop_demo._metrics import (contingency_table, iter_frame_scores,
+                                    score_frame, score_sequence)
+
+
+def test_contingency_table():
+    gt = np.array([[0, 1, 1], [0, 2, 2]])
+    seg = np.array([[5, 5, 0], [0, 5, 5]])
+
+    gt_ids, seg_ids, table = contingency_table(gt, seg)
+    np.testing.assert_array_equal(gt_ids, [0, 1, 2])
+    np.testing.assert_array_equal(seg_ids, [0, 5])
+    np.testing.assert_array_equal(table, [[1, 1], [1, 1], [0, 2]])
+
+
+def test_score_frame():
+    gt = np.zeros((10, 10), dtype=np.uint16)
+    seg = np.zeros((10, 10), dtype=np.uint16)
+    # perfectly segmented
+    gt[0:2, 0:2] = 1
+    seg[0:2, 0:2] = 7
+    # covered by a segment twice its size
+    gt[5:7, 0:2] = 2
+    seg[5:7, 0:4] = 8
+    # missed
+    gt[8:10, 8:10] = 3
+    # false positive
+    seg[0:2, 8:10] = 9
+
+    frame_score = score_frame(gt, seg, frame=4)
+    assert frame_score.frame == 4
+    assert frame_score.n_gt == 3 and frame_score.n_seg == 3
+    assert frame_score.seg == pytest.approx((1 + 0.5 + 0) / 3)
+    assert (frame_score.ns, frame_score.fn, frame_score.fp) == (0, 1, 1)
+    assert frame_score.det == pytest.approx(1 - 11 / 30)
+
+
+def test_score_frame_merge():
+    """One segment covering two ground truth objects needs a split"""
+    gt = np.zeros((4, 4), dtype=np.uint8)
+    gt[:, :2] = 1
+    gt[:, 2:] = 2
+    seg = np.ones((4, 4), dtype=np.uint8)
+
+    frame_score = score_frame(gt, seg)
+    assert (frame_score.ns, frame_score.fn, frame_score.fp) == (1, 0, 0)
+    assert frame_score.seg == pytest.approx(0.5)
+
+
+def test_score_sequence_skips_frames_without_gt():
+    gt = np.zeros((4, 6, 6), dtype=np.uint8)
+    gt[[0, 2], :3] = 1
+    seg = np.zeros((4, 6, 6), dtype=np.uint8)
+    seg[0, :3] = 1
+    seg[1] = 1
+
+    sequence_score, frame_scores = score_sequence(gt, seg, max_workers=2)
+    assert [frame_score.frame for frame_score in frame_scores] == [0, 2]
+    assert sequence_score.n_frames == 2 and sequence_score.n_gt == 2
+    assert sequence_score.seg == pytest.approx(0.5)
+    assert sequence_score.det == pytest.approx(0.5)
+
+
+def test_iter_frame_scores_keeps_frames_without_gt():
+    gt = np.zeros((4, 6, 6), dtype=np.uint8)
+    gt[[0, 2], :3] = 1
+    seg = np.zeros((4, 6, 6), dtype=np.uint8)
+
+    frame_scores = iter_frame_scores(gt, seg, max_workers=2, skip_empty=False)
+    n_gt = {frame_score.frame: frame_score.n_gt for frame_score in frame_scores}
+    assert n_gt == {0: 1, 1: 0, 2: 1, 3: 0}
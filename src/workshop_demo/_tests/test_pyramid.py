@@ -0,0 +1,79 @@
+import os
+
+import dask.array as da
+import numpy as np
+import pytest
+
+from workshop_demo._cache import frame_cache
+from workshop_demo._pyramid import build_pyramid, downsample
+
+
+@pytest.fixture
+def labels():
+    labels = np.zeros((2, 8, 8), dtype=np.uint16)
+    labels[:, :4, :4] = 3
+    # only one pixel of label 7 in its window, so mode drops it
+    labels[:, 4, 4] = 7
+    labels[:, 6:, 6:] = 9
+    return da.from_array(labels, chunks=(1, 8, 8))
+
+
+def test_downsample_labels_mode(labels):
+    small = downsample(labels, "labels").compute()
+    assert small.shape == (2, 4, 4) and small.dtype == np.uint16
+    expected = np.zeros((4, 4), dtype=np.uint16)
+    expected[:2, :2] = 3
+    expected[3, 3] = 9
+    np.testing.assert_array_equal(small[1], expected)
+
+
+def test_downsample_labels_nearest(labels):
+    small = downsample(labels, "labels", label_method="nearest").compute()
+    assert small.shape == (2, 4, 4)
+    assert small[0, 2, 2] == 7
+    assert set(np.unique(small)) <= set(np.unique(labels.compute()))
+
+
+def test_downsample_image_mean():
+    image = da.from_array(np.arange(2 * 4 * 5, dtype=np.uint8).reshape(2, 4, 5))
+    small = downsample(image, "image").compute()
+    # odd sizes are trimmed
+    assert small.shape == (2, 2, 2) and small.dtype == np.uint8
+    assert small[0, 0, 0] == 3  # mean of 0, 1, 5, 6
+
+
+def test_build_pyramid_levels(labels):
+    big = da.zeros((3, 1100, 600), dtype=np.uint16, chunks=(1, 1100, 600))
+    levels = build_pyramid(big, "labels", min_size=300)
+    assert [level.shape for level in levels] == [
+        (3, 1100, 600),
+        (3, 550, 300),
+        (3, 275, 150),
+    ]
+    assert build_pyramid(labels, "labels") == [labels]
+
+
+def test_build_pyramid_persists_levels(tmpdir):
+    image = da.from_array(
+        np.random.randint(0, 100, (3, 64, 64), dtype=np.uint8), chunks=(1, 64, 64)
+    )
+    store_dir = str(tmpdir.join("pyramid"))
+    os.makedirs(os.path.join(store_dir, "stale-level"))
+
+    levels = build_pyramid(image, "image", min_size=16, store_dir=store_dir)
+    expected = np.asarray(levels[2][1])
+    # only frames that were looked at are computed, and stale levels are gone
+    level_dirs = sorted(os.listdir(store_dir))
+    assert len(level_dirs) == 2
+    for level_dir in level_dirs:
+        assert os.listdir(os.path.join(store_dir, level_dir)) == ["t001.npy"]
+
+    # a new session reads the persisted frames instead of recomputing them
+    frame_pths = [
+        os.path.join(store_dir, level_dir, "t001.npy") for level_dir in level_dirs
+    ]
+    saved = [os.stat(frame_pth).st_mtime_ns for frame_pth in frame_pths]
+    frame_cache.clear()
+    levels = build_pyramid(image, "image", min_size=16, store_dir=store_dir)
+    np.testing.assert_array_equal(np.asarray(levels[2][1]), expected)
+    assert [os.stat(frame_pth).st_mtime_ns for frame_pth in frame_pths] == saved
@@ -1,7 +1,18 @@
+import os
+from zipfile import ZIP_DEFLATED, ZipExtFile, ZipFile
+
 import numpy as np
+import pytest
 from tifffile import imsave
 
-from workshop_demo import napari_get_reader
+from workshop_demo import _archive, napari_get_reader
+from workshop_demo._archive import get_archive_index
+from workshop_demo._constants import GT_TIF_REGEX
+from workshop_demo._export import encode_frame, write_zip
+from workshop_demo._index import get_frame_index
+from workshop_demo._pyramid import pyramid_dir
+from workshop_demo._reader import (archive_reader_function, read_tifs,
+                                   reader_function)
 
 
 def test_reader_gt(tmpdir):
@@ -52,14 +63,27 @@ def test_reader_gt_w_seq(tmpdir):
 
     # make sure we're delivering the right format
     layer_data_list = reader(str(gt_pth))
-    assert isinstance(layer_data_list, list) and len(layer_data_list) == 1
-    layer_data_tuple = layer_data_list[0]
+    assert isinstance(layer_data_list, list) and len(layer_data_list) == 2
+    seq_data_tuple, layer_data_tuple = layer_data_list
     assert isinstance(layer_data_tuple, tuple) and layer_data_tuple[2] == "labels"
+    assert isinstance(seq_data_tuple, tuple) and seq_data_tuple[2] == "image"
 
     # make sure it's the same as it started
     layer_data = layer_data_tuple[0]
     assert layer_data.shape == (2, 100, 100)
     np.testing.assert_allclose(gt_labels, layer_data[1])
+    # only frame 1 has a tif, so it's the only one annotated
+    assert layer_data_tuple[1]["metadata"]["annotated_frames"] == [1]
+
+    # the raw sequence comes along with sampled contrast limits
+    seq_data = seq_data_tuple[0]
+    assert seq_data.shape == (2, 100, 100)
+    np.testing.assert_allclose(original_data, seq_data[0])
+    assert seq_data_tuple[1]["name"] == "01"
+    assert seq_data_tuple[1]["contrast_limits"] == [
+        original_data.min(),
+        original_data.max(),
+    ]
 
 
 def test_get_reader_gt_pass(tmpdir):
@@ -117,3 +141,154 @@ def test_get_reader_no_tif_fail(tmpdir):
 
     reader = napari_get_reader(seq)
     assert reader is None
+
+
+def test_read_tifs_sparse_stack(tmpdir):
+    """Long sparse GT sequences don't grow the graph per frame"""
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    gt_labels = np.random.randint(1, 20, size=(100, 100), dtype=np.uint8)
+    imsave(str(gt_pth.join("man_seg007.tif")), gt_labels)
+
+    index = get_frame_index(str(gt_pth), GT_TIF_REGEX)
+    layer_data = read_tifs(index, 5000)
+
+    assert layer_data.shape == (5000, 100, 100)
+    assert len(layer_data.dask.layers) <= 2
+    np.testing.assert_array_equal(layer_data[7], gt_labels)
+    assert not np.any(layer_data[4999].compute())
+
+
+def test_reader_multiscale(tmpdir):
+    """Large frames can be read as lazily computed, persisted pyramids"""
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    gt_labels = np.zeros((600, 40), dtype=np.uint16)
+    gt_labels[100:300, 10:30] = 5
+    imsave(str(gt_pth.join("man_seg000.tif")), gt_labels)
+
+    (layer_data_tuple,) = reader_function(str(gt_pth), multiscale="persist")
+    levels, meta, _ = layer_data_tuple
+    assert meta["multiscale"]
+    assert [level.shape for level in levels] == [(1, 600, 40), (1, 300, 20)]
+    assert set(np.unique(levels[1][0].compute())) == {0, 5}
+    assert os.listdir(pyramid_dir(str(gt_pth)))
+
+    # small frames don't need a pyramid
+    (layer_data_tuple,) = reader_function(str(gt_pth), multiscale="0")
+    assert "multiscale" not in layer_data_tuple[1]
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_reader_writer_zip(tmpdir, compression):
+    """Zips we write are read back without extracting them"""
+    labels = np.random.randint(0, 20, size=(3, 50, 40), dtype=np.uint16)
+    zip_pth = write_zip(labels, str(tmpdir.join("labels.zip")), compression=compression)
+
+    reader = napari_get_reader(zip_pth)
+    assert reader is archive_reader_function
+    ((layer_data, meta, layer_type),) = reader(zip_pth)
+    assert layer_type == "labels" and meta["name"] == "01_AUTO"
+    np.testing.assert_array_equal(layer_data.compute(), labels)
+
+    (index,) = get_archive_index(zip_pth).values()
+    index.load_headers()
+    # uncompressed tifs in stored members are memory-mapped from the archive
+    has_offsets = {info.offset is not None for info in index.frames.values()}
+    assert has_offsets == {compression is None}
+
+
+def test_reader_challenge_zip(tmpdir):
+    """Deflated challenge zips are read, ignoring members we don't need"""
+    seq_data = np.random.randint(0, 2 ** 12, size=(2, 30, 30), dtype=np.uint16)
+    gt_labels = np.random.randint(0, 20, size=(30, 30), dtype=np.uint8)
+    zip_pth = str(tmpdir.join("Fluo-Test.zip"))
+    with ZipFile(zip_pth, "w", ZIP_DEFLATED) as zip_file:
+        for t, frame in enumerate(seq_data):
+            zip_file.writestr(f"Fluo-Test/01/t00{t}.tif", encode_frame(frame, None))
+        zip_file.writestr("Fluo-Test/01_GT/SEG/man_seg001.tif", encode_frame(gt_labels))
+        zip_file.writestr("Fluo-Test/01_GT/TRA/man_track001.tif", b"not read")
+        zip_file.writestr("Fluo-Test/readme.txt", b"not read")
+
+    seq_tuple, gt_tuple = napari_get_reader(zip_pth)(zip_pth)
+    assert seq_tuple[1]["name"] == "01" and seq_tuple[2] == "image"
+    np.testing.assert_array_equal(seq_tuple[0].compute(), seq_data)
+    assert gt_tuple[1]["name"] == "01_GT" and gt_tuple[2] == "labels"
+    # ground truth is spread over its sister sequence's frames
+    assert gt_tuple[0].shape == (2, 30, 30)
+    np.testing.assert_array_equal(gt_tuple[0][1], gt_labels)
+    assert gt_tuple[1]["metadata"]["annotated_frames"] == [1]
+
+
+def test_reader_deflated_zip_reads(tmpdir, monkeypatch):
+    """Deflated members come from one open archive, their headers from their start"""
+    seq_data = np.random.randint(0, 2 ** 12, size=(4, 200, 200), dtype=np.uint16)
+    zip_pth = str(tmpdir.join("Fluo-Test.zip"))
+    with ZipFile(zip_pth, "w", ZIP_DEFLATED) as zip_file:
+        for t, frame in enumerate(seq_data):
+            zip_file.writestr(f"Fluo-Test/01/t00{t}.tif", encode_frame(frame, None))
+    (index,) = get_archive_index(zip_pth).values()
+
+    opened = []
+    read_sizes = []
+    read = ZipExtFile.read
+
+    def record_open(*args, **kwargs):
+        opened.append(args[0])
+        return ZipFile(*args, **kwargs)
+
+    def record_read(self, *args):
+        data = read(self, *args)
+        read_sizes.append(len(data))
+        return data
+
+    monkeypatch.setattr(_archive.zipfile, "ZipFile", record_open)
+    monkeypatch.setattr(ZipExtFile, "read", record_read)
+
+    index.load_headers()
+    # a frame's header is a small part of it
+    assert 0 < sum(read_sizes) < seq_data[0].nbytes
+    ((layer_data, _, _),) = archive_reader_function(zip_pth)
+    np.testing.assert_array_equal(layer_data.compute(), seq_data)
+    assert opened == [zip_pth]
+
+
+def test_reader_writer_sparse_zip(tmpdir):
+    """Empty frames aren't written, but the sequence keeps its length"""
+    labels = np.zeros((6, 20, 20), dtype=np.uint16)
+    labels[1, :5] = 3
+    labels[3, 5:] = 4
+    zip_pth = write_zip(labels, str(tmpdir.join("labels.zip")))
+    with ZipFile(zip_pth) as zip_file:
+        assert [name for name in zip_file.namelist() if name.endswith(".tif")] == [
+            "01_AUTO/SEG/seg001.tif",
+            "01_AUTO/SEG/seg003.tif",
+        ]
+
+    ((layer_data, meta, _),) = archive_reader_function(zip_pth)
+    assert meta["metadata"]["annotated_frames"] == [1, 3]
+    np.testing.assert_array_equal(layer_data.compute(), labels)
+
+
+def test_reader_extracted_sparse_zip(tmpdir):
+    """Extracted archives keep their length, even with their last frames empty"""
+    labels = np.zeros((6, 20, 20), dtype=np.uint16)
+    labels[1, :5] = 3
+    zip_pth = write_zip(labels, str(tmpdir.join("labels.zip")))
+    with ZipFile(zip_pth) as zip_file:
+        zip_file.extractall(str(tmpdir.join("extracted")))
+
+    gt_pth = str(tmpdir.join("extracted", "01_AUTO", "SEG"))
+    ((layer_data, meta, _),) = napari_get_reader(gt_pth)(gt_pth)
+    assert meta["metadata"]["annotated_frames"] == [1]
+    np.testing.assert_array_equal(layer_data.compute(), labels)
+
+
+def test_get_reader_zip_fail(tmpdir):
+    """Zips without tracking challenge frames, and files that aren't zips"""
+    zip_pth = str(tmpdir.join("other.zip"))
+    with ZipFile(zip_pth, "w") as zip_file:
+        zip_file.writestr("images/t000.tif", b"test")
+    assert napari_get_reader(zip_pth) is None
+
+    not_zip = tmpdir.join("broken.zip")
+    not_zip.write("test")
+    assert napari_get_reader(str(not_zip)) is None
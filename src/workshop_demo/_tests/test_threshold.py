@@ -0,0 +1,97 @@
+import dask.array as da
+import numpy as np
+import pytest
+from napari.layers import Image
+from skimage.measure import label
+
+from workshop_demo._threshold import (HistogramCache, Threshold,
+                                      chunked_histogram, segment,
+                                      threshold_from_histogram)
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    background = rng.normal(100, 10, size=(4, 64, 64))
+    background[:, 20:40, 20:40] += 80
+    return background
+
+
+@pytest.mark.parametrize("threshold", list(Threshold))
+def test_threshold_from_histogram(image, threshold):
+    """Histogram thresholds agree with skimage's to within a couple of bins"""
+    counts, bin_centers = chunked_histogram(da.from_array(image, chunks=(1, 32, 32)))
+    bin_width = bin_centers[1] - bin_centers[0]
+
+    expected = threshold.value(image)
+    assert threshold_from_histogram(threshold, counts, bin_centers) == pytest.approx(
+        expected, abs=2 * bin_width
+    )
+
+
+def test_segment_is_lazy_per_frame(image):
+    seg_labels = segment(da.from_array(image, chunks=(2, 64, 64)), Threshold.otsu)
+
+    assert isinstance(seg_labels, da.Array)
+    assert seg_labels.dtype == np.int32
+    assert seg_labels.chunks[0] == (1, 1, 1, 1)
+    # labels are connected within each frame, not through time
+    frame = seg_labels[2].compute()
+    np.testing.assert_array_equal(frame, label(image[2] > Threshold.otsu.value(image)))
+
+
+def test_segment_per_frame(image):
+    image[3] += 1000
+    seg_labels = segment(image, Threshold.otsu, per_frame=True).compute()
+
+    # a global threshold would leave frame 3 entirely foreground
+    assert np.count_nonzero(seg_labels[3]) < image[3].size / 2
+    assert seg_labels[3, 30, 30] != 0
+
+
+def test_integer_histogram_is_exact():
+    data = np.array([[3, 3, 5], [7, 7, 7]], dtype=np.uint16)
+    counts, bin_centers = chunked_histogram(da.from_array(data, chunks=(1, 3)))
+    np.testing.assert_array_equal(bin_centers, [3, 4, 5, 6, 7])
+    np.testing.assert_array_equal(counts, [2, 0, 1, 0, 3])
+
+    counts, bin_centers = chunked_histogram(data, nbins=2, bins="fixed")
+    np.testing.assert_array_equal(counts, [2, 4])
+
+
+@pytest.mark.parametrize(
+    "data", [np.zeros((0, 8, 8)), da.zeros((2, 0, 8), chunks=(1, 0, 8))]
+)
+def test_empty_histogram(data):
+    """Empty data has an empty histogram, and no threshold"""
+    counts, bin_centers = chunked_histogram(data)
+    assert counts.shape == bin_centers.shape == (0,)
+    with pytest.raises(ValueError, match="empty"):
+        threshold_from_histogram(Threshold.otsu, counts, bin_centers)
+
+
+def test_histogram_cache_invalidated_with_layer_data(image):
+    histograms = HistogramCache()
+    layer = Image(image)
+
+    first = histograms.histogram(layer.data, layer=layer)
+    assert histograms.histogram(layer.data, layer=layer) is first
+    # switching method reuses the histogram
+    segment(layer.data, Threshold.li, histograms=histograms, layer=layer)
+    assert len(histograms) == 1
+
+    layer.data = image + 100
+    assert len(histograms) == 0
+    second = histograms.histogram(layer.data, layer=layer)
+    assert second[1][0] == pytest.approx(first[1][0] + 100, abs=1)
+
+
+def test_segment_unique_labels(image):
+    seg_labels = segment(image, Threshold.otsu, connectivity="frame").compute()
+
+    # the square is one object in every frame, with its own label each time
+    square_labels = seg_labels[:, 30, 30]
+    assert len(set(square_labels)) == 4 and 0 not in square_labels
+
+    seg_labels = segment(image, Threshold.otsu, connectivity="spacetime").compute()
+    assert len(set(seg_labels[:, 30, 30])) == 1
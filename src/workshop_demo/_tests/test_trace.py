@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from tifffile import imsave
+
+from workshop_demo import _trace
+from workshop_demo._reader import reader_function
+
+
+@pytest.fixture
+def tracer():
+    tracer = _trace.enable()
+    yield tracer
+    _trace.disable()
+
+
+@pytest.fixture
+def gt_pth(tmpdir):
+    gt_pth = tmpdir.mkdir("01_GT").mkdir("SEG")
+    for t in range(3):
+        labels = np.full((20, 20), t + 1, dtype=np.uint8)
+        imsave(str(gt_pth.join(f"man_seg00{t}.tif")), labels, compression="zlib")
+    return str(gt_pth)
+
+
+def test_tracing_is_off_by_default():
+    assert not _trace.is_enabled()
+    with _trace.span("test.span") as span:
+        span.set(nbytes=1)
+    _trace.count("test.counter")
+    assert _trace.span("test.span") is _trace._NO_SPAN
+
+
+def test_trace_covers_reading(tracer, gt_pth):
+    ((layer_data, _, _),) = reader_function(gt_pth)
+    layer_data.compute()
+    np.asarray(layer_data[0])
+
+    span_names = {event["name"] for event in tracer.events if event["ph"] == "X"}
+    assert {"index.scan_dir", "index.read_headers", "frames.decode"} <= span_names
+    # dask tasks are traced too
+    assert any(name.startswith("dask.") for name in span_names)
+    # frames may be prefetched in the background, but each is decoded once
+    assert tracer.counters["cache.hits"] >= 1
+    assert tracer.counters["frames.decoded_bytes"] == 3 * 20 * 20
+
+
+def test_trace_export(tracer, tmp_path):
+    with _trace.span("test.span", path="here") as span:
+        span.set(nbytes=10)
+    _trace.count("test.counter", 2)
+
+    trace_pth = tmp_path / "trace.json"
+    _trace.export(str(trace_pth))
+    trace = json.loads(trace_pth.read_text())
+    span_event, counter_event = trace["traceEvents"]
+    assert span_event["ph"] == "X" and span_event["cat"] == "test"
+    assert span_event["args"] == {"path": "here", "nbytes": 10}
+    assert span_event["dur"] >= 0
+    assert counter_event["ph"] == "C" and counter_event["args"] == {"test.counter": 2}
+    assert trace["otherData"]["counters"] == {"test.counter": 2}
+
+
+def test_trace_env_writes_on_exit(tmp_path, gt_pth):
+    trace_pth = tmp_path / "trace-{pid}.json"
+    code = (
+        "from workshop_demo._reader import reader_function; "
+        f"reader_function({gt_pth!r})[0][0].compute()"
+    )
+    env = dict(os.environ, **{_trace.TRACE_ENV: str(trace_pth)})
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+    (written,) = tmp_path.glob("trace-*.json")
+    trace = json.loads(written.read_text())
+    assert any(event["name"] == "frames.decode" for event in trace["traceEvents"])
@@ -1,9 +1,14 @@
 import os
+from io import BytesIO
 from zipfile import ZipFile
 
+import dask.array as da
 import numpy as np
+from tifffile import COMPRESSION, TiffFile
 
-from workshop_demo import labels_to_zip
+from workshop_demo import _export, labels_to_zip
+from workshop_demo._export import (encode_frame, iter_frames, iter_write_zip,
+                                   write_zip)
 
 
 def test_writing_single_layer(tmpdir, qtbot):
@@ -32,3 +37,103 @@ def test_writing_returns_none(tmpdir):
 
     layer_tuple2 = (np.random.randint(0, 255, (5, 100, 100)), {}, "labels")
     assert labels_to_zip(pth, [layer_tuple2, layer_tuple2]) is None
+
+
+def test_write_zip_round_trip(tmpdir):
+    """Frames are compressed and land in the archive in order"""
+    data = np.random.randint(0, 255, (7, 20, 30)).astype(np.uint16)
+    pth = os.path.join(str(tmpdir), "test_labels.zip")
+    write_zip(data, pth, compression="zstd", max_workers=2)
+
+    assert not os.path.exists(pth + ".part")
+    with ZipFile(pth) as zip_file:
+        names = zip_file.namelist()
+        assert names == [f"01_AUTO/SEG/seg00{t}.tif" for t in range(7)] + [
+            _export.MANIFEST_NAME
+        ]
+        names.pop()
+        for t, name in enumerate(names):
+            with TiffFile(BytesIO(zip_file.read(name))) as tif:
+                assert tif.pages[0].compression == COMPRESSION.ZSTD
+                np.testing.assert_array_equal(tif.asarray(), data[t])
+
+
+def test_iter_frames_computes_chunks_once():
+    """Each multi-frame dask chunk is computed once, not once per frame"""
+    computed = []
+
+    def record_block(block):
+        computed.append(block.shape[0])
+        return block
+
+    data = da.zeros((10, 5, 5), chunks=(4, 5, 5)).map_blocks(
+        record_block, meta=np.empty((0, 0, 0))
+    )
+    frames = list(iter_frames(data))
+
+    assert len(frames) == 10
+    assert computed == [4, 4, 2]
+
+
+def test_write_zip_reuses_unchanged_frames(tmpdir, monkeypatch):
+    """Saving again only encodes the frames that changed"""
+    data = np.random.randint(0, 255, (6, 20, 30)).astype(np.uint16)
+    pth = os.path.join(str(tmpdir), "test_labels.zip")
+    write_zip(data, pth, max_workers=2)
+
+    encoded = []
+
+    def record_encode(frame, compression):
+        encoded.append(frame.copy())
+        return encode_frame(frame, compression)
+
+    opened = []
+
+    def record_open(zip_pth, *args, **kwargs):
+        opened.append(zip_pth)
+        return ZipFile(zip_pth, *args, **kwargs)
+
+    monkeypatch.setattr(_export, "encode_frame", record_encode)
+    monkeypatch.setattr(_export, "ZipFile", record_open)
+    data[4] = 1
+    write_zip(data, pth, max_workers=2)
+
+    assert len(encoded) == 1
+    # the previous archive is opened once for every frame copied from it
+    assert opened.count(pth) == 1
+    np.testing.assert_array_equal(encoded[0], data[4])
+    with ZipFile(pth) as zip_file:
+        for t in range(6):
+            tif_bytes = zip_file.read(f"01_AUTO/SEG/seg00{t}.tif")
+            with TiffFile(BytesIO(tif_bytes)) as tif:
+                np.testing.assert_array_equal(tif.asarray(), data[t])
+
+
+def test_write_zip_resumes_interrupted_export(tmpdir, monkeypatch):
+    """Frames written before an export was interrupted aren't encoded again"""
+    data = np.random.randint(0, 255, (6, 20, 30)).astype(np.uint16)
+    pth = os.path.join(str(tmpdir), "test_labels.zip")
+
+    # stop the export part way through, as a crash would
+    frames_written = iter_write_zip(data, pth, max_workers=1)
+    for _ in range(3):
+        next(frames_written)
+    frames_written.close()
+    assert not os.path.exists(pth)
+
+    encoded = []
+
+    def record_encode(frame, compression):
+        encoded.append(frame.copy())
+        return encode_frame(frame, compression)
+
+    monkeypatch.setattr(_export, "encode_frame", record_encode)
+    write_zip(data, pth, max_workers=1)
+
+    assert len(encoded) == 3
+    assert sorted(os.listdir(str(tmpdir))) == ["test_labels.zip"]
+    with ZipFile(pth) as zip_file:
+        for t in range(6):
+            tif_bytes = zip_file.read(f"01_AUTO/SEG/seg00{t}.tif")
+            with TiffFile(BytesIO(tif_bytes)) as tif:
+                np.testing.assert_array_equal(tif.asarray(), data[t])
@@ -0,0 +1,129 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dask.array as da
+import numpy as np
+import pytest
+
+from workshop_demo import _zarr, napari_get_reader
+from workshop_demo._reader import napari_get_zarr_reader
+from workshop_demo._zarr import iter_write_zarr, read_zarr, write_zarr
+
+zarr = pytest.importorskip("zarr")
+
+
+@pytest.fixture
+def labels():
+    return np.random.randint(0, 20, size=(5, 12, 10), dtype=np.uint16)
+
+
+def test_zarr_round_trip(tmp_path, labels):
+    store_pth = str(tmp_path / "labels.zarr")
+    written = list(
+        iter_write_zarr(
+            da.from_array(labels, chunks=(1, 12, 10)), store_pth, chunks=(2, 6, 10)
+        )
+    )
+    assert written == list(range(5))
+
+    data, layer_type = read_zarr(store_pth)
+    assert isinstance(data, da.Array) and layer_type == "labels"
+    assert data.chunks[:2] == ((2, 2, 1), (6, 6))
+    np.testing.assert_array_equal(data.compute(), labels)
+
+
+def test_zarr_rewrites_only_given_frames(tmp_path, labels):
+    store_pth = str(tmp_path / "labels.zarr")
+    write_zarr(labels, store_pth, chunks=(2, 12, 10))
+    # chunks written for frames we don't rewrite are left as they are
+    mtime = os.stat(os.path.join(store_pth, "c", "0", "0", "0")).st_mtime_ns
+
+    name = read_zarr(store_pth)[0].name
+    assert read_zarr(store_pth)[0].name == name
+
+    edited = labels.copy()
+    edited[3] = 0
+    assert list(iter_write_zarr(edited, store_pth, frames=[3])) == [2, 3]
+    np.testing.assert_array_equal(read_zarr(store_pth)[0].compute(), edited)
+    # rewritten data is never mistaken for what was there before
+    assert read_zarr(store_pth)[0].name != name
+    assert os.stat(os.path.join(store_pth, "c", "0", "0", "0")).st_mtime_ns == mtime
+
+    with pytest.raises(ValueError, match="rewrite"):
+        write_zarr(edited[:4], store_pth, frames=[0])
+
+
+def test_zarr_fingerprint_only_lists_the_top_level(tmp_path, labels, monkeypatch):
+    store_pth = str(tmp_path / "labels.zarr")
+    write_zarr(labels, store_pth)
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(
+        os, "scandir", lambda path: listed.append(path) or scandir(path)
+    )
+
+    assert _zarr._store_fingerprint(store_pth) == _zarr._store_fingerprint(store_pth)
+    # chunk directories are never listed, however many there are
+    assert listed == [store_pth, store_pth]
+
+
+class SlowFirstFrame:
+    """Frames whose first is only read once the last has been"""
+
+    def __init__(self, data):
+        self.data = data
+        self.shape, self.dtype = data.shape, data.dtype
+        self.last_read = threading.Event()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if index.start == 0:
+            self.last_read.wait(timeout=10)
+        elif index.stop == len(self.data):
+            self.last_read.set()
+        return self.data[index]
+
+
+def test_zarr_write_limits_slabs_in_flight(tmp_path, monkeypatch):
+    most_writing = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.futures = []
+
+        def submit(self, *args, **kwargs):
+            self.futures.append(super().submit(*args, **kwargs))
+            most_writing.append(sum(not future.done() for future in self.futures))
+            return self.futures[-1]
+
+    monkeypatch.setattr(_zarr, "ThreadPoolExecutor", RecordingExecutor)
+    data = SlowFirstFrame(np.arange(20 * 4, dtype=np.uint8).reshape(20, 2, 2))
+    store_pth = str(tmp_path / "slow.zarr")
+
+    # later slabs are written while the first is held up, but never more
+    # than twice as many as there are workers at a time
+    assert list(iter_write_zarr(data, store_pth, max_workers=2)) == list(range(20))
+    assert max(most_writing) <= 4
+    np.testing.assert_array_equal(read_zarr(store_pth)[0].compute(), data.data)
+
+
+def test_zarr_reader(tmp_path, labels):
+    store_pth = str(tmp_path / "labels.zarr")
+    write_zarr(labels, store_pth)
+    # the tracking challenge reader leaves zarr stores alone
+    assert napari_get_reader(store_pth) is None
+
+    reader = napari_get_zarr_reader(store_pth)
+    assert callable(reader)
+    ((data, meta, layer_type),) = reader(store_pth)
+    assert meta["name"] == "labels" and layer_type == "labels"
+    np.testing.assert_array_equal(data[2].compute(), labels[2])
+
+    # zarr stores written by anything else aren't ours to read
+    other_pth = str(tmp_path / "other.zarr")
+    zarr.open_array(other_pth, mode="w", shape=(2, 2), dtype=np.uint8)
+    assert napari_get_zarr_reader(other_pth) is None
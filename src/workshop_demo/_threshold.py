@@ -0,0 +1,499 @@
+"""
+This module thresholds and labels 2D+T images without loading them into
+memory. Global thresholds are computed from an intensity histogram
+accumulated chunk by chunk, and labelling runs lazily one time point at a
+time, or block by block with globally unique labels. It has no napari or
+Qt dependencies.
+"""
+import threading
+import weakref
+from enum import Enum
+from functools import partial
+
+import dask
+import dask.array as da
+import numpy as np
+
+from ._disk_cache import cache_key, get_disk_cache, is_fingerprinted
+from ._label import label_components_steps
+from ._steps import Progress, batches, run_steps
+from ._trace import span
+
+# number of histogram bins global thresholds are computed from
+DEFAULT_NBINS = 256
+# integer images spanning fewer values than this get one bin per value
+MAX_EXACT_BINS = 2 ** 16
+# float chunks are binned this much finer than the final histogram before merging
+FLOAT_OVERSAMPLING = 16
+
+
+class _SkimageThreshold:
+    """A skimage.filters threshold function, imported when it's first called
+
+    skimage.filters is slow to import, and most uses of Threshold only need
+    its names, e.g. to populate a combo box.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        from skimage import filters
+
+        return getattr(filters, self.name)(*args, **kwargs)
+
+    def __eq__(self, other):
+        return isinstance(other, _SkimageThreshold) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return f"skimage.filters.{self.name}"
+
+
+class Threshold(Enum):
+    isodata = _SkimageThreshold("threshold_isodata")
+    li = _SkimageThreshold("threshold_li")
+    otsu = _SkimageThreshold("threshold_otsu")
+    triangle = _SkimageThreshold("threshold_triangle")
+    yen = _SkimageThreshold("threshold_yen")
+
+
+def _chunk_histogram(block, nbins):
+    """Histogram of one chunk, binned so it can be merged with other chunks'.
+
+    Integer chunks get one bin per value, so merging them is exact. Float
+    chunks are binned over their own range, FLOAT_OVERSAMPLING times finer
+    than the final histogram, and rebinned when merged.
+    """
+    block = np.asarray(block).ravel()
+    if not block.size:
+        return None
+    block_min, block_max = block.min(), block.max()
+    if (
+        np.issubdtype(block.dtype, np.integer)
+        and block_max - block_min < MAX_EXACT_BINS
+    ):
+        counts = np.bincount((block.astype(np.int64) - block_min).astype(np.intp))
+        bin_centers = np.arange(block_min, block_min + len(counts), dtype=np.float64)
+        return counts, bin_centers, True
+    counts, bin_edges = np.histogram(
+        block, bins=nbins * FLOAT_OVERSAMPLING, range=(block_min, block_max)
+    )
+    return counts, (bin_edges[:-1] + bin_edges[1:]) / 2, False
+
+
+def _merge_histograms(chunk_histograms, nbins, bins):
+    """Merge chunk histograms onto one set of bins spanning every chunk
+
+    Empty data, with no chunks or only empty ones, has an empty histogram.
+    """
+    chunk_histograms = [hist for hist in chunk_histograms if hist is not None]
+    if not chunk_histograms:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    lo = min(bin_centers[0] for _, bin_centers, _ in chunk_histograms)
+    hi = max(bin_centers[-1] for _, bin_centers, _ in chunk_histograms)
+    exact = all(chunk_exact for _, _, chunk_exact in chunk_histograms)
+
+    if bins == "adaptive" and exact and hi - lo < MAX_EXACT_BINS:
+        # integers with a small enough range keep one bin per value
+        counts = np.zeros(int(hi - lo) + 1, dtype=np.int64)
+        for chunk_counts, bin_centers, _ in chunk_histograms:
+            start = int(bin_centers[0] - lo)
+            counts[start : start + len(chunk_counts)] += chunk_counts
+        return counts, np.arange(lo, hi + 1, dtype=np.float64)
+
+    all_counts = np.concatenate([counts for counts, _, _ in chunk_histograms])
+    all_centers = np.concatenate([centers for _, centers, _ in chunk_histograms])
+    counts, bin_edges = np.histogram(
+        all_centers, bins=nbins, range=(lo, hi), weights=all_counts
+    )
+    return counts.astype(np.int64), (bin_edges[:-1] + bin_edges[1:]) / 2
+
+
+def chunked_histogram_steps(
+    data, nbins=DEFAULT_NBINS, bins="adaptive", batch_size=None
+):
+    """Steps of chunked_histogram, reporting progress after each batch of chunks
+
+    Yields
+    ------
+    Progress
+        number of chunks histogrammed so far
+
+    Returns
+    -------
+    counts, bin_centers : np.ndarray
+        see chunked_histogram
+    """
+    if bins not in ("fixed", "adaptive"):
+        raise ValueError(f"bins must be 'fixed' or 'adaptive', not {bins!r}")
+    blocks = da.asarray(data).to_delayed().ravel()
+    chunk_histograms = []
+    for batch in batches(blocks, batch_size):
+        with span("threshold.histogram_chunks", n_chunks=len(batch)):
+            chunk_histograms.extend(
+                dask.compute(
+                    *[dask.delayed(_chunk_histogram)(block, nbins) for block in batch]
+                )
+            )
+        yield Progress("Computing histogram", len(chunk_histograms), len(blocks))
+    return _merge_histograms(chunk_histograms, nbins, bins)
+
+
+def chunked_histogram(data, nbins=DEFAULT_NBINS, bins="adaptive"):
+    """Intensity histogram of data, computed in parallel over its chunks.
+
+    Each chunk is histogrammed independently over its own range, and the
+    results are merged, so there's no separate pass to find the data's
+    range first.
+
+    Parameters
+    ----------
+    data : ArrayLike
+        image data, dask backed or otherwise
+    nbins : int, optional
+        number of bins, by default DEFAULT_NBINS
+    bins : str, optional
+        "fixed" for exactly nbins bins, or "adaptive" for one bin per value
+        when data is integer with fewer than MAX_EXACT_BINS values, as
+        skimage does, and nbins bins otherwise. By default "adaptive"
+
+    Returns
+    -------
+    counts : np.ndarray
+        number of pixels in each bin, empty if data is
+    bin_centers : np.ndarray
+        intensity at the center of each bin, empty if data is
+    """
+    return run_steps(chunked_histogram_steps(data, nbins, bins))
+
+
+class HistogramCache:
+    """Intensity histograms we've already computed, so changing threshold
+    method doesn't mean reading the image again.
+
+    Dask arrays are keyed by name, which changes whenever their data does,
+    and histograms of those whose name is a fingerprint of their data, see
+    is_fingerprinted, are also kept in the shared disk cache for later
+    sessions. Other arrays are keyed by identity, so histograms computed
+    for a napari layer are dropped when the layer's data is changed, and
+    histograms of arrays that have since been garbage collected are never
+    returned.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._layer_keys = {}
+        self._watched = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._histograms)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._layer_keys.clear()
+
+    def histogram(self, data, nbins=DEFAULT_NBINS, bins="adaptive", layer=None):
+        """Return the histogram of data, computing it if it isn't cached
+
+        Parameters
+        ----------
+        data : ArrayLike
+            image data, dask backed or otherwise
+        nbins : int, optional
+            number of bins, by default DEFAULT_NBINS
+        bins : str, optional
+            "fixed" or "adaptive", see chunked_histogram, by default "adaptive"
+        layer : napari.layers.Layer, optional
+            layer holding data, whose histograms are dropped when its data changes
+
+        Returns
+        -------
+        counts : np.ndarray
+            number of pixels in each bin
+        bin_centers : np.ndarray
+            intensity at the center of each bin
+        """
+        return run_steps(self.histogram_steps(data, nbins, bins, layer))
+
+    def histogram_steps(self, data, nbins=DEFAULT_NBINS, bins="adaptive", layer=None):
+        """Steps of histogram, which only report progress if it isn't cached"""
+        is_dask = isinstance(data, da.Array)
+        key = (data.name if is_dask else id(data), nbins, bins)
+        with self._lock:
+            hist, data_ref = self._histograms.get(key, (None, None))
+        # a different array may have been given the id of one we've seen before
+        if hist is not None and not is_dask and _deref(data_ref) is not data:
+            hist = None
+        if hist is None:
+            # data named any other way could have changed since it was saved
+            on_disk = is_dask and is_fingerprinted(data)
+            hist = _load_histogram(key) if on_disk else None
+            if hist is None:
+                hist = yield from chunked_histogram_steps(data, nbins, bins)
+                if on_disk:
+                    _save_histogram(key, hist)
+            with self._lock:
+                self._histograms[key] = (hist, None if is_dask else _ref(data))
+
+        if layer is not None:
+            with self._lock:
+                self._layer_keys.setdefault(id(layer), set()).add(key)
+                watch = layer not in self._watched
+                self._watched.add(layer)
+            if watch:
+                layer.events.data.connect(self._on_layer_data_change)
+        return hist
+
+    def _on_layer_data_change(self, event):
+        with self._lock:
+            for key in self._layer_keys.pop(id(event.source), ()):
+                self._histograms.pop(key, None)
+
+
+def _load_histogram(key):
+    """Histogram saved to the disk cache under key, or None"""
+    disk_cache = get_disk_cache()
+    if disk_cache is None:
+        return None
+    saved = disk_cache.get_json(cache_key("histogram", *key))
+    if saved is None:
+        return None
+    counts, bin_centers = saved
+    return np.asarray(counts), np.asarray(bin_centers)
+
+
+def _save_histogram(key, hist):
+    disk_cache = get_disk_cache()
+    if disk_cache is not None:
+        counts, bin_centers = hist
+        disk_cache.put_json(
+            cache_key("histogram", *key), [counts.tolist(), bin_centers.tolist()]
+        )
+
+
+def _ref(data):
+    try:
+        return weakref.ref(data)
+    except TypeError:
+        return None
+
+
+def _deref(data_ref):
+    return data_ref() if data_ref is not None else None
+
+
+# histograms shared by every run of the segmentation widget
+histogram_cache = HistogramCache()
+
+
+def _li_from_histogram(counts, bin_centers):
+    """Li's iterative minimum cross entropy threshold, as in skimage, on a histogram"""
+    # li needs positive intensities, so we shift and shift back at the end
+    offset = bin_centers[0]
+    values = bin_centers - offset
+    tolerance = (bin_centers[1] - bin_centers[0]) / 2 if len(bin_centers) > 1 else 0
+
+    t_next = np.average(values, weights=counts)
+    t_curr = -2 * tolerance
+    while abs(t_next - t_curr) > tolerance:
+        t_curr = t_next
+        foreground = values > t_curr
+        fore_count, back_count = counts[foreground].sum(), counts[~foreground].sum()
+        if not fore_count or not back_count:
+            break
+        mean_fore = np.average(values[foreground], weights=counts[foreground])
+        mean_back = np.average(values[~foreground], weights=counts[~foreground])
+        if mean_back == 0:
+            break
+        t_next = (mean_back - mean_fore) / (np.log(mean_back) - np.log(mean_fore))
+    return t_next + offset
+
+
+def _triangle_from_histogram(counts, bin_centers):
+    """Triangle threshold, as in skimage, on a histogram"""
+    nbins = len(counts)
+    arg_peak_height = np.argmax(counts)
+    peak_height = counts[arg_peak_height]
+    arg_low_level, arg_high_level = np.flatnonzero(counts)[[0, -1]]
+    if arg_low_level == arg_high_level:
+        # constant image
+        return bin_centers[arg_low_level]
+
+    # the triangle is drawn on the longer side of the peak
+    flip = arg_peak_height - arg_low_level < arg_high_level - arg_peak_height
+    if flip:
+        counts = counts[::-1]
+        arg_low_level = nbins - arg_high_level - 1
+        arg_peak_height = nbins - arg_peak_height - 1
+
+    width = arg_peak_height - arg_low_level
+    x1 = np.arange(width)
+    y1 = counts[x1 + arg_low_level]
+    norm = np.sqrt(peak_height ** 2 + width ** 2)
+    # distance of each bin's top from the line joining peak and lowest bin
+    length = peak_height / norm * x1 - width / norm * y1
+    arg_level = np.argmax(length) + arg_low_level
+
+    if flip:
+        arg_level = nbins - arg_level - 1
+    return bin_centers[arg_level]
+
+
+def threshold_from_histogram(threshold, counts, bin_centers):
+    """Compute a threshold from an intensity histogram instead of the image
+
+    Parameters
+    ----------
+    threshold : Threshold
+        threshold method to use
+    counts : np.ndarray
+        number of pixels in each bin
+    bin_centers : np.ndarray
+        intensity at the center of each bin
+
+    Returns
+    -------
+    float
+        threshold value
+
+    Raises
+    ------
+    ValueError
+        if the histogram is empty, as that of empty data is
+    """
+    if not len(counts):
+        raise ValueError("Can't compute a threshold of empty data")
+    if threshold is Threshold.li:
+        return _li_from_histogram(counts, bin_centers)
+    if threshold is Threshold.triangle:
+        return _triangle_from_histogram(counts, bin_centers)
+    # the remaining skimage functions take a histogram directly
+    return threshold.value(hist=(counts, bin_centers))
+
+
+def _binarise_frames(block, threshold=None, threshold_fn=None):
+    """Binarise each frame in block, by threshold or its own threshold_fn(frame)"""
+    binary = np.empty(block.shape, dtype=bool)
+    for t, frame in enumerate(block):
+        frame_threshold = threshold if threshold_fn is None else threshold_fn(frame)
+        binary[t] = frame > frame_threshold
+    return binary
+
+
+def _label_frames(block, **binarise_kwargs):
+    """Binarise and label each frame in block independently"""
+    from skimage.measure import label
+
+    with span("threshold.label_frames", n_frames=len(block)):
+        labels = np.empty(block.shape, dtype=np.int32)
+        for t, frame in enumerate(_binarise_frames(block, **binarise_kwargs)):
+            labels[t] = label(frame)
+    return labels
+
+
+def segment_steps(
+    data,
+    threshold,
+    per_frame=False,
+    connectivity=None,
+    nbins=DEFAULT_NBINS,
+    histograms=histogram_cache,
+    layer=None,
+):
+    """Steps of segment, reporting progress through the histogram and labelling passes
+
+    Yields
+    ------
+    Progress
+        progress through the current pass over the data
+
+    Returns
+    -------
+    dask.array.Array
+        see segment
+    """
+    if per_frame:
+        binarise_kwargs = {"threshold_fn": threshold.value}
+    else:
+        # histogram the data as given, so the cache key doesn't depend on rechunking
+        counts, bin_centers = yield from histograms.histogram_steps(
+            data, nbins, layer=layer
+        )
+        with span("threshold.from_histogram", method=threshold.name):
+            threshold_val = threshold_from_histogram(threshold, counts, bin_centers)
+        binarise_kwargs = {"threshold": threshold_val}
+
+    data = da.asarray(data)
+    # one frame per chunk, so each frame is thresholded on its own
+    data = data.rechunk((1,) + data.shape[1:])
+
+    if connectivity is not None:
+        binary = data.map_blocks(
+            partial(_binarise_frames, **binarise_kwargs),
+            dtype=bool,
+            meta=np.empty((0,) * data.ndim, dtype=bool),
+        )
+        return (yield from label_components_steps(binary, connectivity))
+
+    return data.map_blocks(
+        partial(_label_frames, **binarise_kwargs),
+        dtype=np.int32,
+        meta=np.empty((0,) * data.ndim, dtype=np.int32),
+    )
+
+
+def segment(
+    data,
+    threshold,
+    per_frame=False,
+    connectivity=None,
+    nbins=DEFAULT_NBINS,
+    histograms=histogram_cache,
+    layer=None,
+):
+    """Lazily threshold and label each frame of data.
+
+    A global threshold is computed from a histogram accumulated chunk by
+    chunk and cached, see HistogramCache, while per_frame thresholds are
+    computed from each frame as it's labelled.
+
+    Without a connectivity, labelling runs one time point at a time as
+    frames are requested, so peak memory stays at a few frames, and each
+    frame's labels start from 1. With a connectivity, objects are labelled
+    block by block with labels unique across the whole sequence, see
+    label_components: objects are merged across frames up front, after
+    which frames are again computed on their own as they're requested.
+
+    Parameters
+    ----------
+    data : ArrayLike
+        2D+T image data
+    threshold : Threshold
+        threshold method to use
+    per_frame : bool, optional
+        whether to threshold each frame separately, by default False
+    connectivity : Connectivity | str | None, optional
+        "frame" or "spacetime" for globally unique labels connected within
+        frames or through time, or None for lazy per-frame labels, by default None
+    nbins : int, optional
+        number of histogram bins for a global threshold, by default DEFAULT_NBINS
+    histograms : HistogramCache, optional
+        cache of histograms, by default the one shared by the widget
+    layer : napari.layers.Image, optional
+        layer holding data, so its cached histogram is dropped if its data changes
+
+    Returns
+    -------
+    dask.array.Array
+        lazy int32 labels, one chunk per frame
+    """
+    return run_steps(
+        segment_steps(
+            data, threshold, per_frame, connectivity, nbins, histograms, layer
+        )
+    )
@@ -0,0 +1,273 @@
+"""
+This module records opt-in timing spans and counters across the plugin's
+I/O and compute paths, so a slow dataset can be broken down into time
+spent scanning directories, decoding frames, scheduling dask tasks,
+labelling and so on.
+
+Tracing is off unless the WORKSHOP_DEMO_TRACE environment variable is set
+to the path to write the trace to when Python exits, or enable() is
+called. A {pid} in the path is replaced by the process id when the trace
+is written, so each process of a batch run writes its own trace, and a
+forked process starts a trace of its own rather than carrying on its
+parent's. While tracing is off, span()
+returns one shared do-nothing context manager and count() returns
+straight away, so instrumented code costs a function call. Traces are
+written in the Chrome trace event format, which chrome://tracing and
+https://ui.perfetto.dev open.
+
+This module only needs the standard library, since the reader's probe
+is instrumented too.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+# set to a path to trace the whole session and write the trace there on exit
+TRACE_ENV = "WORKSHOP_DEMO_TRACE"
+
+# the active Tracer, or None while tracing is off
+_tracer = None
+# where to write the trace on exit or flush, if anywhere, with {pid} unreplaced
+_trace_pth = None
+# the dask callback timing each task, while tracing is on
+_dask_callback = None
+
+
+class Tracer:
+    """Collects spans and counters as Chrome trace events.
+
+    Spans are complete ("X") events and every counter update is a counter
+    ("C") event holding the counter's running total. Timestamps are in
+    microseconds since the tracer was created.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._start_ns = time.perf_counter_ns()
+
+    def now(self):
+        """Microseconds since the tracer was created"""
+        return (time.perf_counter_ns() - self._start_ns) / 1000
+
+    def add_span(self, name, start, end, args=None):
+        """Record a span of name from start to end, in microseconds"""
+        event = {
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            "ts": start,
+            "dur": end - start,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        # appending to a list is atomic, so spans don't need the lock
+        self.events.append(event)
+
+    def count(self, name, value=1):
+        """Add value to the counter name"""
+        with self._lock:
+            total = self.counters[name] = self.counters.get(name, 0) + value
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": name.split(".")[0],
+                    "ph": "C",
+                    "ts": self.now(),
+                    "pid": self._pid,
+                    "args": {name: total},
+                }
+            )
+
+    def to_dict(self):
+        """The trace as a Chrome trace JSON object, with counter totals"""
+        with self._lock:
+            return {
+                "traceEvents": list(self.events),
+                "displayTimeUnit": "ms",
+                "otherData": {"counters": dict(self.counters)},
+            }
+
+    def export(self, trace_pth):
+        """Write the trace to trace_pth, replacing any trace already there"""
+        part_pth = f"{trace_pth}.{os.getpid()}.part"
+        with open(part_pth, "w") as trace_file:
+            json.dump(self.to_dict(), trace_file)
+        os.replace(part_pth, trace_pth)
+
+
+class _Span:
+    """Times its with block, see span"""
+
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.tracer.now()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add_span(self.name, self.start, self.tracer.now(), self.args)
+
+    def set(self, **args):
+        """Attach more arguments, e.g. sizes only known once the work is done"""
+        self.args.update(args)
+
+
+class _NoSpan:
+    """What span returns while tracing is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def set(self, **args):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Time a with block as a span called name, if tracing is on.
+
+    Names are dotted, with the part before the first dot as the span's
+    category, e.g. "index.scan_dir".
+
+    Parameters
+    ----------
+    name : str
+        name of the span
+    **args
+        arguments shown with the span, e.g. the path being read
+
+    Returns
+    -------
+    ContextManager
+        context manager whose set(**args) attaches more arguments
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NO_SPAN
+    return _Span(tracer, name, args)
+
+
+def count(name, value=1):
+    """Add value to the counter called name, if tracing is on"""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, value)
+
+
+def is_enabled():
+    """Whether tracing is on"""
+    return _tracer is not None
+
+
+def enable(trace_pth=None):
+    """Start tracing, if we aren't already.
+
+    Every dask task computed while tracing is also recorded, as a span
+    named after the task's key, e.g. "dask.from-array".
+
+    Parameters
+    ----------
+    trace_pth : str, optional
+        path to write the trace to when Python exits or on flush, with
+        any {pid} replaced by the process id, by default the trace is only
+        written by export
+
+    Returns
+    -------
+    Tracer
+        the active tracer
+    """
+    global _tracer, _trace_pth
+    if _tracer is None:
+        _tracer = Tracer()
+        _register_dask_callback(_tracer)
+    if trace_pth is not None:
+        if _trace_pth is None:
+            atexit.register(flush)
+        _trace_pth = trace_pth
+    return _tracer
+
+
+def disable():
+    """Stop tracing, returning the tracer that was active, if any"""
+    global _tracer, _dask_callback
+    tracer, _tracer = _tracer, None
+    if _dask_callback is not None:
+        _dask_callback.unregister()
+        _dask_callback = None
+    return tracer
+
+
+def export(trace_pth):
+    """Write the trace so far to trace_pth, if tracing is on"""
+    if _tracer is not None:
+        _tracer.export(trace_pth)
+
+
+def flush():
+    """Write the trace so far to the path given to enable, if there was one.
+
+    This happens on exit anyway, but worker processes of a pool exit
+    without running exit handlers, so they flush after each task.
+    """
+    if _trace_pth is not None:
+        export(_trace_pth.replace("{pid}", str(os.getpid())))
+
+
+def _restart_after_fork():
+    """Give a forked process a trace of its own, e.g. a worker of a process pool"""
+    if _tracer is not None:
+        disable()
+        enable()
+
+
+def _register_dask_callback(tracer):
+    """Record a span for every dask task, if dask is installed"""
+    global _dask_callback
+    # tracing is opt-in, so importing dask here doesn't slow the reader probe
+    try:
+        from dask.callbacks import Callback
+        from dask.utils import key_split
+    except ImportError:  # pragma: no cover
+        return
+
+    class TaskSpans(Callback):
+        def __init__(self):
+            super().__init__()
+            self._starts = {}
+
+        def _pretask(self, key, dsk, state):
+            self._starts[key] = tracer.now()
+
+        def _posttask(self, key, result, dsk, state, worker_id):
+            start = self._starts.pop(key, None)
+            if start is not None:
+                tracer.add_span(f"dask.{key_split(key)}", start, tracer.now())
+
+    _dask_callback = TaskSpans()
+    _dask_callback.register()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV])
@@ -4,41 +4,40 @@ a 2D+T sequence to a zipped file of T tiff files in a directory
 structure similar to that of tracking challenge data.
 """
 
-import os
-from shutil import make_archive, rmtree
 from typing import List
 
-from napari.qt import thread_worker
-from tifffile import imsave
+from ._export import DEFAULT_COMPRESSION, iter_write_zip
 
 
-@thread_worker(
-    # give us an indeterminate progress bar
-    progress=True
-)
-def write_tiffs(data, dir_pth):
-    """Given 2D+T data array, write each slice to individual tif.
+def write_tiffs(data, zip_pth, compression=DEFAULT_COMPRESSION):
+    """Given 2D+T data array, write each slice to a tif in a zip archive.
 
-    This operation is threaded.
+    This is run in a napari thread worker, and frames are encoded in
+    parallel. Each frame written is yielded, advancing the worker's
+    progress bar.
 
     Parameters
     ----------
     data : ArrayLike
         2D+T data to write to files
-    dir_pth : str
-        path to existing folder to hold tiffs
+    zip_pth : str
+        path of zip archive to write
+    compression : str | None, optional
+        tiff compression codec, by default DEFAULT_COMPRESSION
     """
-    for i, t_slice in enumerate(data):
-        tiff_nme = f"seg{str(i).zfill(3)}.tif"
-        tiff_pth = os.path.join(dir_pth, tiff_nme)
-        imsave(tiff_pth, t_slice)
+    yield from iter_write_zip(data, zip_pth, compression=compression)
 
 
 # our manifest writer command points to this function.
 def labels_to_zip(
-    path: str, layer_data_tuples: List["napari.types.LayerDataTuple"]
+    path: str,
+    layer_data_tuples: List["napari.types.LayerDataTuple"],
+    compression=DEFAULT_COMPRESSION,
 ) -> List[str]:
-    """Save all 2D+T labels layers folder of individual 2D tiffs and zip.
+    """Save all 2D+T labels layers as individual 2D tiffs in a zip.
+
+    Encoded tiffs are streamed straight into the archive, so nothing is
+    written to disk twice.
 
     Parameters
     ----------
@@ -46,6 +45,8 @@ def labels_to_zip(
         path to save layers to
     layer_data_tuples : List[napari.types.LayerDataTuple]
         list of (data, meta, layer_type) layer tuples to save
+    compression : str | None, optional
+        tiff compression codec, by default DEFAULT_COMPRESSION
 
     Returns
     -------
@@ -53,38 +54,106 @@ def labels_to_zip(
         path to save to or None if layers can't be saved
     """
 
-    # strip file extension so we can make directory
-    if str(path).endswith(".zip"):
-        path = str(path)[:-4]
+    # make sure we're writing a zip file
+    path = str(path)
+    if not path.endswith(".zip"):
+        path += ".zip"
+
+    data = _labels_to_write(layer_data_tuples)
+    if data is None:
+        return None
+
+    _start_writing(write_tiffs, data, path, compression)
+    # returning path even though worker may not be finished - cheeky...
+    return path
+
+
+def write_zarr_frames(data, store_pth, chunks=None):
+    """Given 2D+T data array, write it to a chunked, compressed Zarr store.
+
+    This is run in a napari thread worker, and slabs of frames are written
+    in parallel. Each frame written is yielded, advancing the worker's
+    progress bar.
+
+    Parameters
+    ----------
+    data : ArrayLike
+        2D+T data to write
+    store_pth : str
+        path of the Zarr store to write
+    chunks : Tuple[int, ...], optional
+        chunk shape, by default one frame per chunk
+    """
+    from ._zarr import iter_write_zarr
+
+    yield from iter_write_zarr(data, store_pth, chunks=chunks)
+
 
+# our manifest zarr writer command points to this function.
+def labels_to_zarr(
+    path: str,
+    layer_data_tuples: List["napari.types.LayerDataTuple"],
+    chunks=None,
+) -> List[str]:
+    """Save a 2D+T labels layer to a chunked, compressed Zarr store.
+
+    Any frame of the store can be read or rewritten without touching the
+    rest, which makes it a better working format than a zip of tiffs.
+
+    Parameters
+    ----------
+    path : str
+        path to save layers to
+    layer_data_tuples : List[napari.types.LayerDataTuple]
+        list of (data, meta, layer_type) layer tuples to save
+    chunks : Tuple[int, ...], optional
+        chunk shape, by default one frame per chunk
+
+    Returns
+    -------
+    List[str] | None
+        path to save to or None if layers can't be saved
+    """
+    path = str(path)
+    if not path.endswith(".zarr"):
+        path += ".zarr"
+
+    data = _labels_to_write(layer_data_tuples)
+    if data is None:
+        return None
+
+    _start_writing(write_zarr_frames, data, path, chunks)
+    return path
+
+
+def _labels_to_write(layer_data_tuples):
+    """Data of the one 2D+T labels layer in layer_data_tuples, else None"""
     layers_to_write = list(filter(lambda lyr: lyr[2] == "labels", layer_data_tuples))
     # we're only writing one layer
     if not len(layers_to_write) == 1:
         return None
 
+    data, meta, _ = layers_to_write[0]
+    # multiscale layers are written at full resolution
+    if meta.get("multiscale"):
+        data = data[0]
     # we need layer's data to be 3D
-    layer = layers_to_write[0]
-    if not layer[0].ndim == 3:
+    if not data.ndim == 3:
         return None
+    return data
 
-    # we will use this function to zip up the folder once all tiffs are written
-    def zip_dir():
-        """Make zip file from directory at path"""
-        make_archive(path, "zip", path)
-        # clean up directory after ourselves
-        rmtree(path)
-
-    os.mkdir(path)
-    data, _, _ = layers_to_write[0]
-    # use correct folder structure so that our reader can read it
-    layer_dir_pth = os.path.join(path, f"01_AUTO/SEG")
-    os.makedirs(layer_dir_pth)
-    if len(data.shape) == 2:
-        data = [data]
-    worker = write_tiffs(data, layer_dir_pth)
-    worker.start()
-    # once this worker is done we zip up the folder
-    worker.finished.connect(zip_dir)
 
-    # returning path even though worker may not be finished - cheeky...
-    return path + ".zip"
+def _start_writing(write_frames, data, path, *args):
+    """Start a thread worker running write_frames, with a progress bar"""
+    # napari.qt is only imported once we're actually writing
+    from napari.qt import thread_worker
+
+    # the total number of frames is given when we call the worker
+    worker = thread_worker(write_frames, progress=True)(
+        data,
+        path,
+        *args,
+        _progress={"total": len(data), "desc": "Writing labels"},
+    )
+    worker.start()
+    return worker
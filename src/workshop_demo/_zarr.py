@@ -0,0 +1,228 @@
+"""
+This module writes 2D+T layers to chunked, compressed Zarr arrays and reads
+them back lazily. Unlike the zip of tiffs, a Zarr store supports random
+access to any chunk and rewriting some frames in place, so it suits
+working copies. It has no napari or Qt dependencies.
+
+zarr is an optional dependency, installed with the plugin's zarr extra,
+and is only imported when a store is written or read.
+"""
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from ._disk_cache import fingerprinted
+from ._trace import span
+
+# chunks span one frame and tiles of at most this size along each frame axis
+DEFAULT_ZARR_TILE = 1024
+# key of the attributes we store with each array
+ZARR_ATTRS_KEY = "workshop_demo"
+ZARR_ATTRS_VERSION = 1
+# metadata files of zarr v3 and v2 arrays
+ZARR_METADATA_NAMES = ("zarr.json", ".zarray", ".zattrs")
+
+
+def _import_zarr():
+    try:
+        import zarr
+    except ImportError as error:
+        raise ImportError(
+            "Writing and reading Zarr stores needs zarr, install it with "
+            "`pip install workshop-demo[zarr]`"
+        ) from error
+    return zarr
+
+
+def default_chunks(shape):
+    """One frame per chunk, tiled into DEFAULT_ZARR_TILE squares for large frames"""
+    return (1,) + tuple(min(size, DEFAULT_ZARR_TILE) for size in shape[1:])
+
+
+def read_zarr_attrs(store_pth):
+    """Our attributes of the Zarr array at store_pth, or None if it isn't ours.
+
+    Only the store's metadata file is read, so this is cheap enough for
+    napari's reader probe and doesn't import zarr.
+    """
+    for metadata_name in ("zarr.json", ".zattrs"):
+        try:
+            with open(os.path.join(store_pth, metadata_name)) as metadata_file:
+                metadata = json.load(metadata_file)
+        except (OSError, ValueError):
+            continue
+        # zarr v3 keeps attributes in zarr.json, v2 in their own .zattrs
+        attrs = (
+            metadata.get("attributes", {}) if metadata_name == "zarr.json" else metadata
+        )
+        if isinstance(attrs, dict) and ZARR_ATTRS_KEY in attrs:
+            return attrs[ZARR_ATTRS_KEY]
+    return None
+
+
+def iter_write_zarr(
+    data,
+    store_pth,
+    chunks=None,
+    max_workers=None,
+    frames=None,
+    layer_type="labels",
+):
+    """Write data to a chunked, compressed Zarr array, slabs of frames in parallel.
+
+    Frames are written a slab of chunks along time at a time, on a thread
+    pool, with at most twice as many slabs in flight as there are workers.
+    Given frames, only the slabs holding those frames are rewritten in an
+    existing store, leaving the rest of it untouched, and the rewrite is
+    counted in the store's attributes so read_zarr names it afresh.
+
+    This is a generator, yielding the index of each frame once it and
+    every frame before it have been written, so callers can report progress.
+
+    Parameters
+    ----------
+    data : ArrayLike
+        2D+T data to write
+    store_pth : str
+        path of the Zarr store to write
+    chunks : Tuple[int, ...], optional
+        chunk shape, by default one frame per chunk, see default_chunks
+    max_workers : int, optional
+        number of writing threads, by default one per core
+    frames : Iterable[int], optional
+        frames to rewrite in an existing store, by default the whole store
+        is created afresh
+    layer_type : str, optional
+        napari layer type stored with the array, by default "labels"
+
+    Yields
+    ------
+    int
+        index of each frame written
+    """
+    zarr = _import_zarr()
+    max_workers = max_workers or os.cpu_count() or 1
+    if frames is None:
+        zarr_array = zarr.open_array(
+            store_pth,
+            mode="w",
+            shape=data.shape,
+            chunks=chunks or default_chunks(data.shape),
+            dtype=data.dtype,
+        )
+        zarr_array.attrs[ZARR_ATTRS_KEY] = {
+            "version": ZARR_ATTRS_VERSION,
+            "layer_type": layer_type,
+        }
+    else:
+        zarr_array = zarr.open_array(store_pth, mode="r+")
+        if zarr_array.shape != data.shape or zarr_array.dtype != data.dtype:
+            raise ValueError(
+                f"Can't rewrite frames of {store_pth}: it holds "
+                f"{zarr_array.dtype} data of shape {zarr_array.shape}, not "
+                f"{data.dtype} data of shape {data.shape}"
+            )
+
+    # slabs line up with chunks along time, so no chunk is written twice
+    slab_size = zarr_array.chunks[0]
+    slab_starts = range(0, len(data), slab_size)
+    if frames is not None:
+        slab_starts = sorted({t - t % slab_size for t in frames})
+
+    def write_slab(start):
+        stop = min(start + slab_size, len(data))
+        with span("zarr.write_slab", start=start, stop=stop):
+            zarr_array[start:stop] = np.asarray(data[start:stop])
+        return range(start, stop)
+
+    try:
+        with ThreadPoolExecutor(max_workers) as pool:
+            # slabs not yet reported, in order, and those of them still being written
+            in_flight = []
+            writing = set()
+            for start in slab_starts:
+                future = pool.submit(write_slab, start)
+                in_flight.append(future)
+                writing.add(future)
+                if len(writing) >= 2 * max_workers:
+                    _, writing = wait(writing, return_when=FIRST_COMPLETED)
+                # report slabs in order as soon as they're written
+                while in_flight and in_flight[0].done():
+                    yield from in_flight.pop(0).result()
+            for future in in_flight:
+                yield from future.result()
+    finally:
+        if frames is not None:
+            # rewriting chunks leaves the store's metadata as it was, and the
+            # metadata is all _store_fingerprint reads, so we count rewrites in it
+            attrs = dict(zarr_array.attrs.get(ZARR_ATTRS_KEY, {}))
+            attrs["rewrites"] = attrs.get("rewrites", 0) + 1
+            zarr_array.attrs[ZARR_ATTRS_KEY] = attrs
+
+
+def write_zarr(data, store_pth, **kwargs):
+    """Write data to a Zarr store in one go, see iter_write_zarr"""
+    for _ in iter_write_zarr(data, store_pth, **kwargs):
+        pass
+
+
+def _store_fingerprint(store_pth):
+    """Metadata of the store at store_pth, and the mtimes of its directories
+
+    Only the store's top level is listed, and only its metadata files are
+    read, so this costs the same however many chunks the store has. Frames
+    rewritten by iter_write_zarr change the metadata. Chunks created or
+    moved into place by anything else change the mtime of the directory
+    holding them, which is seen if that's the store or one of its top-level
+    directories, but chunks other tools overwrite in place deeper down
+    aren't.
+    """
+    fingerprint = []
+    try:
+        entries = sorted(os.scandir(store_pth), key=lambda entry: entry.name)
+        fingerprint.append(os.stat(store_pth).st_mtime_ns)
+    except OSError:
+        return fingerprint
+    for entry in entries:
+        try:
+            if entry.name in ZARR_METADATA_NAMES:
+                with open(entry.path, "rb") as metadata_file:
+                    fingerprint.append((entry.name, metadata_file.read()))
+            elif entry.is_dir():
+                fingerprint.append((entry.name, entry.stat().st_mtime_ns))
+        except OSError:
+            continue
+    return fingerprint
+
+
+def read_zarr(store_pth):
+    """Lazily read the Zarr array at store_pth
+
+    The dask array is named after the store's metadata and directories,
+    see _store_fingerprint, so results cached by name, in memory or on
+    disk, are never served for a store whose frames iter_write_zarr has
+    since rewritten.
+
+    Parameters
+    ----------
+    store_pth : str
+        path of a Zarr store written by iter_write_zarr
+
+    Returns
+    -------
+    data : dask.array.Array
+        data chunked like the store
+    layer_type : str
+        napari layer type the data was written from
+    """
+    import dask.array as da
+    from dask.base import tokenize
+
+    zarr = _import_zarr()
+    zarr_array = zarr.open_array(store_pth, mode="r")
+    attrs = zarr_array.attrs.get(ZARR_ATTRS_KEY, {})
+    name = "zarr-" + tokenize(os.path.abspath(store_pth), _store_fingerprint(store_pth))
+    data = fingerprinted(da.from_zarr(zarr_array, name=name))
+    return data, attrs.get("layer_type", "labels")